@@ -0,0 +1,162 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable
+
+import docker
+
+import containers
+import metrics
+import state
+
+logger = logging.getLogger(__name__)
+
+# Activity-based idle detection. When set, a session whose container has
+# been probed is idle ACTIVITY_IDLE_MINUTES after its last sign of use
+# (an /access, or activity seen by the sampler) instead of
+# IDLE_TIMEOUT_HOURS after its last /access. 0 = off (last /access only).
+ACTIVITY_IDLE_MINUTES = int(os.environ.get("ACTIVITY_IDLE_MINUTES", "0"))
+
+# What counts as activity:
+#   traffic      the container sent/received at least ACTIVITY_MIN_BYTES since
+#                the previous sample (one-shot stats network counters; the
+#                browser's own traffic also counts)
+#   connections  a viewer holds an established TCP connection to the noVNC
+#                port (one exec reading /proc/net/tcp per container; exact, but
+#                an exec costs far more than a stats call)
+ACTIVITY_SIGNAL = os.environ.get("ACTIVITY_SIGNAL", "traffic")
+ACTIVITY_SIGNALS = ("traffic", "connections")
+
+# Seconds between two probes of every session container
+ACTIVITY_SAMPLE_SECONDS = int(os.environ.get("ACTIVITY_SAMPLE_SECONDS", "60"))
+
+# Probes made at the same time during one sample
+ACTIVITY_SAMPLE_CONCURRENCY = int(os.environ.get("ACTIVITY_SAMPLE_CONCURRENCY", "8"))
+
+# ACTIVITY_SIGNAL=traffic: bytes per sample interval below which a session is quiet
+ACTIVITY_MIN_BYTES = int(os.environ.get("ACTIVITY_MIN_BYTES", "4096"))
+
+_lock = threading.Lock()
+_thread: threading.Thread | None = None
+_listeners: list[Callable[[str], None]] = []
+
+# client_id -> {"container_id", "last_active" (ISO or None), "bytes" (traffic counter)}
+# for every session probed successfully at least once
+_sessions: dict[str, dict] = {}
+
+
+def enabled() -> bool:
+    return ACTIVITY_IDLE_MINUTES > 0
+
+
+def subscribe(callback: Callable[[str], None]) -> None:
+    """Register callback(client_id), called when a session's activity information changes."""
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+
+def start() -> None:
+    """Start the sampler thread (no-op if running or disabled). Run it in the leader only."""
+    global _thread
+    if not enabled():
+        return
+    if ACTIVITY_SIGNAL not in ACTIVITY_SIGNALS:
+        raise ValueError(f"Unknown ACTIVITY_SIGNAL: {ACTIVITY_SIGNAL!r} (expected one of {ACTIVITY_SIGNALS})")
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=_run, name="activity-sampler", daemon=True)
+        _thread.start()
+    logger.info("[ACTIVITY] Probing sessions every %ds (signal=%s, idle after %d min)",
+                ACTIVITY_SAMPLE_SECONDS, ACTIVITY_SIGNAL, ACTIVITY_IDLE_MINUTES)
+
+
+def last_active(client_id: str) -> str | None:
+    """When activity was last seen for client_id's session (ISO), or None."""
+    with _lock:
+        session = _sessions.get(client_id)
+        return session["last_active"] if session else None
+
+
+def is_tracked(client_id: str) -> bool:
+    """True once client_id's container has been probed successfully (its idle time is activity based)."""
+    with _lock:
+        return client_id in _sessions
+
+
+# ---------------------------------------------------------------------------
+# Sampling
+# ---------------------------------------------------------------------------
+
+def _run() -> None:
+    executor = ThreadPoolExecutor(max_workers=ACTIVITY_SAMPLE_CONCURRENCY, thread_name_prefix="activity-probe")
+    while True:
+        try:
+            _sample(executor)
+        except Exception as e:
+            logger.exception("[ACTIVITY] Sample failed: %s", e)
+        time.sleep(ACTIVITY_SAMPLE_SECONDS)
+
+
+def _sample(executor: ThreadPoolExecutor) -> None:
+    """Probe every client session once and record which ones are in use."""
+    t0 = time.monotonic()
+    records = [rec for rec in state.load_records() if rec["client_id"] != "__pool__"]
+    probes = list(executor.map(_probe, records))
+    now = datetime.now().isoformat()
+
+    changed = []
+    active = 0
+    with _lock:
+        live = {rec["client_id"] for rec in records}
+        for client_id in [cid for cid in _sessions if cid not in live]:
+            del _sessions[client_id]
+        for rec, reading in zip(records, probes):
+            if reading is None:
+                continue
+            session = _sessions.get(rec["client_id"])
+            if session is None or session["container_id"] != rec["container_id"]:
+                # First successful probe: the session switches to activity-based idling
+                session = _sessions[rec["client_id"]] = {
+                    "container_id": rec["container_id"], "last_active": None, "bytes": None,
+                }
+                changed.append(rec["client_id"])
+            if _is_active(session, reading):
+                session["last_active"] = now
+                active += 1
+                if rec["client_id"] not in changed:
+                    changed.append(rec["client_id"])
+
+    metrics.SESSIONS_ACTIVE.set(active)
+    logger.info("[ACTIVITY] Sampled %d sessions: %d active, %d probes failed (%.2fs)",
+                len(records), active, probes.count(None), time.monotonic() - t0)
+    for client_id in changed:
+        for callback in _listeners:
+            try:
+                callback(client_id)
+            except Exception:
+                logger.exception("[ACTIVITY] Listener %s failed", getattr(callback, "__name__", callback))
+
+
+def _probe(rec: dict) -> int | None:
+    """Connection count or traffic counter of a session's container, None if it could not be read."""
+    try:
+        if ACTIVITY_SIGNAL == "traffic":
+            return containers.network_bytes(rec["container_id"])
+        return containers.count_vnc_connections(rec["container_id"])
+    except (docker.errors.APIError, docker.errors.DockerException, OSError) as e:
+        logger.debug("[ACTIVITY] Could not probe CPF=%s container=%s: %s",
+                     rec["client_id"], rec["container_id"][:12], e)
+        return None
+
+
+def _is_active(session: dict, reading: int) -> bool:
+    """Must be called with _lock held."""
+    if ACTIVITY_SIGNAL != "traffic":
+        return reading > 0
+    previous, session["bytes"] = session["bytes"], reading
+    # The first counter reading is only a baseline
+    return previous is not None and reading - previous >= ACTIVITY_MIN_BYTES
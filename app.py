@@ -4,28 +4,60 @@ load_dotenv()
 import logging
 import os
 
-from flask import Flask
+from flask import Flask, g, request
 
+import logging_setup
+import tracing
 from routes import bp as routes_bp
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-)
+logging_setup.configure()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.register_blueprint(routes_bp)
 
+# Probes and scrapes are not traced: they would push the requests worth
+# looking at out of the trace buffer
+_UNTRACED_PATHS = {"/health", "/metrics", "/debug/traces"}
+
+
+@app.before_request
+def _bind_request_id():
+    # Correlation id of every log line written while serving this request
+    rid = logging_setup.new_request_id(request.headers.get("X-Request-ID"))
+    g.request_id_token = logging_setup.request_id.set(rid)
+    if tracing.TRACING and request.path not in _UNTRACED_PATHS:
+        g.trace_scope = tracing.trace(f"{request.method} {request.path}").__enter__()
+
+
+@app.after_request
+def _send_request_id(response):
+    response.headers["X-Request-ID"] = logging_setup.request_id.get()
+    return response
+
+
+@app.teardown_request
+def _unbind_request_id(exc):
+    scope = g.pop("trace_scope", None)
+    if scope is not None:
+        scope.__exit__(type(exc) if exc else None, exc, None)
+    token = g.pop("request_id_token", None)
+    if token is not None:
+        logging_setup.request_id.reset(token)
+
 
 if __name__ == "__main__":
     from services import reconcile_on_startup
+    import proxy
+    import resource_monitor
     import scheduler
     import warm_pool
 
     reconcile_on_startup()
     scheduler.start_scheduler()
-    warm_pool.replenish_pool()
+    resource_monitor.start()
+    warm_pool.start_pool_manager()
+    proxy.start()
 
     port = int(os.environ.get("ORCHESTRATOR_PORT", 8080))
     logger.info("========== ORCHESTRATOR RUNNING on port %d ==========", port)
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import os
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+from app import app as flask_app
+from routes import waiting_page
+import containers
+import docker_async
+import logging_setup
+import proxy
+import resource_monitor
+import scheduler
+import services
+import state
+import tracing
+import warm_pool
+
+logger = logging.getLogger(__name__)
+
+# ASGI entry point (uvicorn asgi:app). /access is served natively on the event
+# loop, so cold starts await the async Docker client instead of holding a
+# thread for up to 60s, and so is the /access/events progress stream of
+# ACCESS_MODE=background; every other route is the regular Flask app, run in
+# a thread pool.
+
+# Threads available to the Flask routes other than /access
+ASGI_WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", "8"))
+
+# Seconds between two progress events of /access/events while a job runs
+ACCESS_EVENTS_INTERVAL_SECONDS = 5
+
+_wsgi = WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+    elif scope["type"] == "http" and scope["path"] == "/access":
+        send = _bind_request_id(scope, send)
+        with tracing.trace("GET /access"):
+            await _access(scope, send)
+    elif scope["type"] == "http" and scope["path"] == "/access/events":
+        await _access_events(scope, _bind_request_id(scope, send))
+    else:
+        await _wsgi(scope, receive, send)
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # With several workers only one of them runs the background jobs
+            if state.try_become_leader():
+                await asyncio.to_thread(services.reconcile_on_startup)
+                scheduler.start_scheduler()
+                resource_monitor.start()
+                warm_pool.start_pool_manager()
+                proxy.start()
+            else:
+                services.check_single_worker(leader=False)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await docker_async.close_clients()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def _bind_request_id(scope, send):
+    """Set the correlation id of a natively served request and echo it as X-Request-ID.
+
+    Each ASGI request runs in its own task (and context), so nothing has to be reset.
+    """
+    incoming = dict(scope.get("headers") or []).get(b"x-request-id", b"").decode("latin1")
+    rid = logging_setup.new_request_id(incoming)
+    logging_setup.request_id.set(rid)
+
+    async def send_with_id(message):
+        if message["type"] == "http.response.start":
+            message = {**message, "headers": [*message.get("headers", []), (b"x-request-id", rid.encode("latin1"))]}
+        await send(message)
+    return send_with_id
+
+
+def _client_id(scope) -> str:
+    params = parse_qs(scope.get("query_string", b"").decode("latin1"))
+    return params.get("id", [""])[0].strip()
+
+
+async def _access(scope, send) -> None:
+    """Async twin of routes.access()."""
+    client_id = _client_id(scope)
+
+    if not client_id:
+        logger.warning("[ACCESS] Request with missing 'id' parameter")
+        await _json(send, 400, {"error": "Missing required parameter: id"})
+        return
+
+    try:
+        if services.ACCESS_MODE == "background":
+            result = await services.start_access_async(client_id)
+        else:
+            result = await services.get_or_create_access_async(client_id)
+    except ValueError as e:
+        await _json(send, 503, {
+            "error": str(e),
+            "max_slots": containers.total_slots(),
+        })
+        return
+    except RuntimeError as e:
+        await _json(send, 500, {"error": str(e)})
+        return
+
+    if result["action"] == "pending":
+        body = waiting_page(client_id, events=True).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 202,
+            "headers": [(b"content-type", b"text/html; charset=utf-8"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+        return
+
+    await send({
+        "type": "http.response.start",
+        "status": 302,
+        "headers": [(b"location", result["url"].encode()), (b"content-length", b"0")],
+    })
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _access_events(scope, send) -> None:
+    """Server-sent events with the progress of a background provisioning.
+
+    Sends a "status" event (services.access_status()) now, every
+    ACCESS_EVENTS_INTERVAL_SECONDS while pending, and as soon as the job
+    finishes; the stream ends after the first status that is not pending.
+    Waiting costs no thread: the job wakes this coroutine when it lands.
+    """
+    client_id = _client_id(scope)
+    if not client_id:
+        await _json(send, 400, {"error": "Missing required parameter: id"})
+        return
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+    })
+    status = await asyncio.to_thread(services.access_status, client_id)
+    while True:
+        await send({
+            "type": "http.response.body",
+            "body": f"event: status\ndata: {json.dumps(status)}\n\n".encode(),
+            "more_body": status["status"] == "pending",
+        })
+        if status["status"] != "pending":
+            return
+        status = await services.wait_access_status(client_id, ACCESS_EVENTS_INTERVAL_SECONDS)
+
+
+async def _json(send, status: int, payload: dict) -> None:
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
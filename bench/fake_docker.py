@@ -0,0 +1,414 @@
+"""Stand-in for the Docker Engine API, for load tests without Docker.
+
+Serves the subset of the API the orchestrator uses (containers create/
+start/inspect/list/remove/rename/pause/unpause/restart/exec, image pulls,
+networks and the events stream) on a unix socket. Nothing is actually run: a started
+container turns "running" after --boot-seconds and reports health_status
+"healthy" (or "unhealthy" with probability --failure-rate) after a further
+--health-seconds. Both delays get up to --jitter extra random seconds.
+Stats report --container-memory-mb of memory and --container-cpus of CPU
+for every running container. With --viewer-seconds, every started container
+has a simulated noVNC viewer connected for a random time (exponential, that
+mean): it shows up as an established connection in /proc/net/tcp (exec) and
+as network traffic in the stats. Every container reports --container-ip
+as its address, so a local server can stand in for noVNC behind proxy.py.
+With --pull-required, no image exists until it is pulled: create answers
+404 "No such image" like dockerd, and /images/create "pulls" it.
+
+    python bench/fake_docker.py --socket /tmp/fake-docker.sock --health-seconds 2
+
+Point the orchestrator at it with DOCKER_HOST=unix://<socket> and
+DOCKER_SOCKET=<socket>. bench/load.py starts one on its own.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from aiohttp import web
+
+API_VERSION = "1.41"
+
+
+class FakeDaemon:
+    def __init__(self, boot_seconds: float, health_seconds: float, jitter: float,
+                 failure_rate: float, error_rate: float, api_latency: float,
+                 container_memory_mb: float = 400, container_cpus: float = 0.2, viewer_seconds: float = 0.0,
+                 container_ip: str = "127.0.0.1", pull_required: bool = False):
+        self.boot_seconds = boot_seconds
+        self.health_seconds = health_seconds
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.api_latency = api_latency
+        self.container_memory_mb = container_memory_mb
+        self.container_cpus = container_cpus
+        self.viewer_seconds = viewer_seconds
+        self.container_ip = container_ip
+        self.pull_required = pull_required
+        self.images: set[str] = set()
+        self.containers: dict[str, dict] = {}
+        self.networks: dict[str, dict] = {}
+        self.execs: dict[str, dict] = {}
+        self.subscribers: list[asyncio.Queue] = []
+
+    # -----------------------------------------------------------------------
+    # Helpers
+    # -----------------------------------------------------------------------
+
+    @staticmethod
+    def _image_ref(name: str) -> str:
+        return name if ":" in name.rsplit("/", 1)[-1] else name + ":latest"
+
+    def _delay(self, base: float) -> float:
+        return base + random.uniform(0, self.jitter)
+
+    def _find(self, ref: str) -> dict:
+        ref = ref.lstrip("/")
+        if ref in self.containers:
+            return self.containers[ref]
+        for c in self.containers.values():
+            if c["Name"] == "/" + ref or (len(ref) >= 12 and c["Id"].startswith(ref)):
+                return c
+        raise web.HTTPNotFound(text=json.dumps({"message": f"No such container: {ref}"}),
+                               content_type="application/json")
+
+    def _emit(self, c: dict, action: str) -> None:
+        event = {
+            "Type": "container",
+            "Action": action,
+            "status": action,
+            "id": c["Id"],
+            "Actor": {"ID": c["Id"], "Attributes": {"name": c["Name"].lstrip("/"), **c["Config"]["Labels"]}},
+            "time": int(time.time()),
+            "timeNano": time.time_ns(),
+        }
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    def _set_status(self, c: dict, status: str) -> None:
+        c["State"].update(Status=status, Running=status in ("running", "paused"), Paused=status == "paused")
+
+    async def _boot(self, c: dict, generation: int) -> None:
+        """Simulate a container process starting and its healthcheck settling."""
+        await asyncio.sleep(self._delay(self.boot_seconds))
+        if c["_generation"] != generation or c["Id"] not in self.containers:
+            return
+        self._set_status(c, "running")
+        c["State"]["Health"] = {"Status": "starting"}
+        c["_running_since"] = time.monotonic()
+        if self.viewer_seconds:
+            c["_viewer_until"] = c["_running_since"] + random.expovariate(1 / self.viewer_seconds)
+        self._emit(c, "start")
+
+        await asyncio.sleep(self._delay(self.health_seconds))
+        if c["_generation"] != generation or c["Id"] not in self.containers:
+            return
+        health = "unhealthy" if random.random() < self.failure_rate else "healthy"
+        c["State"]["Health"]["Status"] = health
+        self._emit(c, f"health_status: {health}")
+
+    def _start(self, c: dict) -> None:
+        c["_generation"] += 1
+        self._set_status(c, "created")
+        c["State"]["Health"] = {"Status": "starting"}
+        asyncio.get_running_loop().create_task(self._boot(c, c["_generation"]))
+
+    def _viewer_seconds(self, c: dict) -> float:
+        """Seconds the simulated viewer has been connected so far."""
+        since = c.get("_running_since")
+        if since is None:
+            return 0.0
+        return max(0.0, min(time.monotonic(), c.get("_viewer_until", since)) - since)
+
+    def _proc_net_tcp(self, c: dict) -> str:
+        lines = ["  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode"]
+        lines.append("   0: 00000000:17C0 00000000:0000 0A 00000000:00000000 00:00000000 00000000  1000        0 1")
+        if c["State"]["Running"] and time.monotonic() < c.get("_viewer_until", 0):
+            lines.append("   1: 020A0A0A:17C0 010A0A0A:D431 01 00000000:00000000 00:00000000 00000000  1000        0 2")
+        return "\n".join(lines) + "\n"
+
+    def _summary(self, c: dict) -> dict:
+        ports = []
+        for spec, bindings in (c["HostConfig"].get("PortBindings") or {}).items():
+            private, _, proto = spec.partition("/")
+            for b in bindings or []:
+                ports.append({"IP": b.get("HostIp") or "0.0.0.0", "PrivatePort": int(private),
+                              "PublicPort": int(b["HostPort"]), "Type": proto or "tcp"})
+        return {
+            "Id": c["Id"],
+            "Names": [c["Name"]],
+            "Image": c["Config"]["Image"],
+            "State": c["State"]["Status"],
+            "Status": c["State"]["Status"],
+            "Labels": c["Config"]["Labels"],
+            "Ports": ports,
+        }
+
+    @staticmethod
+    def _matches(c: dict, filters: dict) -> bool:
+        labels = c["Config"]["Labels"]
+        for spec in filters.get("label", []):
+            key, sep, value = spec.partition("=")
+            if key not in labels or (sep and labels[key] != value):
+                return False
+        names = filters.get("name", [])
+        if names and not any(n in c["Name"] for n in names):
+            return False
+        return True
+
+    # -----------------------------------------------------------------------
+    # Handlers
+    # -----------------------------------------------------------------------
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler):
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        return await handler(request)
+
+    async def version(self, request: web.Request) -> web.Response:
+        return web.json_response({"ApiVersion": API_VERSION, "MinAPIVersion": "1.24", "Version": "fake"})
+
+    async def ping(self, request: web.Request) -> web.Response:
+        return web.Response(text="OK")
+
+    async def stats(self, request: web.Request) -> web.Response:
+        c = self._find(request.match_info["ref"])
+        cpu_seconds = self.container_cpus * (time.monotonic() - c.get("_running_since", time.monotonic()))
+        memory = int(self.container_memory_mb * 1024 * 1024) if c["State"]["Running"] else 0
+        return web.json_response({
+            "read": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "memory_stats": {"usage": memory, "stats": {"inactive_file": 0}, "limit": 64 * 1024 ** 3},
+            "cpu_stats": {"cpu_usage": {"total_usage": int(cpu_seconds * 1e9)}, "online_cpus": 16},
+            "precpu_stats": {},
+            # ~20 KB/s each way while the viewer is connected
+            "networks": {"eth0": {"rx_bytes": int(self._viewer_seconds(c) * 20000),
+                                  "tx_bytes": int(self._viewer_seconds(c) * 20000)}},
+        })
+
+    async def info(self, request: web.Request) -> web.Response:
+        return web.json_response({"Name": "fake", "MemTotal": 64 * 1024 ** 3, "NCPU": 16,
+                                  "Containers": len(self.containers)})
+
+    async def create(self, request: web.Request) -> web.Response:
+        name = request.query.get("name") or uuid.uuid4().hex[:12]
+        if any(c["Name"] == "/" + name for c in self.containers.values()):
+            return web.json_response({"message": f'Conflict. The container name "/{name}" is already in use'},
+                                     status=409)
+        if random.random() < self.error_rate:
+            return web.json_response({"message": "fake daemon: injected create failure"}, status=500)
+        body = await request.json()
+        if self.pull_required and self._image_ref(body.get("Image", "")) not in self.images:
+            return web.json_response({"message": f"No such image: {body.get('Image', '')}"}, status=404)
+        cid = uuid.uuid4().hex + uuid.uuid4().hex
+        network = (body.get("HostConfig") or {}).get("NetworkMode") or "bridge"
+        self.containers[cid] = {
+            "Id": cid,
+            "Name": "/" + name,
+            "Created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "State": {"Status": "created", "Running": False, "Paused": False},
+            "Config": {"Image": body.get("Image", ""), "Labels": body.get("Labels") or {}, "Env": body.get("Env") or []},
+            "HostConfig": body.get("HostConfig") or {},
+            "NetworkSettings": {"Ports": {}, "Networks": {network: {"IPAddress": self.container_ip}}},
+            "_generation": 0,
+        }
+        self._emit(self.containers[cid], "create")
+        return web.json_response({"Id": cid, "Warnings": []}, status=201)
+
+    async def image_pull(self, request: web.Request) -> web.Response:
+        image = f"{request.query['fromImage']}:{request.query.get('tag') or 'latest'}"
+        await asyncio.sleep(self._delay(self.boot_seconds))
+        self.images.add(image)
+        progress = [{"status": f"Pulling from {request.query['fromImage']}"},
+                    {"status": f"Status: Downloaded newer image for {image}"}]
+        return web.Response(text="".join(json.dumps(p) + "\n" for p in progress), content_type="application/json")
+
+    async def image_inspect(self, request: web.Request) -> web.Response:
+        image = self._image_ref(request.match_info["name"])
+        if self.pull_required and image not in self.images:
+            return web.json_response({"message": f"No such image: {image}"}, status=404)
+        return web.json_response({"Id": "sha256:" + uuid.uuid5(uuid.NAMESPACE_URL, image).hex, "RepoTags": [image]})
+
+    async def inspect(self, request: web.Request) -> web.Response:
+        c = self._find(request.match_info["ref"])
+        return web.json_response({k: v for k, v in c.items() if not k.startswith("_")})
+
+    async def list(self, request: web.Request) -> web.Response:
+        filters = json.loads(request.query.get("filters", "{}"))
+        show_all = request.query.get("all") in ("1", "true", "True")
+        return web.json_response([
+            self._summary(c) for c in self.containers.values()
+            if (show_all or c["State"]["Running"]) and self._matches(c, filters)
+        ])
+
+    async def start(self, request: web.Request) -> web.Response:
+        self._start(self._find(request.match_info["ref"]))
+        return web.Response(status=204)
+
+    async def restart(self, request: web.Request) -> web.Response:
+        c = self._find(request.match_info["ref"])
+        self._emit(c, "die")
+        self._start(c)
+        return web.Response(status=204)
+
+    async def pause(self, request: web.Request) -> web.Response:
+        c = self._find(request.match_info["ref"])
+        self._set_status(c, "paused")
+        self._emit(c, "pause")
+        return web.Response(status=204)
+
+    async def unpause(self, request: web.Request) -> web.Response:
+        c = self._find(request.match_info["ref"])
+        self._set_status(c, "running")
+        self._emit(c, "unpause")
+        return web.Response(status=204)
+
+    async def rename(self, request: web.Request) -> web.Response:
+        c = self._find(request.match_info["ref"])
+        name = "/" + request.query["name"]
+        if any(o["Name"] == name and o is not c for o in self.containers.values()):
+            return web.json_response({"message": f'Conflict. The container name "{name}" is already in use'},
+                                     status=409)
+        c["Name"] = name
+        self._emit(c, "rename")
+        return web.Response(status=204)
+
+    async def remove(self, request: web.Request) -> web.Response:
+        c = self._find(request.match_info["ref"])
+        del self.containers[c["Id"]]
+        self._set_status(c, "removing")
+        self._emit(c, "die")
+        self._emit(c, "destroy")
+        return web.Response(status=204)
+
+    async def exec_create(self, request: web.Request) -> web.Response:
+        c = self._find(request.match_info["ref"])
+        exec_id = uuid.uuid4().hex
+        cmd = (await request.json()).get("Cmd") or []
+        self.execs[exec_id] = {"ID": exec_id, "ContainerID": c["Id"], "Running": False, "ExitCode": 0,
+                               "_cmd": " ".join(cmd)}
+        return web.json_response({"Id": exec_id}, status=201)
+
+    async def exec_start(self, request: web.Request) -> web.Response:
+        info = self.execs.get(request.match_info["exec_id"])
+        if info is None:
+            raise web.HTTPNotFound()
+        output = b""
+        if "/proc/net/tcp" in info["_cmd"]:
+            output = self._proc_net_tcp(self.containers[info["ContainerID"]]).encode()
+        # Like dockerd: upgrade, then write the raw multiplexed output (stream
+        # type, 3 zero bytes, big-endian length) on the hijacked connection and
+        # close it. The short pause keeps the client from buffering the output
+        # together with the headers, which it reads from the raw socket.
+        response = web.StreamResponse(status=101, headers={
+            "Content-Type": "application/vnd.docker.raw-stream", "Connection": "Upgrade", "Upgrade": "tcp",
+        })
+        await response.prepare(request)
+        await asyncio.sleep(0.02)
+        if output:
+            request.transport.write(b"\x01\x00\x00\x00" + len(output).to_bytes(4, "big") + output)
+        request.transport.close()
+        return response
+
+    async def exec_inspect(self, request: web.Request) -> web.Response:
+        info = self.execs.get(request.match_info["exec_id"])
+        if info is None:
+            raise web.HTTPNotFound()
+        return web.json_response({k: v for k, v in info.items() if not k.startswith("_")})
+
+    async def network_inspect(self, request: web.Request) -> web.Response:
+        network = self.networks.get(request.match_info["name"])
+        if network is None:
+            return web.json_response({"message": "network not found"}, status=404)
+        return web.json_response(network)
+
+    async def network_create(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        network = {"Id": uuid.uuid4().hex, "Name": body["Name"], "Driver": body.get("Driver", "bridge"),
+                   "IPAM": body.get("IPAM") or {}, "Containers": {}}
+        self.networks[body["Name"]] = self.networks[network["Id"]] = network
+        return web.json_response({"Id": network["Id"], "Warning": ""}, status=201)
+
+    async def events(self, request: web.Request) -> web.StreamResponse:
+        wanted = json.loads(request.query.get("filters", "{}")).get("event", [])
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        queue: asyncio.Queue = asyncio.Queue()
+        self.subscribers.append(queue)
+        try:
+            while True:
+                event = await queue.get()
+                if wanted and event["Action"].split(":")[0] not in wanted:
+                    continue
+                await response.write(json.dumps(event).encode() + b"\n")
+        finally:
+            self.subscribers.remove(queue)
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware])
+        routes = [
+            ("GET", "/version", self.version),
+            ("GET", "/_ping", self.ping),
+            ("GET", "/info", self.info),
+            ("POST", "/containers/create", self.create),
+            ("GET", "/containers/json", self.list),
+            ("GET", "/containers/{ref}/json", self.inspect),
+            ("GET", "/containers/{ref}/stats", self.stats),
+            ("POST", "/containers/{ref}/start", self.start),
+            ("POST", "/containers/{ref}/restart", self.restart),
+            ("POST", "/containers/{ref}/pause", self.pause),
+            ("POST", "/containers/{ref}/unpause", self.unpause),
+            ("POST", "/containers/{ref}/rename", self.rename),
+            ("POST", "/containers/{ref}/exec", self.exec_create),
+            ("DELETE", "/containers/{ref}", self.remove),
+            ("POST", "/exec/{exec_id}/start", self.exec_start),
+            ("GET", "/exec/{exec_id}/json", self.exec_inspect),
+            ("POST", "/images/create", self.image_pull),
+            ("GET", "/images/{name:.+}/json", self.image_inspect),
+            ("GET", "/networks/{name}", self.network_inspect),
+            ("POST", "/networks/create", self.network_create),
+            ("GET", "/events", self.events),
+        ]
+        # Accept both versioned (/v1.41/...) and unversioned paths
+        for method, path, handler in routes:
+            app.router.add_route(method, path, handler)
+            app.router.add_route(method, r"/v{version:[0-9.]+}" + path, handler)
+        return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--socket", default="/tmp/fake-docker.sock", help="unix socket to listen on")
+    parser.add_argument("--boot-seconds", type=float, default=0.5, help="delay from start to running")
+    parser.add_argument("--health-seconds", type=float, default=2.0, help="delay from running to healthy")
+    parser.add_argument("--jitter", type=float, default=0.5, help="random extra seconds on both delays")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of containers that turn unhealthy")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of create calls that fail with 500")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds added to every API call")
+    parser.add_argument("--container-memory-mb", type=float, default=400, help="memory each running container reports")
+    parser.add_argument("--container-cpus", type=float, default=0.2, help="CPUs each running container reports")
+    parser.add_argument("--viewer-seconds", type=float, default=0.0,
+                        help="mean time a simulated VNC viewer stays connected after start (0 = no viewers)")
+    parser.add_argument("--container-ip", default="127.0.0.1",
+                        help="address every container reports on its network (where proxy.py forwards to)")
+    parser.add_argument("--pull-required", action="store_true",
+                        help="start with no images: create fails with 404 until the image is pulled")
+    args = parser.parse_args()
+
+    daemon = FakeDaemon(args.boot_seconds, args.health_seconds, args.jitter,
+                        args.failure_rate, args.error_rate, args.api_latency,
+                        args.container_memory_mb, args.container_cpus, args.viewer_seconds,
+                        args.container_ip, args.pull_required)
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    # The events stream never ends on its own: do not wait for it on shutdown
+    web.run_app(daemon.app(), path=args.socket, print=None, shutdown_timeout=1)
+
+
+if __name__ == "__main__":
+    main()
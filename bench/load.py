@@ -0,0 +1,255 @@
+"""Load test the orchestrator against a fake Docker daemon (bench/fake_docker.py).
+
+No Docker host or VNC image needed. Starts the fake daemon in a subprocess,
+points the orchestrator at it with a throwaway state directory, boots the
+warm pool and then fires --requests synthetic /access and /remove calls
+through the Flask routes from --concurrency threads, while a background
+thread runs the idle cleanup every --cleanup-every seconds. Clients are
+drawn with a Zipf-like skew so some sessions are reused and others expire.
+
+Reports p50/p99 latency per route and per access action, throughput, pool
+hit rate, Docker API calls and state store operations. --json writes the
+same numbers to a file so runs can be compared for regressions.
+
+    python bench/load.py --requests 5000 --clients 300 --ports 60 --pool-size 8
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def start_fake_daemon(args, socket_path: str) -> subprocess.Popen:
+    cmd = [
+        sys.executable, os.path.join(os.path.dirname(__file__), "fake_docker.py"),
+        "--socket", socket_path,
+        "--boot-seconds", str(args.boot_seconds),
+        "--health-seconds", str(args.health_seconds),
+        "--jitter", str(args.jitter),
+        "--failure-rate", str(args.failure_rate),
+        "--error-rate", str(args.error_rate),
+        "--api-latency", str(args.api_latency),
+    ]
+    proc = subprocess.Popen(cmd)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            with socket.socket(socket.AF_UNIX) as s:
+                s.connect(socket_path)
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("fake Docker daemon did not start")
+
+
+def configure_env(args, workdir: str, socket_path: str) -> None:
+    """Environment read by the orchestrator modules at import time."""
+    os.environ.update({
+        "DOCKER_HOST": f"unix://{socket_path}",
+        "DOCKER_SOCKET": socket_path,
+        "STATE_BACKEND": args.backend,
+        "STATE_FILE": os.path.join(workdir, "state.json"),
+        "PORT_RANGE_MIN": str(args.port_base),
+        "PORT_RANGE_MAX": str(args.port_base + args.ports - 1),
+        "WARM_POOL_SIZE": str(args.pool_size),
+        "WARM_POOL_PAUSED": "1" if args.pool_paused else "0",
+        "RECYCLE_MODE": args.recycle_mode,
+        "VNC_HOST": "localhost",
+    })
+
+
+def histogram_totals(histogram) -> dict[str, dict]:
+    """label value -> {"count", "sum"} of a single-label prometheus Histogram."""
+    totals = defaultdict(lambda: {"count": 0, "sum": 0.0})
+    for metric in histogram.collect():
+        for sample in metric.samples:
+            label = next(iter(sample.labels.values()), "")
+            if sample.name.endswith("_count"):
+                totals[label]["count"] = int(sample.value)
+            elif sample.name.endswith("_sum"):
+                totals[label]["sum"] = sample.value
+    return {k: v for k, v in totals.items() if v["count"]}
+
+
+def wait_for_pool(warm_pool, size: int, timeout: float) -> float:
+    start = time.time()
+    while time.time() - start < timeout and warm_pool.get_progress()["ready"] < size:
+        time.sleep(0.1)
+    return time.time() - start
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="orchestrator-bench-")
+    socket_path = os.path.join(workdir, "docker.sock")
+    daemon = start_fake_daemon(args, socket_path)
+    try:
+        configure_env(args, workdir, socket_path)
+
+        from app import app  # noqa: E402
+        import metrics  # noqa: E402
+        import scheduler  # noqa: E402
+        import services  # noqa: E402
+        import warm_pool  # noqa: E402
+
+        logging.getLogger().setLevel(args.log_level)
+        scheduler.IDLE_TIMEOUT_HOURS = args.idle_seconds / 3600
+
+        services.reconcile_on_startup()
+        warm_pool.start_pool_manager()
+        pool_fill_s = wait_for_pool(warm_pool, args.pool_size, timeout=60)
+
+        rng = random.Random(args.seed)
+        weights = [1 / (i + 1) ** args.skew for i in range(args.clients)]
+        client_ids = [f"{i:011d}" for i in range(args.clients)]
+        ops = [
+            ("remove" if rng.random() < args.remove_ratio else "access", rng.choices(client_ids, weights)[0])
+            for _ in range(args.requests)
+        ]
+
+        latencies = defaultdict(list)
+        statuses = Counter()
+        lock = threading.Lock()
+
+        def call(op: str, client_id: str) -> None:
+            start = time.perf_counter()
+            response = app.test_client().get(f"/{op}?id={client_id}")
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies[op].append(elapsed)
+                statuses[f"{op} {response.status_code}"] += 1
+
+        cleanups = []
+        stop = threading.Event()
+
+        def cleanup_loop() -> None:
+            while not stop.wait(args.cleanup_every):
+                start = time.perf_counter()
+                stats = scheduler.reap_idle_containers()
+                cleanups.append({"seconds": time.perf_counter() - start, **stats})
+
+        cleaner = threading.Thread(target=cleanup_loop, name="bench-cleanup", daemon=True)
+        cleaner.start()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            for future in [executor.submit(call, op, cid) for op, cid in ops]:
+                future.result()
+        duration = time.perf_counter() - start
+        stop.set()
+        cleaner.join()
+
+        progress = warm_pool.get_progress()
+        claims = progress["pool_hits"] + progress["cold_creates"]
+        state_files = [f for f in os.listdir(workdir) if f.startswith("state")]
+        return {
+            "requests": args.requests,
+            "duration_s": duration,
+            "throughput_rps": args.requests / duration,
+            "pool_fill_s": pool_fill_s,
+            "latency_ms": {
+                op: {
+                    "p50": percentile(values, 50) * 1000,
+                    "p99": percentile(values, 99) * 1000,
+                    "max": max(values) * 1000,
+                    "count": len(values),
+                }
+                for op, values in latencies.items()
+            },
+            "statuses": dict(statuses),
+            "access_actions": histogram_totals(metrics.ACCESS_SECONDS),
+            "pool_hit_rate": progress["pool_hits"] / claims if claims else float("nan"),
+            "pool": progress,
+            "cleanups": {
+                "runs": len(cleanups),
+                "removed": sum(c.get("removed", 0) for c in cleanups),
+                "mean_s": sum(c["seconds"] for c in cleanups) / len(cleanups) if cleanups else 0.0,
+            },
+            "docker_api": histogram_totals(metrics.DOCKER_SECONDS),
+            "state_ops": histogram_totals(metrics.STATE_SECONDS),
+            "state_bytes": {f: os.path.getsize(os.path.join(workdir, f)) for f in state_files},
+        }
+    finally:
+        daemon.terminate()
+        daemon.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_report(result: dict) -> None:
+    print(f"\n{result['requests']} requests in {result['duration_s']:.1f}s "
+          f"({result['throughput_rps']:.1f} req/s), pool filled in {result['pool_fill_s']:.1f}s")
+
+    print(f"\n{'route':>10} | {'count':>7} | {'p50 ms':>9} | {'p99 ms':>9} | {'max ms':>9}")
+    for op, s in result["latency_ms"].items():
+        print(f"{op:>10} | {s['count']:>7} | {s['p50']:>9.1f} | {s['p99']:>9.1f} | {s['max']:>9.1f}")
+
+    print(f"\n{'action':>10} | {'count':>7} | {'mean ms':>9}")
+    for action, t in result["access_actions"].items():
+        print(f"{action:>10} | {t['count']:>7} | {t['sum'] / t['count'] * 1000:>9.1f}")
+
+    print(f"\npool hit rate: {result['pool_hit_rate']:.1%}  statuses: {result['statuses']}")
+    c = result["cleanups"]
+    print(f"cleanup: {c['runs']} runs, {c['removed']} removed, {c['mean_s'] * 1000:.1f} ms mean")
+
+    for title, totals in (("docker api", result["docker_api"]), ("state op", result["state_ops"])):
+        print(f"\n{title:>20} | {'calls':>7} | {'total ms':>9} | {'mean ms':>8}")
+        for op, t in sorted(totals.items(), key=lambda kv: -kv[1]["sum"]):
+            print(f"{op:>20} | {t['count']:>7} | {t['sum'] * 1000:>9.1f} | {t['sum'] / t['count'] * 1000:>8.3f}")
+    print(f"\nstate files: {result['state_bytes']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000, help="synthetic requests to send")
+    parser.add_argument("--clients", type=int, default=200, help="distinct client ids")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of client popularity (0 = uniform)")
+    parser.add_argument("--remove-ratio", type=float, default=0.05, help="fraction of requests that are /remove")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads")
+    parser.add_argument("--ports", type=int, default=50, help="size of the port range")
+    parser.add_argument("--port-base", type=int, default=20000, help="first port of the range")
+    parser.add_argument("--pool-size", type=int, default=4, help="WARM_POOL_SIZE")
+    parser.add_argument("--pool-paused", action="store_true", help="WARM_POOL_PAUSED=1")
+    parser.add_argument("--backend", choices=("journal", "sqlite"), default="journal", help="STATE_BACKEND")
+    parser.add_argument("--recycle-mode", choices=("destroy", "reset"), default="destroy", help="RECYCLE_MODE")
+    parser.add_argument("--idle-seconds", type=float, default=5.0, help="idle timeout used by the cleanup")
+    parser.add_argument("--cleanup-every", type=float, default=2.0, help="seconds between cleanup runs")
+    parser.add_argument("--boot-seconds", type=float, default=0.2, help="fake daemon: start -> running")
+    parser.add_argument("--health-seconds", type=float, default=0.5, help="fake daemon: running -> healthy")
+    parser.add_argument("--jitter", type=float, default=0.2, help="fake daemon: random extra delay")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fake daemon: unhealthy fraction")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake daemon: failed create fraction")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="fake daemon: seconds per API call")
+    parser.add_argument("--seed", type=int, default=1, help="workload random seed")
+    parser.add_argument("--log-level", default="WARNING", help="orchestrator log level during the run")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    result = run(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Compare a running warm pool with a paused one (WARM_POOL_PAUSED).
+
+Needs a real Docker daemon and the VNC image. For each mode it boots
+--size pool containers, lets them settle, samples their memory/CPU with
+`docker stats` plus the host's MemAvailable, then claims them one by one
+and measures the claim latency (unpause + health check, and optionally the
+time until the VNC port answers HTTP). Containers are removed afterwards.
+The ports are taken from the first node's range (PORT_RANGE_MIN/MAX), which
+must hold --size ports from --port-base on.
+
+    PORT_RANGE_MAX=5009 python bench/pool_pause.py --size 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import containers  # noqa: E402
+
+
+def mem_available_mb() -> float:
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def sample_stats(container_ids: list[str]) -> tuple[float, float]:
+    """Return (total memory MB, total CPU %) of the containers."""
+    mem = cpu = 0.0
+    for cid in container_ids:
+        s = containers.client.api.stats(cid, stream=False)
+        mem += s.get("memory_stats", {}).get("usage", 0) / (1024 * 1024)
+        cpu_delta = s["cpu_stats"]["cpu_usage"]["total_usage"] - s["precpu_stats"]["cpu_usage"]["total_usage"]
+        sys_delta = s["cpu_stats"].get("system_cpu_usage", 0) - s["precpu_stats"].get("system_cpu_usage", 0)
+        if sys_delta > 0:
+            cpu += cpu_delta / sys_delta * s["cpu_stats"].get("online_cpus", 1) * 100
+    return mem, cpu
+
+
+def wait_http(port: int, timeout: float) -> float | None:
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1)
+            return time.time() - start
+        except Exception:
+            time.sleep(0.05)
+    return None
+
+
+def run(mode: str, size: int, port_base: int, settle: float, http: bool) -> dict:
+    baseline = mem_available_mb()
+    pool = []
+    try:
+        for i in range(size):
+            info = containers.create_pool_container(port_base + i)
+            if mode == "paused":
+                containers.pause_container(info["container_id"])
+            pool.append(info)
+
+        time.sleep(settle)
+        mem, cpu = sample_stats([p["container_id"] for p in pool])
+        host_used = baseline - mem_available_mb()
+
+        claims, first_http = [], []
+        for info in pool:
+            start = time.time()
+            containers.unpause_container(info["container_id"])
+            containers.is_container_healthy(info["container_id"])
+            claims.append(time.time() - start)
+            if http:
+                elapsed = wait_http(info["port"], timeout=10)
+                if elapsed is not None:
+                    first_http.append(claims[-1] + elapsed)
+    finally:
+        for info in pool:
+            containers.remove_container(info["container_id"])
+
+    return {
+        "mode": mode,
+        "containers_mem_mb": mem,
+        "containers_cpu_pct": cpu,
+        "host_mem_used_mb": host_used,
+        "claim_p50_ms": statistics.median(claims) * 1000,
+        "claim_max_ms": max(claims) * 1000,
+        "first_http_p50_ms": statistics.median(first_http) * 1000 if first_http else float("nan"),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=5, help="pool containers per mode")
+    parser.add_argument("--port-base", type=int, default=containers.NODES[0].port_min,
+                        help="first host port to use (default: start of the first node's range)")
+    parser.add_argument("--settle", type=float, default=20.0, help="seconds to idle before sampling")
+    parser.add_argument("--no-http", action="store_true", help="skip the time-to-first-HTTP measurement")
+    args = parser.parse_args()
+
+    node = containers.NODES[0]
+    if args.port_base < node.port_min or args.port_base + args.size - 1 > node.port_max:
+        parser.error(f"ports {args.port_base}-{args.port_base + args.size - 1} are outside the range "
+                     f"{node.port_min}-{node.port_max} of node {node.name}; set PORT_RANGE_MIN/PORT_RANGE_MAX")
+
+    results = [run(mode, args.size, args.port_base, args.settle, not args.no_http)
+               for mode in ("running", "paused")]
+
+    columns = list(results[0])
+    print(" | ".join(f"{c:>18}" for c in columns))
+    for r in results:
+        print(" | ".join(f"{r[c]:>18.1f}" if isinstance(r[c], float) else f"{r[c]:>18}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
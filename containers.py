@@ -1,8 +1,19 @@
+import asyncio
 import docker
 import logging
 import os
-import socket
+import shlex
+import threading
 import time
+from datetime import datetime
+
+import docker_async
+import events
+import metrics
+import nodes
+import state
+import tracing
+from logging_setup import SAMPLED
 
 logger = logging.getLogger(__name__)
 
@@ -11,17 +22,137 @@ IMAGE = os.environ.get(
     "ghcr.io/giovannemendonca/firefox-flash-kiosk:4bda8f16af52b0c2593505a7359e49a252728573",
 )
 CONTAINER_PORT = os.environ.get("VNC_CONTAINER_PORT", "6080")
+
+# Port range and redirect host of the local engine, used when DOCKER_NODES
+# is not set (see nodes.py for several engines)
 PORT_MIN = int(os.environ.get("PORT_RANGE_MIN", "5000"))
 PORT_MAX = int(os.environ.get("PORT_RANGE_MAX", "5003"))
+VNC_HOST = os.environ.get("VNC_HOST", "localhost")
 
 APPNAME = os.environ.get("VNC_APPNAME", "firefox-kiosk https://google.com")
 WIDTH = os.environ.get("VNC_WIDTH", "390")
 HEIGHT = os.environ.get("VNC_HEIGHT", "900")
 
+# Labels set on every container the orchestrator creates. Discovery,
+# reconciliation and cleanup find our containers (and rebuild their records)
+# from these instead of parsing names; ORCHESTRATOR_INSTANCE keeps several
+# orchestrators on one Docker host from touching each other's containers.
+LABEL_PREFIX = os.environ.get("ORCHESTRATOR_LABEL_PREFIX", "vnc-orchestrator")
+ORCHESTRATOR_INSTANCE = os.environ.get("ORCHESTRATOR_INSTANCE", "default")
+MANAGED_LABEL = f"{LABEL_PREFIX}.managed"
+INSTANCE_LABEL = f"{LABEL_PREFIX}.instance"
+CLIENT_LABEL = f"{LABEL_PREFIX}.client_id"
+PORT_LABEL = f"{LABEL_PREFIX}.port"
+POOL_LABEL = f"{LABEL_PREFIX}.pool"
+CREATED_LABEL = f"{LABEL_PREFIX}.created_at"
+
 NETWORK_NAME = os.environ.get("DOCKER_NETWORK_NAME", "vnc_network")
 NETWORK_SUBNET = os.environ.get("DOCKER_NETWORK_SUBNET", "10.10.0.0/24")
 
-client = docker.from_env()
+# While the Docker events stream is up, wait_container_ready() only inspects
+# the container this often as a safety net (it is woken by events otherwise)
+WAIT_FALLBACK_POLL_SECONDS = int(os.environ.get("WAIT_FALLBACK_POLL_SECONDS", "10"))
+
+# Smoothing factor of the boot time EWMA (weight of the newest measurement)
+BOOT_TIME_ALPHA = 0.3
+
+# Assumed time to healthy until the first container has been measured
+DEFAULT_BOOT_SECONDS = 15.0
+
+# Container status cache used by is_container_healthy(). Entries are kept
+# up to date by Docker events; without a live events stream they are only
+# trusted for HEALTH_CACHE_TTL_SECONDS.
+HEALTH_CACHE_TTL_SECONDS = float(os.environ.get("HEALTH_CACHE_TTL_SECONDS", "5"))
+HEALTH_CACHE_MAX_AGE_SECONDS = float(os.environ.get("HEALTH_CACHE_MAX_AGE_SECONDS", "300"))
+
+# reset_container(): command run inside a recycled container to start a fresh
+# browser session (e.g. "pkill -f firefox" when a supervisor relaunches it).
+# When empty the whole container is restarted with `docker restart`.
+RESET_COMMAND = os.environ.get("RECYCLE_RESET_COMMAND", "")
+
+# Seconds `docker restart` waits for the old session to stop before killing it
+RESET_STOP_TIMEOUT_SECONDS = int(os.environ.get("RECYCLE_RESET_STOP_TIMEOUT", "5"))
+
+# Name of a container recycled by reset between leaving its previous owner
+# and being renamed for the new one (see park_container())
+PARKED_PREFIX = "vnc_reset_"
+
+# Resource limits of every VNC container: memory in Docker notation ("1g",
+# "768m") and CPUs as a fraction ("1.5"). Empty = unlimited.
+CONTAINER_MEMORY_LIMIT = os.environ.get("CONTAINER_MEMORY_LIMIT", "")
+CONTAINER_CPUS = float(os.environ.get("CONTAINER_CPUS") or "0")
+
+# Publish CONTAINER_PORT of every container on its record's host port. Off
+# when the single-port proxy (proxy.py, PROXY_PORT) serves the sessions: a
+# record's port is then a session slot (see SESSION_SLOT_BASE), not a host port.
+PUBLISH_PORTS = not int(os.environ.get("PROXY_PORT") or "0")
+
+# Behind the proxy: sessions a node takes unless its DOCKER_NODES entry sets
+# "sessions". Only a key space for the state store; the real limit is the
+# resource admission control (resource_monitor.py).
+PROXY_SESSIONS_PER_NODE = int(os.environ.get("PROXY_SESSIONS_PER_NODE", "1000"))
+
+# First session slot behind the proxy. Slots lie above the TCP port range so a
+# record's slot is never mistaken for a host port; each node gets the next
+# block of its session count.
+SESSION_SLOT_BASE = 100000
+
+
+def _load_nodes() -> list[nodes.Node]:
+    """Build the node registry from DOCKER_NODES (or the local engine alone)."""
+    if not nodes.DOCKER_NODES:
+        built = [nodes.Node("local", docker.from_env(), f"unix://{docker_async.DOCKER_SOCKET}",
+                            VNC_HOST, PORT_MIN, PORT_MAX)]
+        sessions = [None]
+    else:
+        specs = nodes.parse_nodes(nodes.DOCKER_NODES, publish_ports=PUBLISH_PORTS)
+        built = [
+            nodes.Node(spec["name"], docker.DockerClient(base_url=spec["url"]), spec["url"], spec["host"],
+                       spec.get("port_min", 0), spec.get("port_max", -1), spec.get("pool"),
+                       spec.get("memory_mb"), spec.get("cpus"))
+            for spec in specs
+        ]
+        sessions = [spec.get("sessions") for spec in specs]
+    if not PUBLISH_PORTS:
+        first = SESSION_SLOT_BASE
+        for node, count in zip(built, sessions):
+            node.port_min, node.port_max = first, first + int(count or PROXY_SESSIONS_PER_NODE) - 1
+            first = node.port_max + 1
+    return built
+
+
+NODES = _load_nodes()
+
+# Client of the first node (the only one unless DOCKER_NODES is set)
+client = NODES[0].client
+
+for _node in NODES:
+    # Docker API latency per operation (orchestrator_docker_api_seconds), and
+    # each call as a span of the current trace
+    _node.client.api.hooks["response"].append(metrics.observe_docker_response)
+    _node.client.api.hooks["response"].append(tracing.docker_response_hook)
+
+# container_id -> node running it (learnt on create/listing, probed otherwise)
+_container_nodes: dict[str, nodes.Node] = {}
+
+# container_id -> (status, time.monotonic() when observed)
+_status_cache: dict[str, tuple[str, float]] = {}
+_status_lock = threading.Lock()
+
+# Docker event action -> container status
+_EVENT_STATUS = {
+    "start": "running",
+    "unpause": "running",
+    "die": "exited",
+    "pause": "paused",
+    "destroy": "removed",
+}
+
+_boot_seconds: float | None = None
+
+# container_id -> waiters blocked in wait_container_ready()
+_health_waiters: dict[str, list["_HealthWaiter | _AsyncHealthWaiter"]] = {}
+_waiters_lock = threading.Lock()
 
 
 def log_config():
@@ -29,30 +160,101 @@ def log_config():
     logger.info("========== DOCKER CONFIG ==========")
     logger.info("  IMAGE           = %s", IMAGE)
     logger.info("  CONTAINER_PORT  = %s", CONTAINER_PORT)
-    logger.info("  PORT_RANGE      = %s - %s (%d slots)", PORT_MIN, PORT_MAX, PORT_MAX - PORT_MIN + 1)
+    for node in NODES:
+        logger.info("  NODE %-10s = %s host=%s %s=%d-%d (%d slots)", node.name, node.url, node.host,
+                    "ports" if PUBLISH_PORTS else "sessions", node.port_min, node.port_max, node.capacity)
+    logger.info("  PLACEMENT       = %s", nodes.PLACEMENT_POLICY)
     logger.info("  APPNAME         = %s", APPNAME)
     logger.info("  WIDTH           = %s", WIDTH)
     logger.info("  HEIGHT          = %s", HEIGHT)
     logger.info("  NETWORK_NAME    = %s", NETWORK_NAME)
     logger.info("  NETWORK_SUBNET  = %s", NETWORK_SUBNET)
+    logger.info("  PUBLISH_PORTS   = %s", PUBLISH_PORTS)
+    logger.info("  LIMITS          = memory=%s cpus=%s",
+                CONTAINER_MEMORY_LIMIT or "unlimited", CONTAINER_CPUS or "unlimited")
     logger.info("====================================")
 
 
-def ensure_network() -> str:
-    """Ensure the dedicated Docker network exists. Create it if needed."""
+# ---------------------------------------------------------------------------
+# Nodes
+# ---------------------------------------------------------------------------
+
+def node_for_port(port: int) -> nodes.Node:
+    """Node whose port range contains port (ranges never overlap)."""
+    for node in NODES:
+        if node.owns(port):
+            return node
+    raise ValueError(f"Port {port} is outside the port range of every node")
+
+
+def access_url(port: int) -> str:
+    """URL a client is redirected to for the container published on port (see proxy.session_url())."""
+    return f"https://{node_for_port(port).host}:{port}"
+
+
+def total_slots() -> int:
+    """Number of ports (= containers) across all nodes."""
+    return sum(node.capacity for node in NODES)
+
+
+def _node_of(container_id: str) -> nodes.Node:
+    """Node running container_id; asks each node once if it is not known yet."""
+    if len(NODES) == 1:
+        return NODES[0]
+    node = _container_nodes.get(container_id)
+    if node is not None:
+        return node
+    for node in NODES:
+        try:
+            node.client.api.inspect_container(container_id)
+        except docker.errors.APIError:
+            continue
+        _container_nodes[container_id] = node
+        return node
+    # Not found anywhere: the caller gets its NotFound from the first node
+    return NODES[0]
+
+
+async def _anode_of(container_id: str) -> nodes.Node:
+    """Async _node_of()."""
+    if len(NODES) == 1:
+        return NODES[0]
+    node = _container_nodes.get(container_id)
+    if node is not None:
+        return node
+    for node in NODES:
+        try:
+            await docker_async.get_client(node.url).inspect_container(container_id)
+        except docker.errors.APIError:
+            continue
+        _container_nodes[container_id] = node
+        return node
+    return NODES[0]
+
+
+def _start_events() -> None:
+    """Make sure the events subscriber of every node is running."""
+    for node in NODES:
+        events.start(node.client, node.name)
+
+
+@tracing.traced("containers.ensure_network")
+def ensure_network(node: nodes.Node | None = None) -> str:
+    """Ensure the dedicated Docker network exists on node. Create it if needed."""
+    node = node or NODES[0]
     try:
-        network = client.networks.get(NETWORK_NAME)
-        logger.info("[NETWORK] Network already exists: name=%s id=%s", NETWORK_NAME, network.id[:12])
+        network = node.client.networks.get(NETWORK_NAME)
+        logger.info("[NETWORK] Network already exists: name=%s id=%s node=%s", NETWORK_NAME, network.id[:12], node.name)
         return NETWORK_NAME
     except docker.errors.NotFound:
         pass
 
-    logger.info("[NETWORK] Creating network: name=%s subnet=%s", NETWORK_NAME, NETWORK_SUBNET)
+    logger.info("[NETWORK] Creating network: name=%s subnet=%s node=%s", NETWORK_NAME, NETWORK_SUBNET, node.name)
 
     ipam_pool = docker.types.IPAMPool(subnet=NETWORK_SUBNET)
     ipam_config = docker.types.IPAMConfig(pool_configs=[ipam_pool])
 
-    network = client.networks.create(
+    network = node.client.networks.create(
         NETWORK_NAME,
         driver="bridge",
         ipam=ipam_config,
@@ -62,11 +264,68 @@ def ensure_network() -> str:
     return NETWORK_NAME
 
 
-def is_container_healthy(container_id: str) -> bool:
+def _cache_status(container_id: str, status: str) -> None:
+    with _status_lock:
+        _status_cache[container_id] = (status, time.monotonic())
+
+
+def _forget_status(container_id: str) -> None:
+    with _status_lock:
+        _status_cache.pop(container_id, None)
+
+
+def _cached_status(container_id: str) -> str | None:
+    """Return the cached status if it can be trusted, else None.
+
+    An entry is trusted while the events stream that keeps it up to date has
+    been connected since before the entry was written (bounded by
+    HEALTH_CACHE_MAX_AGE_SECONDS), or for HEALTH_CACHE_TTL_SECONDS otherwise.
+    """
+    with _status_lock:
+        entry = _status_cache.get(container_id)
+    if entry is None:
+        return None
+    status, seen_at = entry
+    age = time.monotonic() - seen_at
+    since = events.connected_since()
+    if since is not None and seen_at >= since:
+        return status if age < HEALTH_CACHE_MAX_AGE_SECONDS else None
+    return status if age < HEALTH_CACHE_TTL_SECONDS else None
+
+
+def _on_status_event(event: dict) -> None:
+    action = event.get("Action") or event.get("status") or ""
+    status = _EVENT_STATUS.get(action.split(":", 1)[0])
+    container_id = event.get("id") or event.get("Actor", {}).get("ID", "")
+    if status is None or not container_id:
+        return
+    if status == "removed":
+        _forget_status(container_id)
+        _container_nodes.pop(container_id, None)
+        return
+    _cache_status(container_id, status)
+
+
+@tracing.traced("containers.is_container_healthy")
+def is_container_healthy(container_id: str, allow_paused: bool = False) -> bool:
+    """True if the container is running (or paused, with allow_paused).
+
+    Answered from the status cache when it is fresh; otherwise the
+    container is inspected and the result cached.
+    """
+    ok = ("running", "paused") if allow_paused else ("running",)
+    _start_events()
+    status = _cached_status(container_id)
+    if status is not None:
+        logger.debug("[HEALTH CHECK] container=%s status=%s (cached)", container_id[:12], status, extra=SAMPLED)
+        return status in ok
+
     try:
-        container = client.containers.get(container_id)
-        healthy = container.status == "running"
-        logger.debug("[HEALTH CHECK] container=%s status=%s healthy=%s", container_id[:12], container.status, healthy)
+        container = _node_of(container_id).client.containers.get(container_id)
+        healthy = container.status in ok
+        _cache_status(container_id, container.status)
+        logger.debug("[HEALTH CHECK] container=%s status=%s healthy=%s", container_id[:12], container.status, healthy,
+                     extra=SAMPLED)
         return healthy
     except docker.errors.NotFound:
         logger.warning("[HEALTH CHECK] container=%s NOT FOUND", container_id[:12])
@@ -76,40 +335,130 @@ def is_container_healthy(container_id: str) -> bool:
         return False
 
 
-def create_container(client_id: str, port: int) -> dict:
-    container_name = f"vnc_{client_id}"
+def _labels(client_id: str, port: int) -> dict:
+    """Ownership/metadata labels of a new container (client_id "__pool__" for the pool).
+
+    Labels are immutable: a pool container keeps pool=true after it is
+    claimed (the claim renames it to vnc_{cpf} instead, see rename_claimed_container()).
+    """
+    return {
+        MANAGED_LABEL: "true",
+        INSTANCE_LABEL: ORCHESTRATOR_INSTANCE,
+        CLIENT_LABEL: client_id,
+        PORT_LABEL: str(port),
+        POOL_LABEL: "true" if client_id == "__pool__" else "false",
+        CREATED_LABEL: datetime.now().isoformat(),
+    }
+
+
+def _run_kwargs(container_name: str, port: int, network_name: str, client_id: str) -> dict:
+    """Arguments for client.containers.run() shared by every container we create."""
+    kwargs = {
+        "name": container_name,
+        "environment": {
+            "APPNAME": APPNAME,
+            "WIDTH": WIDTH,
+            "HEIGHT": HEIGHT,
+        },
+        "labels": _labels(client_id, port),
+        "network": network_name,
+        "detach": True,
+        "restart_policy": {"Name": "unless-stopped"},
+    }
+    if PUBLISH_PORTS:
+        kwargs["ports"] = {f"{CONTAINER_PORT}/tcp": ("0.0.0.0", port)}
+    if CONTAINER_MEMORY_LIMIT:
+        kwargs["mem_limit"] = CONTAINER_MEMORY_LIMIT
+    if CONTAINER_CPUS:
+        kwargs["nano_cpus"] = int(CONTAINER_CPUS * 1e9)
+    return kwargs
+
+
+def _api_create_body(kwargs: dict) -> dict:
+    """Translate _run_kwargs() into a raw Engine API /containers/create body."""
+    host_config = {
+        "PortBindings": {
+            spec: [{"HostIp": host_ip, "HostPort": str(host_port)}]
+            for spec, (host_ip, host_port) in kwargs.get("ports", {}).items()
+        },
+        "NetworkMode": kwargs["network"],
+        "RestartPolicy": kwargs["restart_policy"],
+    }
+    if "mem_limit" in kwargs:
+        host_config["Memory"] = docker.utils.parse_bytes(kwargs["mem_limit"])
+    if "nano_cpus" in kwargs:
+        host_config["NanoCpus"] = kwargs["nano_cpus"]
+    return {
+        "Image": IMAGE,
+        "Env": [f"{k}={v}" for k, v in kwargs["environment"].items()],
+        "Labels": kwargs["labels"],
+        "ExposedPorts": {f"{CONTAINER_PORT}/tcp": {}},
+        "HostConfig": host_config,
+    }
+
 
-    logger.info("[CREATE] Starting creation: name=%s port=%d image=%s", container_name, port, IMAGE[:50])
+def _check_leftover_owner(container_name: str, labels: dict) -> None:
+    """Refuse to remove a same-named container that belongs to another orchestrator instance."""
+    owner = (labels or {}).get(INSTANCE_LABEL)
+    if owner is not None and owner != ORCHESTRATOR_INSTANCE:
+        raise RuntimeError(f"Container name {container_name} is taken by orchestrator instance {owner!r}")
+
+
+def _held_by_session(container_name: str, container_id: str) -> bool:
+    """True if the same-named container is a state record's session, not a leftover.
+
+    A container recycled by reset (or a claimed pool container) keeps its
+    old name until it is renamed, after its record already moved to the
+    new client. Such a container is parked (see park_container()) instead
+    of removed, which frees the name without touching the session.
+    """
+    rec = state.find_by_container(container_id)
+    if rec is None:
+        return False
+    logger.info("[CREATE] Container %s (id=%s) now belongs to CPF=%s, parking it to free the name",
+                container_name, container_id[:12], rec["client_id"])
+    return True
 
-    # Remove leftover container with same name if it exists
+
+@tracing.traced("containers.remove_leftover")
+def _remove_leftover(container_name: str, node: nodes.Node) -> None:
+    """Remove a container left behind with the same name on node, if any."""
     try:
-        old = client.containers.get(container_name)
+        old = node.client.containers.get(container_name)
+        _check_leftover_owner(container_name, old.labels)
+        if _held_by_session(container_name, old.id):
+            # By name: NotFound (handled below) if its new owner renamed it first
+            park_container(old.id, container_name)
+            return
         logger.warning("[CREATE] Found leftover container %s (id=%s), removing...", container_name, old.id[:12])
         old.remove(force=True)
         logger.info("[CREATE] Leftover container %s removed", container_name)
     except docker.errors.NotFound:
         logger.debug("[CREATE] No leftover container found for %s", container_name)
 
-    network_name = ensure_network()
+
+@tracing.traced("containers.create_container")
+def create_container(client_id: str, port: int) -> dict:
+    container_name = f"vnc_{client_id}"
+
+    node = node_for_port(port)
+
+    logger.info("[CREATE] Starting creation: name=%s port=%d node=%s image=%s",
+                container_name, port, node.name, IMAGE[:50])
+
+    _remove_leftover(container_name, node)
+
+    network_name = ensure_network(node)
 
     logger.info("[CREATE] Running docker create: %s -> %s:%d network=%s env=[APPNAME=%s, WIDTH=%s, HEIGHT=%s]",
                 container_name, CONTAINER_PORT, port, network_name, APPNAME, WIDTH, HEIGHT)
 
-    container = client.containers.run(
-        IMAGE,
-        name=container_name,
-        ports={f"{CONTAINER_PORT}/tcp": ("0.0.0.0", port)},
-        environment={
-            "APPNAME": APPNAME,
-            "WIDTH": WIDTH,
-            "HEIGHT": HEIGHT,
-        },
-        network=network_name,
-        detach=True,
-        restart_policy={"Name": "unless-stopped"},
-    )
+    with tracing.span("containers.run"):
+        container = node.client.containers.run(IMAGE, **_run_kwargs(container_name, port, network_name, client_id))
+    _container_nodes[container.id] = node
 
-    logger.info("[CREATE] Container CREATED: name=%s id=%s port=%d", container_name, container.id[:12], port)
+    logger.info("[CREATE] Container CREATED: name=%s id=%s port=%d node=%s",
+                container_name, container.id[:12], port, node.name)
 
     wait_container_ready(container.id, port)
 
@@ -120,40 +469,29 @@ def create_container(client_id: str, port: int) -> dict:
     }
 
 
+@tracing.traced("containers.create_pool_container")
 def create_pool_container(port: int) -> dict:
     """Create a warm pool container (no CPF assigned yet)."""
     container_name = f"vnc_pool_{port}"
 
-    logger.info("[CREATE] Starting POOL creation: name=%s port=%d image=%s", container_name, port, IMAGE[:50])
+    node = node_for_port(port)
 
-    # Remove leftover container with same name if it exists
-    try:
-        old = client.containers.get(container_name)
-        logger.warning("[CREATE] Found leftover pool container %s (id=%s), removing...", container_name, old.id[:12])
-        old.remove(force=True)
-    except docker.errors.NotFound:
-        logger.debug("[CREATE] No leftover pool container found for %s", container_name)
+    logger.info("[CREATE] Starting POOL creation: name=%s port=%d node=%s image=%s",
+                container_name, port, node.name, IMAGE[:50])
 
-    network_name = ensure_network()
+    _remove_leftover(container_name, node)
+
+    network_name = ensure_network(node)
 
     logger.info("[CREATE] Running docker create (pool): %s -> %s:%d network=%s",
                 container_name, CONTAINER_PORT, port, network_name)
 
-    container = client.containers.run(
-        IMAGE,
-        name=container_name,
-        ports={f"{CONTAINER_PORT}/tcp": ("0.0.0.0", port)},
-        environment={
-            "APPNAME": APPNAME,
-            "WIDTH": WIDTH,
-            "HEIGHT": HEIGHT,
-        },
-        network=network_name,
-        detach=True,
-        restart_policy={"Name": "unless-stopped"},
-    )
+    with tracing.span("containers.run"):
+        container = node.client.containers.run(IMAGE, **_run_kwargs(container_name, port, network_name, "__pool__"))
+    _container_nodes[container.id] = node
 
-    logger.info("[CREATE] Pool container CREATED: name=%s id=%s port=%d", container_name, container.id[:12], port)
+    logger.info("[CREATE] Pool container CREATED: name=%s id=%s port=%d node=%s",
+                container_name, container.id[:12], port, node.name)
 
     wait_container_ready(container.id, port)
 
@@ -164,19 +502,219 @@ def create_pool_container(port: int) -> dict:
     }
 
 
+@tracing.traced("containers.pause_container")
+def pause_container(container_id: str) -> None:
+    """Freeze a ready pool container (cgroup freezer) until it is claimed."""
+    _node_of(container_id).client.containers.get(container_id).pause()
+    _cache_status(container_id, "paused")
+    logger.info("[POOL] Container %s PAUSED", container_id[:12])
+
+
+@tracing.traced("containers.unpause_container")
+def unpause_container(container_id: str) -> None:
+    """Resume a container if it is paused (no-op otherwise)."""
+    if _cached_status(container_id) in ("running", "exited"):
+        return
+    try:
+        container = _node_of(container_id).client.containers.get(container_id)
+        if container.status != "paused":
+            return
+        start = time.time()
+        container.unpause()
+        _cache_status(container_id, "running")
+        logger.info("[POOL] Container %s UNPAUSED (%.3fs)", container_id[:12], time.time() - start)
+    except docker.errors.NotFound:
+        logger.warning("[POOL] Container %s not found, cannot unpause", container_id[:12])
+    except docker.errors.APIError as e:
+        logger.error("[POOL] Failed to unpause container %s: %s", container_id[:12], e)
+
+
+@tracing.traced("containers.rename_claimed_container")
+def rename_claimed_container(container_id: str, client_id: str) -> str:
+    """Rename a claimed pool container to vnc_{client_id} and return the new name.
+
+    Labels cannot change after creation, so the name is what tells a
+    claimed pool container apart from a free one when records are rebuilt
+    from Docker.
+    """
+    container_name = f"vnc_{client_id}"
+    node = _node_of(container_id)
+    try:
+        node.client.api.rename(container_id, container_name)
+    except docker.errors.APIError as e:
+        if e.status_code != 409:
+            raise
+        # Name still held by a dead container of this client
+        _remove_leftover(container_name, node)
+        node.client.api.rename(container_id, container_name)
+    _forget_status(container_id)
+    logger.info("[CREATE] Claimed container %s renamed to %s", container_id[:12], container_name)
+    return container_name
+
+
+@tracing.traced("containers.park_container")
+def park_container(container_id: str, current_name: str) -> str:
+    """Rename a container that changed owner to vnc_reset_{id}.
+
+    After a reset takeover the container keeps the victim's vnc_{cpf} name
+    until reset_container() renames it. When something needs that name in
+    the meantime (the victim coming back, or a chain of takeovers), the
+    container is parked instead of removed as a leftover.
+
+    The container is addressed by current_name, so the rename fails with
+    NotFound if its owner renamed it first, and never renames it twice.
+    """
+    container_name = f"{PARKED_PREFIX}{container_id[:12]}"
+    _node_of(container_id).client.api.rename(current_name, container_name)
+    _forget_status(container_id)
+    logger.info("[RESET] Container %s renamed to %s", container_id[:12], container_name)
+    return container_name
+
+
+@tracing.traced("containers.reset_container")
+def reset_container(container_id: str, client_id: str, port: int) -> dict:
+    """Hand a running container over to another client without recreating it.
+
+    Renames it to vnc_{client_id} and starts a fresh browser session, either
+    with RESET_COMMAND or with `docker restart`, then waits until it is
+    healthy again. The image, network and port binding are kept, so this
+    skips the container create/start of create_container().
+    """
+    container_name = f"vnc_{client_id}"
+
+    logger.info("[RESET] Resetting container %s for CPF=%s port=%d", container_id[:12], client_id, port)
+
+    node = _node_of(container_id)
+    _remove_leftover(container_name, node)
+
+    container = node.client.containers.get(container_id)
+    old_name = container.name
+    container.rename(container_name)
+    _forget_status(container_id)
+
+    if RESET_COMMAND:
+        result = container.exec_run(shlex.split(RESET_COMMAND))
+        logger.info("[RESET] Ran '%s' in %s (exit=%s)", RESET_COMMAND, container_name, result.exit_code)
+    else:
+        container.restart(timeout=RESET_STOP_TIMEOUT_SECONDS)
+        logger.info("[RESET] Restarted container %s", container_name)
+
+    logger.info("[RESET] Container RESET: %s -> %s id=%s port=%d", old_name, container_name, container_id[:12], port)
+
+    wait_container_ready(container_id, port)
+
+    return {
+        "container_id": container_id,
+        "container_name": container_name,
+        "port": port,
+    }
+
+
+class _HealthWaiter:
+    """One wait_container_ready() call waiting for a health_status event."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.health: str | None = None
+
+    def notify(self, health: str) -> None:
+        self.health = health
+        self.event.set()
+
+
+class _AsyncHealthWaiter:
+    """Same as _HealthWaiter for await_container_ready(), woken on its event loop."""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+        self.health: str | None = None
+
+    def notify(self, health: str) -> None:
+        self.loop.call_soon_threadsafe(self._set, health)
+
+    def _set(self, health: str) -> None:
+        self.health = health
+        self.event.set()
+
+
+def _on_health_event(event: dict) -> None:
+    action = event.get("Action") or event.get("status") or ""
+    if not action.startswith("health_status"):
+        return
+    container_id = event.get("id") or event.get("Actor", {}).get("ID", "")
+    health = action.split(":", 1)[1].strip() if ":" in action else ""
+    with _waiters_lock:
+        waiters = list(_health_waiters.get(container_id, ()))
+    for waiter in waiters:
+        waiter.notify(health)
+
+
+events.subscribe(_on_health_event)
+events.subscribe(_on_status_event)
+
+
+def _add_waiter(container_id: str, waiter) -> None:
+    with _waiters_lock:
+        _health_waiters.setdefault(container_id, []).append(waiter)
+
+
+def _remove_waiter(container_id: str, waiter) -> None:
+    with _waiters_lock:
+        remaining = [w for w in _health_waiters.get(container_id, ()) if w is not waiter]
+        if remaining:
+            _health_waiters[container_id] = remaining
+        else:
+            _health_waiters.pop(container_id, None)
+
+
+def _health_from_attrs(attrs: dict) -> str:
+    return attrs.get("State", {}).get("Health", {}).get("Status", "none")
+
+
+def _inspect_health(container_id: str) -> str:
+    return _health_from_attrs(_node_of(container_id).client.containers.get(container_id).attrs)
+
+
+def _ready_result(healthy: bool) -> str:
+    return "healthy" if healthy else "not_ready"
+
+
+@tracing.traced("containers.wait_container_ready")
+@metrics.timed(metrics.READY_SECONDS, _ready_result)
 def wait_container_ready(container_id: str, port: int, timeout: int = 60) -> bool:
-    """Wait until the Docker healthcheck reports 'healthy'."""
+    """Wait until the Docker healthcheck reports 'healthy'.
+
+    Woken by the shared Docker events subscriber (events.py) as soon as the
+    daemon reports health_status for the container. The container is still
+    inspected once up front (in case it is already healthy) and then every
+    WAIT_FALLBACK_POLL_SECONDS, or every second while the events stream is down.
+    """
     logger.info("[WAIT] Waiting for container %s to be healthy (timeout=%ds)...", container_id[:12], timeout)
+    _start_events()
+
+    waiter = _HealthWaiter()
+    _add_waiter(container_id, waiter)
+
     start = time.time()
-    while time.time() - start < timeout:
-        try:
-            container = client.containers.get(container_id)
-            health = container.attrs.get("State", {}).get("Health", {}).get("Status", "none")
+    try:
+        while time.time() - start < timeout:
+            if waiter.health is not None:
+                health = waiter.health
+                waiter.health = None
+                waiter.event.clear()
+            else:
+                try:
+                    health = _inspect_health(container_id)
+                except docker.errors.NotFound:
+                    logger.warning("[WAIT] Container %s disappeared while waiting", container_id[:12])
+                    return False
             logger.debug("[WAIT] container=%s health=%s (%.1fs)", container_id[:12], health, time.time() - start)
 
             if health == "healthy":
                 elapsed = round(time.time() - start, 1)
                 logger.info("[WAIT] Container %s is HEALTHY (took %.1fs)", container_id[:12], elapsed)
+                _record_boot_time(time.time() - start)
                 return True
 
             if health == "unhealthy":
@@ -184,22 +722,37 @@ def wait_container_ready(container_id: str, port: int, timeout: int = 60) -> boo
                 logger.warning("[WAIT] Container %s is UNHEALTHY after %.1fs", container_id[:12], elapsed)
                 return False
 
-        except docker.errors.NotFound:
-            logger.warning("[WAIT] Container %s disappeared while waiting", container_id[:12])
-            return False
-
-        time.sleep(1)
+            poll = WAIT_FALLBACK_POLL_SECONDS if events.is_connected() else 1
+            waiter.event.wait(min(poll, max(0, timeout - (time.time() - start))))
+    finally:
+        _remove_waiter(container_id, waiter)
 
     logger.warning("[WAIT] Container %s not healthy after %ds, redirecting anyway", container_id[:12], timeout)
     return False
 
 
+def _record_boot_time(seconds: float) -> None:
+    global _boot_seconds
+    if _boot_seconds is None:
+        _boot_seconds = seconds
+    else:
+        _boot_seconds = BOOT_TIME_ALPHA * seconds + (1 - BOOT_TIME_ALPHA) * _boot_seconds
+
+
+def expected_boot_seconds() -> float:
+    """Smoothed time a new container takes to become healthy (EWMA)."""
+    return _boot_seconds if _boot_seconds is not None else DEFAULT_BOOT_SECONDS
+
+
+@tracing.traced("containers.remove_container")
 def remove_container(container_id: str) -> None:
     try:
-        container = client.containers.get(container_id)
+        container = _node_of(container_id).client.containers.get(container_id)
         container_name = container.name
         logger.info("[REMOVE] Killing container: name=%s id=%s status=%s", container_name, container_id[:12], container.status)
         container.remove(force=True)
+        _forget_status(container_id)
+        _container_nodes.pop(container_id, None)
         logger.info("[REMOVE] Container REMOVED: name=%s id=%s", container_name, container_id[:12])
     except docker.errors.NotFound:
         logger.warning("[REMOVE] Container %s not found (already removed?)", container_id[:12])
@@ -207,38 +760,348 @@ def remove_container(container_id: str) -> None:
         logger.error("[REMOVE] Failed to remove container %s: %s", container_id[:12], e)
 
 
-def allocate_port(used: set[int]) -> int | None:
-    logger.debug("[PORT] Used ports: %s", sorted(used))
-    for port in range(PORT_MIN, PORT_MAX + 1):
-        if port not in used:
-            logger.info("[PORT] Allocated port %d (used: %d/%d)", port, len(used), PORT_MAX - PORT_MIN + 1)
+# ---------------------------------------------------------------------------
+# Activity probes (see activity.py)
+# ---------------------------------------------------------------------------
+
+# TCP state ESTABLISHED in /proc/net/tcp
+_TCP_ESTABLISHED = "01"
+
+
+def count_vnc_connections(container_id: str) -> int:
+    """Established TCP connections to the noVNC port inside the container.
+
+    Reads /proc/net/tcp{,6} of the container's network namespace with one
+    exec, so it needs no tools in the image.
+    """
+    api = _node_of(container_id).client.api
+    exec_id = api.exec_create(container_id, ["sh", "-c", "cat /proc/net/tcp /proc/net/tcp6 2>/dev/null"])["Id"]
+    output = api.exec_start(exec_id).decode(errors="replace")
+    port = f":{int(CONTAINER_PORT):04X}"
+    count = 0
+    for line in output.splitlines():
+        fields = line.split()
+        # sl local_address rem_address st ...
+        if len(fields) > 3 and fields[1].endswith(port) and fields[3] == _TCP_ESTABLISHED:
+            count += 1
+    return count
+
+
+def network_bytes(container_id: str) -> int:
+    """Bytes received + sent by the container on all its interfaces (one-shot stats)."""
+    stats = _node_of(container_id).client.api.stats(container_id, stream=False, one_shot=True)
+    return sum(net.get("rx_bytes", 0) + net.get("tx_bytes", 0) for net in (stats.get("networks") or {}).values())
+
+
+# ---------------------------------------------------------------------------
+# Async API (Engine API over the unix socket, see docker_async.py)
+#
+# Used by the ASGI entry point so a cold start does not hold an OS thread
+# while the container boots. Sync code uses the docker SDK functions above.
+# ---------------------------------------------------------------------------
+
+@tracing.traced("containers.aensure_network")
+async def aensure_network(node: nodes.Node | None = None) -> str:
+    """Async ensure_network()."""
+    node = node or NODES[0]
+    api = docker_async.get_client(node.url)
+    try:
+        await api.inspect_network(NETWORK_NAME)
+        return NETWORK_NAME
+    except docker.errors.NotFound:
+        pass
+
+    logger.info("[NETWORK] Creating network: name=%s subnet=%s", NETWORK_NAME, NETWORK_SUBNET)
+    network = await api.create_network({
+        "Name": NETWORK_NAME,
+        "Driver": "bridge",
+        "CheckDuplicate": True,
+        "IPAM": {"Config": [{"Subnet": NETWORK_SUBNET}]},
+    })
+    logger.info("[NETWORK] Network CREATED: name=%s id=%s subnet=%s", NETWORK_NAME, network["Id"][:12], NETWORK_SUBNET)
+    return NETWORK_NAME
+
+
+@tracing.traced("containers.ais_container_healthy")
+async def ais_container_healthy(container_id: str) -> bool:
+    """Async is_container_healthy() (shares the same status cache)."""
+    status = _cached_status(container_id)
+    if status is not None:
+        return status == "running"
+    try:
+        node = await _anode_of(container_id)
+        attrs = await docker_async.get_client(node.url).inspect_container(container_id)
+    except docker.errors.NotFound:
+        logger.warning("[HEALTH CHECK] container=%s NOT FOUND", container_id[:12])
+        return False
+    except docker.errors.APIError as e:
+        logger.error("[HEALTH CHECK] container=%s API ERROR: %s", container_id[:12], e)
+        return False
+    status = attrs.get("State", {}).get("Status")
+    _cache_status(container_id, status)
+    logger.debug("[HEALTH CHECK] container=%s status=%s", container_id[:12], status, extra=SAMPLED)
+    return status == "running"
+
+
+@tracing.traced("containers.aremove_container")
+async def aremove_container(container_id: str) -> None:
+    """Async remove_container()."""
+    try:
+        node = await _anode_of(container_id)
+        await docker_async.get_client(node.url).remove_container(container_id, force=True)
+        _forget_status(container_id)
+        _container_nodes.pop(container_id, None)
+        logger.info("[REMOVE] Container REMOVED: id=%s", container_id[:12])
+    except docker.errors.NotFound:
+        logger.warning("[REMOVE] Container %s not found (already removed?)", container_id[:12])
+    except docker.errors.APIError as e:
+        logger.error("[REMOVE] Failed to remove container %s: %s", container_id[:12], e)
+
+
+@tracing.traced("containers.aremove_leftover")
+async def _aremove_leftover(container_name: str, node: nodes.Node) -> None:
+    """Async _remove_leftover()."""
+    api = docker_async.get_client(node.url)
+    try:
+        old = await api.inspect_container(container_name)
+        _check_leftover_owner(container_name, old.get("Config", {}).get("Labels"))
+        if await asyncio.to_thread(_held_by_session, container_name, old["Id"]):
+            await api.rename_container(container_name, f"{PARKED_PREFIX}{old['Id'][:12]}")
+            _forget_status(old["Id"])
+            return
+        await api.remove_container(old["Id"], force=True)
+        logger.warning("[CREATE] Leftover container %s removed", container_name)
+    except docker.errors.NotFound:
+        logger.debug("[CREATE] No leftover container found for %s", container_name)
+
+
+@tracing.traced("containers.acreate_container")
+async def acreate_container(client_id: str, port: int) -> dict:
+    """Async create_container(): create, start and wait for health without blocking a thread."""
+    node = node_for_port(port)
+    api = docker_async.get_client(node.url)
+    container_name = f"vnc_{client_id}"
+
+    logger.info("[CREATE] Starting creation (async): name=%s port=%d node=%s image=%s",
+                container_name, port, node.name, IMAGE[:50])
+
+    await _aremove_leftover(container_name, node)
+
+    network_name = await aensure_network(node)
+
+    body = _api_create_body(_run_kwargs(container_name, port, network_name, client_id))
+    try:
+        container_id = await api.create_container(container_name, body)
+    except docker.errors.NotFound as e:
+        if "No such image" not in str(e):
+            raise
+        # Like containers.run() on the sync path: pull the missing image once and retry
+        logger.info("[CREATE] Image %s not on node %s yet, pulling...", IMAGE, node.name)
+        await api.pull_image(IMAGE)
+        container_id = await api.create_container(container_name, body)
+    _container_nodes[container_id] = node
+    await api.start_container(container_id)
+
+    logger.info("[CREATE] Container CREATED: name=%s id=%s port=%d node=%s",
+                container_name, container_id[:12], port, node.name)
+
+    await await_container_ready(container_id, port)
+
+    return {
+        "container_id": container_id,
+        "container_name": container_name,
+        "port": port,
+    }
+
+
+@tracing.traced("containers.areset_container")
+async def areset_container(container_id: str, client_id: str, port: int) -> dict:
+    """Async reset_container()."""
+    node = await _anode_of(container_id)
+    api = docker_async.get_client(node.url)
+    container_name = f"vnc_{client_id}"
+
+    logger.info("[RESET] Resetting container %s for CPF=%s port=%d (async)", container_id[:12], client_id, port)
+
+    await _aremove_leftover(container_name, node)
+
+    await api.rename_container(container_id, container_name)
+    _forget_status(container_id)
+
+    if RESET_COMMAND:
+        exit_code = await api.exec_run(container_id, shlex.split(RESET_COMMAND))
+        logger.info("[RESET] Ran '%s' in %s (exit=%s)", RESET_COMMAND, container_name, exit_code)
+    else:
+        await api.restart_container(container_id, timeout=RESET_STOP_TIMEOUT_SECONDS)
+        logger.info("[RESET] Restarted container %s", container_name)
+
+    logger.info("[RESET] Container RESET: -> %s id=%s port=%d", container_name, container_id[:12], port)
+
+    await await_container_ready(container_id, port)
+
+    return {
+        "container_id": container_id,
+        "container_name": container_name,
+        "port": port,
+    }
+
+
+@tracing.traced("containers.await_container_ready")
+@metrics.timed(metrics.READY_SECONDS, _ready_result)
+async def await_container_ready(container_id: str, port: int, timeout: int = 60) -> bool:
+    """Async wait_container_ready(), woken by the same shared events subscriber."""
+    logger.info("[WAIT] Waiting (async) for container %s to be healthy (timeout=%ds)...", container_id[:12], timeout)
+    _start_events()
+    api = docker_async.get_client((await _anode_of(container_id)).url)
+
+    waiter = _AsyncHealthWaiter()
+    _add_waiter(container_id, waiter)
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    try:
+        while loop.time() - start < timeout:
+            if waiter.health is not None:
+                health = waiter.health
+                waiter.health = None
+                waiter.event.clear()
+            else:
+                try:
+                    health = _health_from_attrs(await api.inspect_container(container_id))
+                except docker.errors.NotFound:
+                    logger.warning("[WAIT] Container %s disappeared while waiting", container_id[:12])
+                    return False
+
+            if health == "healthy":
+                elapsed = loop.time() - start
+                logger.info("[WAIT] Container %s is HEALTHY (took %.1fs)", container_id[:12], elapsed)
+                _record_boot_time(elapsed)
+                return True
+
+            if health == "unhealthy":
+                logger.warning("[WAIT] Container %s is UNHEALTHY after %.1fs", container_id[:12], loop.time() - start)
+                return False
+
+            poll = WAIT_FALLBACK_POLL_SECONDS if events.is_connected() else 1
+            try:
+                await asyncio.wait_for(waiter.event.wait(), min(poll, max(0, timeout - (loop.time() - start))))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        _remove_waiter(container_id, waiter)
+
+    logger.warning("[WAIT] Container %s not healthy after %ds, redirecting anyway", container_id[:12], timeout)
+    return False
+
+
+# ---------------------------------------------------------------------------
+# Ports / discovery
+# ---------------------------------------------------------------------------
+
+@tracing.traced("containers.allocate_port")
+def allocate_port(node: nodes.Node | None = None, among: list[nodes.Node] | None = None) -> int | None:
+    """Reserve a free host port on node, or on the node PLACEMENT_POLICY picks.
+
+    among limits the nodes PLACEMENT_POLICY picks from (None = all; an
+    empty list means no node may take it, and None is returned).
+    The port also decides where the container runs (node_for_port()). It
+    is leased in the state store until a record is added for it; callers
+    must state.release_port() it if the container is never created.
+    """
+    if among is None:
+        among = NODES
+    if node is None and not among:
+        return None
+    if node is not None or len(among) == 1:
+        candidates = [node or among[0]]
+    else:
+        candidates = nodes.rank(among, state.used_ports())
+        if not candidates:
+            logger.warning("[PORT] No node has room for another container (policy=%s)", nodes.PLACEMENT_POLICY)
+            return None
+
+    for candidate in candidates:
+        port = state.reserve_port(candidate.port_min, candidate.port_max)
+        if port is not None:
+            logger.info("[PORT] Allocated port %d on node %s (range %d-%d)",
+                        port, candidate.name, candidate.port_min, candidate.port_max, extra=SAMPLED)
             return port
-    logger.warning("[PORT] No free ports available! All %d slots in use", PORT_MAX - PORT_MIN + 1)
+
+    logger.warning("[PORT] No free ports available! All %d slots in use", sum(c.capacity for c in candidates))
     return None
 
 
-def list_running_orchestrated_containers() -> dict[str, dict]:
-    """Return a map of container_name -> {id, port} for all running vnc_* containers."""
+def snapshot_orchestrated_containers(unreachable: set[str] | None = None,
+                                     known: set[str] | None = None) -> dict[str, dict]:
+    """Return container_id -> {name, status, port, client_id, created_at, node}, one API call per node.
+
+    Lists every container (running or not) of this ORCHESTRATOR_INSTANCE by
+    label and derives the record fields from the labels, so the state can
+    be rebuilt from Docker alone; it also primes the status cache. The
+    owner is read from the name (vnc_pool_* = pool, vnc_{cpf}), since a
+    claimed pool container is renamed but keeps its creation labels.
+
+    known are the container ids of the previous state. When given, the list
+    matches the vnc_ name prefix instead, so the same call also returns
+    containers created before the labels existed; those unlabelled ones are
+    kept only if known. Nodes that could not be listed are added to
+    unreachable, if given.
+    """
+    if known is None:
+        filters = {"label": [MANAGED_LABEL, f"{INSTANCE_LABEL}={ORCHESTRATOR_INSTANCE}"]}
+    else:
+        filters = {"name": "vnc_"}
     result = {}
-    try:
-        for container in client.containers.list(filters={"name": "vnc_"}):
-            if container.status != "running":
-                logger.debug("[SCAN] Skipping container %s (status=%s)", container.name, container.status)
+    for node in NODES:
+        try:
+            # sparse: use the list response as is (no per-container inspect)
+            listed = node.client.containers.list(all=True, filters=filters, sparse=True)
+        except (docker.errors.APIError, docker.errors.DockerException, OSError) as e:
+            logger.error("[SCAN] Error listing containers on node %s: %s", node.name, e)
+            if unreachable is not None:
+                unreachable.add(node.name)
+            continue
+        for container in listed:
+            attrs = container.attrs
+            labels = attrs.get("Labels") or {}
+            if MANAGED_LABEL not in labels:
+                if known is None or container.id not in known:
+                    continue
+            elif labels.get(INSTANCE_LABEL) != ORCHESTRATOR_INSTANCE:
                 continue
-            name = container.name
-            ports = container.attrs.get("NetworkSettings", {}).get("Ports", {})
-            host_port = None
-            for binding in (ports.get(f"{CONTAINER_PORT}/tcp") or []):
-                host_port = int(binding["HostPort"])
-                break
-            if host_port is not None:
-                result[name] = {
-                    "container_id": container.id,
-                    "port": host_port,
-                }
-                logger.debug("[SCAN] Found running container: name=%s id=%s port=%d", name, container.id[:12], host_port)
-    except docker.errors.APIError as e:
-        logger.error("[SCAN] Error listing containers: %s", e)
+            name = (attrs.get("Names") or ["/"])[0].lstrip("/")
+            status = attrs.get("State", "")
+            result[container.id] = {
+                "name": name,
+                "status": status,
+                "port": _port_of(attrs, labels),
+                "client_id": _owner_of(name, labels),
+                "created_at": labels.get(CREATED_LABEL),
+                "node": node.name,
+            }
+            _container_nodes[container.id] = node
+            _cache_status(container.id, status)
 
-    logger.info("[SCAN] Found %d running vnc_* containers", len(result))
+    logger.info("[SCAN] Snapshot: %d orchestrated containers on %d nodes (%s)",
+                len(result), len(NODES), "by label" if known is None else "by name and label")
     return result
+
+
+def _port_of(attrs: dict, labels: dict) -> int | None:
+    if labels.get(PORT_LABEL):
+        return int(labels[PORT_LABEL])
+    for binding in attrs.get("Ports") or []:
+        if str(binding.get("PrivatePort")) == CONTAINER_PORT and binding.get("PublicPort"):
+            return int(binding["PublicPort"])
+    return None
+
+
+def _owner_of(name: str, labels: dict) -> str | None:
+    if name.startswith("vnc_pool_"):
+        return "__pool__"
+    if name.startswith(PARKED_PREFIX):
+        # Reset interrupted between owners: only a state record can tell
+        return None
+    if name.startswith("vnc_") and len(name) > 4:
+        return name[4:]
+    return labels.get(CLIENT_LABEL)
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any
+from urllib.parse import urlparse
+
+import aiohttp
+import docker
+
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+DOCKER_SOCKET = os.environ.get("DOCKER_SOCKET", "/var/run/docker.sock")
+DOCKER_API_VERSION = os.environ.get("DOCKER_API_VERSION", "v1.41")
+
+# Upper bound on concurrent requests to the daemon from this process
+DOCKER_ASYNC_MAX_CONNECTIONS = int(os.environ.get("DOCKER_ASYNC_MAX_CONNECTIONS", "100"))
+
+
+class AsyncDockerClient:
+    """Minimal asyncio Docker Engine API client over the unix socket.
+
+    Covers only what the orchestrator needs (create/start/inspect/remove/
+    rename/restart/exec, image pulls and networks). Errors are raised as
+    docker.errors.NotFound / docker.errors.APIError so callers can handle
+    both clients the same way.
+
+    url is a unix:// socket or a plain tcp:// (http) endpoint; TLS is not
+    supported.
+    """
+
+    def __init__(self, url: str = f"unix://{DOCKER_SOCKET}", api_version: str = DOCKER_API_VERSION):
+        parsed = urlparse(url)
+        if parsed.scheme == "unix":
+            self.socket_path = parsed.path
+            self.base_url = f"http://docker/{api_version}"
+        elif parsed.scheme in ("tcp", "http"):
+            self.socket_path = None
+            self.base_url = f"http://{parsed.netloc}/{api_version}"
+        else:
+            raise ValueError(f"Unsupported Docker endpoint for the async client: {url!r}")
+        self._session: aiohttp.ClientSession | None = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            if self.socket_path:
+                connector = aiohttp.UnixConnector(path=self.socket_path, limit=DOCKER_ASYNC_MAX_CONNECTIONS)
+            else:
+                connector = aiohttp.TCPConnector(limit=DOCKER_ASYNC_MAX_CONNECTIONS)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method: str, path: str, *, params: dict | None = None,
+                       body: Any = None, timeout: float | None = 60, raw: bool = False) -> Any:
+        start = time.perf_counter()
+        async with self._get_session().request(
+            method,
+            self.base_url + path,
+            params=params,
+            json=body,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as resp:
+            text = await resp.text()
+            elapsed = time.perf_counter() - start
+            metrics.observe_docker(method, path, elapsed)
+            tracing.record_docker(method, path, elapsed)
+            if resp.status == 404:
+                raise docker.errors.NotFound(f"{method} {path}: {_error_message(text)}")
+            if resp.status >= 400:
+                raise docker.errors.APIError(f"{method} {path} -> {resp.status}: {_error_message(text)}")
+            if raw:
+                return text
+            return json.loads(text) if text else None
+
+    # -----------------------------------------------------------------------
+    # Containers
+    # -----------------------------------------------------------------------
+
+    async def inspect_container(self, container_id: str) -> dict:
+        return await self._request("GET", f"/containers/{container_id}/json")
+
+    async def create_container(self, name: str, body: dict) -> str:
+        created = await self._request("POST", "/containers/create", params={"name": name}, body=body)
+        return created["Id"]
+
+    async def start_container(self, container_id: str) -> None:
+        await self._request("POST", f"/containers/{container_id}/start")
+
+    async def remove_container(self, container_id: str, force: bool = True) -> None:
+        await self._request("DELETE", f"/containers/{container_id}", params={"force": "1" if force else "0"})
+
+    async def rename_container(self, container_id: str, name: str) -> None:
+        await self._request("POST", f"/containers/{container_id}/rename", params={"name": name})
+
+    async def restart_container(self, container_id: str, timeout: int = 10) -> None:
+        await self._request("POST", f"/containers/{container_id}/restart", params={"t": str(timeout)},
+                            timeout=timeout + 60)
+
+    async def exec_run(self, container_id: str, cmd: list[str]) -> int | None:
+        """Run a command inside the container, wait for it and return its exit code."""
+        exec_id = (await self._request("POST", f"/containers/{container_id}/exec", body={"Cmd": cmd}))["Id"]
+        # Detached start returns no (multiplexed) output body; poll the exec until it exits
+        await self._request("POST", f"/exec/{exec_id}/start", body={"Detach": True, "Tty": False})
+        while True:
+            info = await self._request("GET", f"/exec/{exec_id}/json")
+            if not info.get("Running"):
+                return info.get("ExitCode")
+            await asyncio.sleep(0.2)
+
+    # -----------------------------------------------------------------------
+    # Images
+    # -----------------------------------------------------------------------
+
+    async def pull_image(self, image: str, timeout: float | None = 600) -> None:
+        """Pull image (repository[:tag], default tag latest) and wait until it is complete."""
+        repository, tag = docker.utils.parse_repository_tag(image)
+        # The daemon streams one JSON progress object per line; a failed pull
+        # still answers 200 and reports the error in the stream
+        text = await self._request("POST", "/images/create", params={"fromImage": repository, "tag": tag or "latest"},
+                                   timeout=timeout, raw=True)
+        for line in text.splitlines():
+            try:
+                progress = json.loads(line)
+            except ValueError:
+                continue
+            if progress.get("error"):
+                raise docker.errors.APIError(f"Pull of {image} failed: {progress['error']}")
+
+    # -----------------------------------------------------------------------
+    # Networks
+    # -----------------------------------------------------------------------
+
+    async def inspect_network(self, name: str) -> dict:
+        return await self._request("GET", f"/networks/{name}")
+
+    async def create_network(self, body: dict) -> dict:
+        return await self._request("POST", "/networks/create", body=body)
+
+
+def _error_message(text: str) -> str:
+    try:
+        return json.loads(text).get("message", text)
+    except (ValueError, AttributeError):
+        return text
+
+
+# ---------------------------------------------------------------------------
+# Shared client / event loop
+# ---------------------------------------------------------------------------
+
+_clients: dict[tuple[asyncio.AbstractEventLoop, str], AsyncDockerClient] = {}
+
+
+def get_client(url: str | None = None) -> AsyncDockerClient:
+    """Return the async client of the running event loop for a Docker endpoint.
+
+    aiohttp sessions are bound to the loop that created them, so the ASGI
+    server loop and the proxy's loop (proxy.py) each get their own.
+    url defaults to the local DOCKER_SOCKET.
+    """
+    key = (asyncio.get_running_loop(), url or f"unix://{DOCKER_SOCKET}")
+    if key not in _clients:
+        _clients[key] = AsyncDockerClient(key[1])
+    return _clients[key]
+
+
+async def close_clients() -> None:
+    """Close the sessions of every endpoint opened on the running event loop."""
+    loop = asyncio.get_running_loop()
+    for key in [k for k in _clients if k[0] is loop]:
+        await _clients.pop(key).close()
+
@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+from typing import Callable
+
+import docker
+
+logger = logging.getLogger(__name__)
+
+# Container events the shared subscriber listens to
+EVENT_FILTERS = {
+    "type": "container",
+    "event": ["health_status", "start", "die", "destroy", "pause", "unpause"],
+}
+
+# Delay before reconnecting after the events stream breaks
+RECONNECT_SECONDS = 2
+
+_listeners: list[Callable[[dict], None]] = []
+_lock = threading.Lock()
+
+# One subscriber thread per Docker engine (node name -> thread / connect time)
+_threads: dict[str, threading.Thread] = {}
+_connected_at: dict[str, float | None] = {}
+
+
+def subscribe(callback: Callable[[dict], None]) -> None:
+    """Register a callback invoked (on a subscriber thread) for every event."""
+    with _lock:
+        if callback not in _listeners:
+            _listeners.append(callback)
+
+
+def is_connected() -> bool:
+    """True while the events stream of every started engine is open."""
+    with _lock:
+        return bool(_connected_at) and all(t is not None for t in _connected_at.values())
+
+
+def connected_since() -> float | None:
+    """time.monotonic() since which every stream has been open (None if one is down).
+
+    Anything observed after this moment is kept up to date by events.
+    """
+    with _lock:
+        if not _connected_at or any(t is None for t in _connected_at.values()):
+            return None
+        return max(_connected_at.values())
+
+
+def start(client: docker.DockerClient, name: str = "local") -> None:
+    """Start the background subscriber of one engine for this process (idempotent)."""
+    with _lock:
+        thread = _threads.get(name)
+        if thread is not None and thread.is_alive():
+            return
+        _connected_at[name] = None
+        thread = threading.Thread(target=_run, args=(client, name), name=f"docker-events-{name}", daemon=True)
+        _threads[name] = thread
+        thread.start()
+
+
+def _run(client: docker.DockerClient, name: str) -> None:
+    while True:
+        try:
+            stream = client.events(decode=True, filters=EVENT_FILTERS)
+            with _lock:
+                _connected_at[name] = time.monotonic()
+            logger.info("[EVENTS] Subscribed to Docker events on node %s: %s", name, EVENT_FILTERS["event"])
+            for event in stream:
+                _dispatch(event)
+            logger.warning("[EVENTS] Docker events stream of node %s ended", name)
+        except Exception as e:
+            logger.warning("[EVENTS] Docker events stream of node %s failed: %s", name, e)
+        with _lock:
+            _connected_at[name] = None
+        time.sleep(RECONNECT_SECONDS)
+
+
+def _dispatch(event: dict) -> None:
+    with _lock:
+        listeners = list(_listeners)
+    for callback in listeners:
+        try:
+            callback(event)
+        except Exception:
+            logger.exception("[EVENTS] Listener %s failed", getattr(callback, "__name__", callback))
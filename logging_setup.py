@@ -0,0 +1,185 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import metrics
+
+# Minimum level written
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# "text" (one line per record, as before) or "json" (one JSON object per
+# line: ts, level, logger, tag, message, request_id, thread, exc)
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+LOG_FORMATS = ("text", "json")
+
+# Hand records to a background writer thread through a bounded queue, so
+# the request thread never formats or writes them. 0 = write synchronously.
+LOG_ASYNC = os.environ.get("LOG_ASYNC", "1") == "1"
+
+# Records waiting for the writer; when full new records are dropped (and
+# counted in orchestrator_log_records_dropped_total) instead of blocking
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+# High-frequency records (logged with extra=SAMPLED) pass at most
+# LOG_SAMPLE_BURST times per LOG_SAMPLE_SECONDS for each message template;
+# the first one after a suppressed stretch says how many were dropped
+LOG_SAMPLE_BURST = int(os.environ.get("LOG_SAMPLE_BURST", "20"))
+LOG_SAMPLE_SECONDS = float(os.environ.get("LOG_SAMPLE_SECONDS", "10"))
+
+_TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(name)s %(request_id)s: %(message)s"
+
+# extra= of a high-frequency log call (see LOG_SAMPLE_BURST)
+SAMPLED = {"sampled": True}
+
+# Correlation id of the request being served ("-" outside of a request)
+request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+_listener: logging.handlers.QueueListener | None = None
+_configured = False
+
+
+def configure() -> None:
+    """Install the logging pipeline on the root logger (idempotent)."""
+    global _listener, _configured
+    if _configured:
+        return
+    if LOG_FORMAT not in LOG_FORMATS:
+        raise ValueError(f"Unknown LOG_FORMAT: {LOG_FORMAT!r} (expected one of {LOG_FORMATS})")
+    _configured = True
+
+    writer = logging.StreamHandler(sys.stderr)
+    writer.setFormatter(JSONFormatter() if LOG_FORMAT == "json" else logging.Formatter(_TEXT_FORMAT))
+
+    if LOG_ASYNC:
+        handler: logging.Handler = _QueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _listener = logging.handlers.QueueListener(handler.queue, writer)
+        _listener.start()
+        atexit.register(_listener.stop)
+    else:
+        handler = writer
+    handler.addFilter(_ContextFilter())
+    handler.addFilter(_SampleFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+
+
+def new_request_id(incoming: str | None = None) -> str:
+    """Correlation id of a request: the caller's X-Request-ID if sane, else a new one."""
+    if incoming and len(incoming) <= 64 and incoming.isprintable():
+        return incoming
+    return uuid.uuid4().hex[:16]
+
+
+class lazy:
+    """Log argument computed only if the record is actually written.
+
+    logger.debug("[STATE] Used ports: %s", lazy(sorted, ports)) calls
+    sorted(ports) in the writer thread, and never when DEBUG is off.
+    """
+
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self) -> str:
+        return str(self.func(*self.args))
+
+    __repr__ = __str__
+
+
+# ---------------------------------------------------------------------------
+# Handlers, filters and formatters
+# ---------------------------------------------------------------------------
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the writer thread and never blocks."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stdlib version formats the message here, on the caller's
+        # thread. Only the traceback needs the caller (its frames are gone
+        # later); msg and args are formatted by the writer.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.stack_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_RECORDS_DROPPED.inc()
+
+
+class _ContextFilter(logging.Filter):
+    """Stamp every record with the correlation id of the current request."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class _SampleFilter(logging.Filter):
+    """Rate-limit records logged with extra=SAMPLED, per message template."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        # (logger name, msg template) -> [window start, passed, suppressed]
+        self._windows: dict[tuple[str, str], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sampled", False):
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= LOG_SAMPLE_SECONDS:
+                suppressed = window[2] if window else 0
+                self._windows[key] = window = [now, 0, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} (+{suppressed} similar suppressed)"
+            if window[1] >= LOG_SAMPLE_BURST:
+                window[2] += 1
+                return False
+            window[1] += 1
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record; the leading "[TAG]" of the message becomes "tag"."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        tag = None
+        if message.startswith("[") and "]" in message:
+            tag, _, rest = message[1:].partition("]")
+            message = rest.lstrip()
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "tag": tag,
+            "message": message,
+            "request_id": getattr(record, "request_id", "-"),
+            "thread": record.threadName,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
@@ -0,0 +1,224 @@
+import functools
+import inspect
+import logging
+import os
+import re
+import time
+from typing import Callable
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics served on /metrics. With several gunicorn workers set
+# PROMETHEUS_MULTIPROC_DIR to an empty directory shared by the workers (it
+# must be emptied before each start) so a scrape aggregates all of them.
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+
+# Buckets (seconds) for the request / boot histograms: reuse is milliseconds,
+# a cold start is tens of seconds
+_SLOW_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 20, 30, 45, 60, 90, 120)
+
+# Buckets (seconds) for single Docker API calls and state store operations
+_FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+ACCESS_SECONDS = Histogram(
+    "orchestrator_access_seconds",
+    "Time to answer /access, by action (reused, pool, created, reset, error)",
+    ["action"], buckets=_SLOW_BUCKETS,
+)
+READY_SECONDS = Histogram(
+    "orchestrator_container_ready_seconds",
+    "Time spent waiting for a new container to become healthy, by result",
+    ["result"], buckets=_SLOW_BUCKETS,
+)
+DOCKER_SECONDS = Histogram(
+    "orchestrator_docker_api_seconds",
+    "Latency of Docker Engine API calls, by operation",
+    ["operation"], buckets=_FAST_BUCKETS,
+)
+STATE_SECONDS = Histogram(
+    "orchestrator_state_seconds",
+    "Latency of state store operations, by operation",
+    ["operation"], buckets=_FAST_BUCKETS,
+)
+RECYCLES = Counter(
+    "orchestrator_recycles_total",
+    "Sessions recycled because all ports were taken, by RECYCLE_MODE",
+    ["mode"],
+)
+ADMISSIONS = Counter(
+    "orchestrator_admission_actions_total",
+    "New sessions refused, or idle sessions recycled, because every node was overloaded",
+    ["action"],
+)
+NODE_MEMORY_PERCENT = Gauge(
+    "orchestrator_node_memory_percent",
+    "Memory used by the orchestrator's containers, in percent of the node's memory",
+    ["node"], multiprocess_mode="mostrecent",
+)
+NODE_CPU_PERCENT = Gauge(
+    "orchestrator_node_cpu_percent",
+    "CPU used by the orchestrator's containers, in percent of the node's CPUs",
+    ["node"], multiprocess_mode="mostrecent",
+)
+SESSIONS_ACTIVE = Gauge(
+    "orchestrator_sessions_active",
+    "Client sessions with activity in the last activity sample",
+    multiprocess_mode="max",
+)
+LOG_RECORDS_DROPPED = Counter(
+    "orchestrator_log_records_dropped_total",
+    "Log records dropped because the log writer queue was full",
+)
+PROVISIONS_PENDING = Gauge(
+    "orchestrator_provisions_pending",
+    "Background provisioning jobs not finished yet (ACCESS_MODE=background)",
+    multiprocess_mode="livesum",
+)
+PROXY_REQUESTS = Counter(
+    "orchestrator_proxy_requests_total",
+    "Requests served by the session proxy, by kind (http, websocket, not_found)",
+    ["kind"],
+)
+PROXY_WEBSOCKETS = Gauge(
+    "orchestrator_proxy_websockets",
+    "Viewer websockets open through the session proxy",
+    multiprocess_mode="livesum",
+)
+POOL_CONTAINERS = Gauge(
+    "orchestrator_pool_containers",
+    "Warm pool containers ready to be claimed",
+    multiprocess_mode="mostrecent",
+)
+POOL_TARGET = Gauge(
+    "orchestrator_pool_target",
+    "Current warm pool target size",
+    multiprocess_mode="max",
+)
+POOL_BOOTING = Gauge(
+    "orchestrator_pool_booting",
+    "Warm pool containers being created",
+    multiprocess_mode="max",
+)
+PORTS_USED = Gauge(
+    "orchestrator_ports_used",
+    "Host ports held by a container record",
+    multiprocess_mode="mostrecent",
+)
+PORTS_TOTAL = Gauge(
+    "orchestrator_ports_total",
+    "Host ports available across all nodes",
+    multiprocess_mode="max",
+)
+
+# Engine API path (without the /vX.Y prefix) -> operation label. Ids and
+# names are dropped so the label set stays small.
+_DOCKER_PATHS = [
+    (re.compile(r"^/containers/create$"), "container_create"),
+    (re.compile(r"^/containers/json$"), "container_list"),
+    (re.compile(r"^/containers/[^/]+/json$"), "container_inspect"),
+    (re.compile(r"^/containers/[^/]+/(\w+)$"), "container_{0}"),
+    (re.compile(r"^/containers/[^/]+$"), "container_remove"),
+    (re.compile(r"^/exec/[^/]+/json$"), "exec_inspect"),
+    (re.compile(r"^/exec/[^/]+/(\w+)$"), "exec_{0}"),
+    (re.compile(r"^/images/create$"), "image_pull"),
+    (re.compile(r"^/networks/create$"), "network_create"),
+    (re.compile(r"^/networks/[^/]+$"), "network_inspect"),
+    (re.compile(r"^/events$"), "events"),
+    (re.compile(r"^/_ping$"), "ping"),
+    (re.compile(r"^/info$"), "info"),
+    (re.compile(r"^/version$"), "version"),
+]
+_VERSION_PREFIX = re.compile(r"^/v\d+\.\d+")
+
+
+# ---------------------------------------------------------------------------
+# Recording
+# ---------------------------------------------------------------------------
+
+def timed(histogram: Histogram, outcome: Callable[[object], str]) -> Callable:
+    """Decorator observing the duration of every call of a sync or async function.
+
+    The label value is outcome(return value), or "error" if the call raised.
+    """
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def awrapper(*args, **kwargs):
+                start = time.perf_counter()
+                label = "error"
+                try:
+                    result = await func(*args, **kwargs)
+                    label = outcome(result)
+                    return result
+                finally:
+                    histogram.labels(label).observe(time.perf_counter() - start)
+            return awrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            label = "error"
+            try:
+                result = func(*args, **kwargs)
+                label = outcome(result)
+                return result
+            finally:
+                histogram.labels(label).observe(time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def docker_operation(method: str, path: str) -> str:
+    """Map an Engine API request to its operation label (e.g. container_start)."""
+    path = _VERSION_PREFIX.sub("", path.split("?", 1)[0])
+    for pattern, name in _DOCKER_PATHS:
+        match = pattern.match(path)
+        if match:
+            if name == "container_remove" and method != "DELETE":
+                break
+            return name.format(*match.groups())
+    return "other"
+
+
+def observe_docker(method: str, path: str, seconds: float) -> None:
+    DOCKER_SECONDS.labels(docker_operation(method, path)).observe(seconds)
+
+
+def observe_docker_response(response, *args, **kwargs) -> None:
+    """requests response hook for the docker SDK client (time until headers)."""
+    try:
+        request = response.request
+        observe_docker(request.method, request.path_url, response.elapsed.total_seconds())
+    except Exception:
+        logger.debug("[METRICS] Could not record Docker API latency", exc_info=True)
+
+
+# ---------------------------------------------------------------------------
+# Exposition
+# ---------------------------------------------------------------------------
+
+def _refresh_gauges() -> None:
+    """Update the gauges read from the state store (shared by all workers)."""
+    import containers
+    import state
+
+    PORTS_TOTAL.set(containers.total_slots())
+    PORTS_USED.set(len(state.used_ports()))
+    POOL_CONTAINERS.set(len(state.find_unassigned()))
+
+
+def render() -> tuple[bytes, str]:
+    """Return the /metrics body and its content type."""
+    try:
+        _refresh_gauges()
+    except Exception as e:
+        logger.warning("[METRICS] Could not refresh state gauges: %s", e)
+
+    registry = REGISTRY
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
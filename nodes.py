@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import threading
+
+import docker
+
+logger = logging.getLogger(__name__)
+
+# Docker engines containers are placed on, as a JSON list. Each node has:
+#   name       unique node name (shown in /status and logs)
+#   url        Docker endpoint (unix:///var/run/docker.sock, tcp://10.0.0.5:2375)
+#   host       host name used in the /access redirect URL
+#   ports      host port range "5000-5099"; ranges must not overlap across
+#              nodes, so a record's port also tells which node runs it.
+#              Not needed behind the proxy (PROXY_PORT), where nothing is published
+#   sessions   session slots of the node behind the proxy (default:
+#              PROXY_SESSIONS_PER_NODE, see containers.py)
+#   pool       warm pool size on this node (default: an even share of the pool target)
+#   memory_mb  memory available for containers (default: the engine's MemTotal)
+#   cpus       CPUs available for containers (default: the engine's NCPU)
+# Empty = a single node on the local engine (DOCKER_HOST / socket, VNC_HOST,
+# PORT_RANGE_MIN..PORT_RANGE_MAX), i.e. the single-host behaviour.
+DOCKER_NODES = os.environ.get("DOCKER_NODES", "")
+
+# Which node a new container goes to:
+#   least-loaded  lowest fraction of its port range in use
+#   binpack       fullest node (by estimated memory) that still fits one more
+#   spread        round robin
+PLACEMENT_POLICY = os.environ.get("PLACEMENT_POLICY", "least-loaded")
+PLACEMENT_POLICIES = ("least-loaded", "binpack", "spread")
+
+# Memory one VNC container is assumed to use when bin-packing by memory
+PLACEMENT_CONTAINER_MEMORY_MB = int(os.environ.get("PLACEMENT_CONTAINER_MEMORY_MB", "1024"))
+
+
+class Node:
+    """One Docker engine and the slice of the port range (or of the session slots) it serves."""
+
+    def __init__(self, name: str, client: docker.DockerClient, url: str, host: str,
+                 port_min: int, port_max: int, pool_size: int | None = None,
+                 memory_mb: int | None = None, cpus: float | None = None):
+        self.name = name
+        self.client = client
+        self.url = url
+        self.host = host
+        self.port_min = port_min
+        self.port_max = port_max
+        self.pool_size = pool_size
+        self._memory_mb = memory_mb
+        self._cpus = cpus
+        self._info: dict | None = None
+
+    @property
+    def capacity(self) -> int:
+        return self.port_max - self.port_min + 1
+
+    def owns(self, port: int) -> bool:
+        return self.port_min <= port <= self.port_max
+
+    def _engine_info(self) -> dict:
+        """`docker info` of the engine, fetched once ({} while it cannot be read)."""
+        if self._info is None:
+            try:
+                self._info = self.client.info()
+            except Exception as e:
+                logger.warning("[NODES] Could not read the engine info of node %s: %s", self.name, e)
+                return {}
+        return self._info
+
+    def memory_mb(self) -> int:
+        """Memory available for containers (0 if unknown)."""
+        if self._memory_mb is None:
+            return self._engine_info().get("MemTotal", 0) // (1024 * 1024)
+        return self._memory_mb
+
+    def cpus(self) -> float:
+        """CPUs available for containers (0 if unknown)."""
+        if self._cpus is None:
+            return float(self._engine_info().get("NCPU", 0))
+        return self._cpus
+
+    def __repr__(self) -> str:
+        return f"Node({self.name!r}, {self.url!r}, ports={self.port_min}-{self.port_max})"
+
+
+def parse_nodes(raw: str, publish_ports: bool = True) -> list[dict]:
+    """Validate a DOCKER_NODES value and return the node specs.
+
+    With publish_ports=False (behind the proxy) the host port ranges are not
+    used and "ports" may be left out.
+    """
+    specs = json.loads(raw)
+    if not isinstance(specs, list) or not specs:
+        raise ValueError("DOCKER_NODES must be a non-empty JSON list")
+    names = set()
+    for spec in specs:
+        for key in ("name", "url", "host", "ports") if publish_ports else ("name", "url", "host"):
+            if key not in spec:
+                raise ValueError(f"DOCKER_NODES entry {spec!r} is missing {key!r}")
+        if spec["name"] in names:
+            raise ValueError(f"Duplicate node name in DOCKER_NODES: {spec['name']!r}")
+        names.add(spec["name"])
+        if "sessions" in spec and int(spec["sessions"]) < 1:
+            raise ValueError(f"Node {spec['name']!r} must take at least one session")
+        if "ports" not in spec:
+            continue
+        low, _, high = str(spec["ports"]).partition("-")
+        spec["port_min"], spec["port_max"] = int(low), int(high or low)
+        if spec["port_min"] > spec["port_max"]:
+            raise ValueError(f"Node {spec['name']!r} has an empty port range {spec['ports']!r}")
+    if publish_ports:
+        check_disjoint(specs)
+    return specs
+
+
+def check_disjoint(specs: list[dict]) -> None:
+    """Refuse overlapping port ranges: ports identify nodes in the state store."""
+    ordered = sorted(specs, key=lambda s: s["port_min"])
+    for a, b in zip(ordered, ordered[1:]):
+        if b["port_min"] <= a["port_max"]:
+            raise ValueError(f"Port ranges of nodes {a['name']!r} and {b['name']!r} overlap")
+
+
+# ---------------------------------------------------------------------------
+# Placement
+# ---------------------------------------------------------------------------
+
+_spread_lock = threading.Lock()
+_spread_next = 0
+
+
+def rank(nodes: list[Node], used_ports: set[int], policy: str = PLACEMENT_POLICY) -> list[Node]:
+    """Return the nodes in the order a new container should try them.
+
+    used_ports are the ports held by records (all nodes); full nodes are
+    left to the caller, whose port reservation fails on them.
+    """
+    global _spread_next
+    if len(nodes) == 1:
+        return list(nodes)
+
+    used = {node.name: sum(1 for p in used_ports if node.owns(p)) for node in nodes}
+
+    if policy == "spread":
+        with _spread_lock:
+            start = _spread_next % len(nodes)
+            _spread_next += 1
+        return nodes[start:] + nodes[:start]
+
+    if policy == "binpack":
+        free = {node.name: node.memory_mb() - used[node.name] * PLACEMENT_CONTAINER_MEMORY_MB for node in nodes}
+        fits = [node for node in nodes if free[node.name] >= PLACEMENT_CONTAINER_MEMORY_MB]
+        return sorted(fits, key=lambda node: free[node.name])
+
+    if policy == "least-loaded":
+        return sorted(nodes, key=lambda node: used[node.name] / node.capacity)
+
+    raise ValueError(f"Unknown placement policy: {policy!r} (expected one of {PLACEMENT_POLICIES})")
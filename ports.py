@@ -0,0 +1,79 @@
+import logging
+import time
+from collections import deque
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class PortAllocator:
+    """Constant-time free-port allocator with expiring reservations (leases).
+
+    Free ports live in a FIFO queue. The queue may hold stale entries (a
+    port that was taken after being queued); reserve() skips them, and each
+    port is queued at most once per time it becomes free, so allocation is
+    amortized O(1) regardless of the range size.
+
+    ``is_used`` tells the allocator whether a port is held by a state
+    record. The owner must call release() whenever a record's port is freed
+    and resync() whenever the whole state is replaced.
+    """
+
+    def __init__(self, port_min: int, port_max: int, is_used: Callable[[int], bool]):
+        self.port_min = port_min
+        self.port_max = port_max
+        self._is_used = is_used
+        self._free: deque[int] = deque()
+        self._queued: set[int] = set()
+        self._leases: dict[int, float] = {}            # port -> expires_at (monotonic)
+        self._lease_order: deque[tuple[float, int]] = deque()
+        self.resync()
+
+    def resync(self) -> None:
+        """Rebuild the free queue from scratch (O(range)); keeps live leases."""
+        self._free = deque(p for p in range(self.port_min, self.port_max + 1)
+                           if not self._is_used(p) and p not in self._leases)
+        self._queued = set(self._free)
+
+    def _expire_leases(self) -> None:
+        now = time.monotonic()
+        while self._lease_order and self._lease_order[0][0] <= now:
+            expires_at, port = self._lease_order.popleft()
+            # Ignore entries superseded by a later reserve() of the same port
+            if self._leases.get(port) == expires_at:
+                del self._leases[port]
+                logger.warning("[PORT] Reservation for port %d expired without a record", port)
+                self.release(port)
+
+    def reserve(self, ttl: float) -> int | None:
+        """Take a free port and lease it for ttl seconds. Returns None when full."""
+        self._expire_leases()
+        while self._free:
+            port = self._free.popleft()
+            self._queued.discard(port)
+            if self._is_used(port) or port in self._leases:
+                continue
+            expires_at = time.monotonic() + ttl
+            self._leases[port] = expires_at
+            self._lease_order.append((expires_at, port))
+            return port
+        return None
+
+    def lease(self, port: int, ttl: float) -> None:
+        """Lease a specific port (one just freed for the caller) for ttl seconds."""
+        self._expire_leases()
+        expires_at = time.monotonic() + ttl
+        self._leases[port] = expires_at
+        self._lease_order.append((expires_at, port))
+
+    def commit(self, port: int) -> None:
+        """A record now owns the port: drop its lease."""
+        self._leases.pop(port, None)
+
+    def release(self, port: int) -> None:
+        """Return a port to the free queue (lease cancelled or record removed)."""
+        self._leases.pop(port, None)
+        if (self.port_min <= port <= self.port_max and port not in self._queued
+                and not self._is_used(port)):
+            self._free.append(port)
+            self._queued.add(port)
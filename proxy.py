@@ -0,0 +1,318 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import ssl
+import threading
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp import web
+
+import containers
+import docker_async
+import logging_setup
+import metrics
+import state
+
+logger = logging.getLogger(__name__)
+
+# Single-port reverse proxy. When set, every session is served on
+# https://PROXY_HOST:PROXY_PORT/s/<token>/ (HTTP and the noVNC websocket),
+# forwarded to the container's address on NETWORK_NAME, and containers
+# publish no host port (containers.PUBLISH_PORTS). The proxy must be able to
+# reach that network (same host, or a network routed to every node).
+# 0 = off: one published host port per container.
+PROXY_PORT = int(os.environ.get("PROXY_PORT") or "0")
+
+# Host name in the redirect URL
+PROXY_HOST = os.environ.get("PROXY_HOST", containers.VNC_HOST)
+
+# Certificate and key of the proxy port. Empty = plain HTTP (TLS terminated
+# in front of it; the redirect URL is https either way).
+PROXY_CERT_FILE = os.environ.get("PROXY_CERT_FILE", "/opt/docker-orchestrator/fullchain.crt")
+PROXY_KEY_FILE = os.environ.get("PROXY_KEY_FILE", "/opt/docker-orchestrator/server.key")
+
+# Key signing the session tokens. Every process that answers /access must
+# use the same one as the proxy; when empty a random key is generated, which
+# only works with a single worker.
+PROXY_SECRET = os.environ.get("PROXY_SECRET", "")
+
+# Seconds a token -> container address route is trusted before it is
+# checked against the state again (a removed session stops resolving after this)
+PROXY_ROUTE_TTL_SECONDS = float(os.environ.get("PROXY_ROUTE_TTL_SECONDS", "5"))
+
+# Cookie remembering the last session a browser opened. Absolute paths a
+# page requests outside /s/<token>/ are routed by the Referer's token; the
+# cookie is only the fallback for requests without one (e.g. the handshake of
+# noVNC's /websockify)
+SESSION_COOKIE = "vnc_session"
+
+# Headers that describe one connection and are not forwarded
+_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade", "host",
+}
+
+_secret = (PROXY_SECRET or secrets.token_hex(32)).encode()
+
+_thread: threading.Thread | None = None
+_lock = threading.Lock()
+
+# token -> (upstream base URL, time.monotonic() when it expires)
+_routes: dict[str, tuple[str, float]] = {}
+
+# Upstream client session, created on the proxy's event loop
+_upstream: aiohttp.ClientSession | None = None
+
+
+def enabled() -> bool:
+    return PROXY_PORT > 0
+
+
+def session_token(port: int, container_id: str) -> str:
+    """Token of a session: its slot and a signature binding it to the container.
+
+    A recycled slot gets a new container, so links to the previous session
+    stop working.
+    """
+    signature = hmac.new(_secret, f"{port}:{container_id}".encode(), hashlib.sha256).hexdigest()[:32]
+    return f"{port}-{signature}"
+
+
+def session_url(port: int, container_id: str) -> str:
+    """URL a client is redirected to for its session behind the proxy."""
+    return f"https://{PROXY_HOST}:{PROXY_PORT}/s/{session_token(port, container_id)}/"
+
+
+def start() -> None:
+    """Serve the proxy from a background thread (no-op if running or disabled). Run it in one process only."""
+    global _thread
+    if not enabled():
+        return
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=asyncio.run, args=(serve(),), name="proxy", daemon=True)
+        _thread.start()
+    if not PROXY_SECRET:
+        logger.warning("[PROXY] PROXY_SECRET is not set: session links are only valid in this process")
+
+
+async def serve() -> None:
+    """Run the proxy on the current event loop until cancelled."""
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", _handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "0.0.0.0", PROXY_PORT, ssl_context=_ssl_context())
+    await site.start()
+    logger.info("[PROXY] Serving sessions on port %d (%s, host=%s)",
+                PROXY_PORT, "tls" if PROXY_CERT_FILE else "plain http", PROXY_HOST)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        if _upstream is not None:
+            await _upstream.close()
+        await docker_async.close_clients()
+        await runner.cleanup()
+
+
+def _ssl_context() -> ssl.SSLContext | None:
+    if not PROXY_CERT_FILE:
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(PROXY_CERT_FILE, PROXY_KEY_FILE)
+    return context
+
+
+def _session() -> aiohttp.ClientSession:
+    global _upstream
+    if _upstream is None or _upstream.closed:
+        # No connection limit: every open viewer holds one websocket upstream
+        _upstream = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0),
+            auto_decompress=False,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=10),
+        )
+    return _upstream
+
+
+# ---------------------------------------------------------------------------
+# Routing
+# ---------------------------------------------------------------------------
+
+def _forget_expired() -> None:
+    now = time.monotonic()
+    for token in [t for t, (_, expires_at) in _routes.items() if expires_at <= now]:
+        del _routes[token]
+
+
+async def _resolve(token: str) -> str | None:
+    """Upstream base URL (http://ip:port) of the session token points to, or None."""
+    route = _routes.get(token)
+    if route is not None and route[1] > time.monotonic():
+        return route[0]
+
+    slot, _, _ = token.partition("-")
+    if not slot.isdigit():
+        return None
+    record = await asyncio.to_thread(state.find_by_port, int(slot))
+    if record is None or not hmac.compare_digest(token, session_token(record["port"], record["container_id"])):
+        return None
+
+    node = containers.node_for_port(record["port"])
+    try:
+        attrs = await docker_async.get_client(node.url).inspect_container(record["container_id"])
+    except Exception as e:
+        logger.warning("[PROXY] Could not inspect container=%s of CPF=%s: %s",
+                       record["container_id"][:12], record["client_id"], e)
+        return None
+    networks = (attrs.get("NetworkSettings") or {}).get("Networks") or {}
+    ip = (networks.get(containers.NETWORK_NAME) or {}).get("IPAddress")
+    if not ip:
+        logger.warning("[PROXY] Container=%s of CPF=%s has no address on %s",
+                       record["container_id"][:12], record["client_id"], containers.NETWORK_NAME)
+        return None
+
+    _forget_expired()
+    upstream = f"http://{ip}:{containers.CONTAINER_PORT}"
+    _routes[token] = (upstream, time.monotonic() + PROXY_ROUTE_TTL_SECONDS)
+    logger.debug("[PROXY] Route %s... -> CPF=%s %s", token[:12], record["client_id"], upstream)
+    return upstream
+
+
+def _split(request: web.Request) -> tuple[str | None, str, bool]:
+    """(token, upstream path, whether the token came from the path)."""
+    path = request.path
+    if path.startswith("/s/"):
+        token, _, rest = path[3:].partition("/")
+        return token, "/" + rest, True
+    return _referer_token(request) or request.cookies.get(SESSION_COOKIE), path, False
+
+
+def _referer_token(request: web.Request) -> str | None:
+    """Token of the session page that requested an absolute path, from its Referer."""
+    path = urlsplit(request.headers.get("Referer", "")).path
+    if not path.startswith("/s/"):
+        return None
+    token, slash, _ = path[3:].partition("/")
+    return token if slash else None
+
+
+async def _handle(request: web.Request) -> web.StreamResponse:
+    token, path, from_path = _split(request)
+    if from_path and path == "/" and not request.path.endswith("/"):
+        # /s/<token> -> /s/<token>/ so the page's relative links stay under the prefix
+        raise web.HTTPMovedPermanently(request.rel_url.with_path(request.path + "/"))
+
+    upstream = await _resolve(token) if token else None
+    if upstream is None:
+        metrics.PROXY_REQUESTS.labels("not_found").inc()
+        return web.json_response({"error": "Session not found or expired, please open it again"}, status=404)
+
+    url = upstream + path
+    if request.query_string:
+        url += "?" + request.query_string
+
+    if request.headers.get("Upgrade", "").lower() == "websocket":
+        metrics.PROXY_REQUESTS.labels("websocket").inc()
+        return await _websocket(request, url)
+    metrics.PROXY_REQUESTS.labels("http").inc()
+    return await _http(request, url, token if from_path else None)
+
+
+# ---------------------------------------------------------------------------
+# Forwarding
+# ---------------------------------------------------------------------------
+
+def _forward_headers(headers) -> dict:
+    return {k: v for k, v in headers.items() if k.lower() not in _HOP_HEADERS}
+
+
+async def _http(request: web.Request, url: str, cookie_token: str | None) -> web.StreamResponse:
+    headers = _forward_headers(request.headers)
+    headers["X-Forwarded-For"] = request.remote or ""
+    headers["X-Forwarded-Proto"] = "https"
+    body = await request.read() if request.body_exists else None
+    response = None
+    try:
+        async with _session().request(request.method, url, headers=headers, data=body,
+                                      allow_redirects=False) as upstream:
+            response = web.StreamResponse(status=upstream.status, reason=upstream.reason)
+            for name, value in upstream.headers.items():
+                if name.lower() not in _HOP_HEADERS:
+                    response.headers.add(name, value)
+            if cookie_token and request.cookies.get(SESSION_COOKIE) != cookie_token:
+                response.set_cookie(SESSION_COOKIE, cookie_token, path="/", secure=True,
+                                    httponly=True, samesite="Lax")
+            await response.prepare(request)
+            async for chunk in upstream.content.iter_chunked(64 * 1024):
+                await response.write(chunk)
+            await response.write_eof()
+            return response
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning("[PROXY] Upstream %s failed: %s", url, e)
+        if response is not None and response.prepared:
+            # Status and headers are already out: drop the connection so the
+            # browser sees a truncated response instead of a spliced-in error
+            if request.transport is not None:
+                request.transport.close()
+            return response
+        return web.json_response({"error": "Session is not reachable, please retry"}, status=502)
+
+
+async def _websocket(request: web.Request, url: str) -> web.StreamResponse:
+    protocols = [p.strip() for p in request.headers.get("Sec-WebSocket-Protocol", "").split(",") if p.strip()]
+    try:
+        upstream = await _session().ws_connect(
+            "ws" + url[len("http"):], protocols=protocols, headers=_forward_headers(request.headers),
+            autoping=False, max_msg_size=0,
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning("[PROXY] Upstream websocket %s failed: %s", url, e)
+        return web.json_response({"error": "Session is not reachable, please retry"}, status=502)
+
+    downstream = web.WebSocketResponse(protocols=[upstream.protocol] if upstream.protocol else (),
+                                       autoping=False, max_msg_size=0)
+    metrics.PROXY_WEBSOCKETS.inc()
+    try:
+        await downstream.prepare(request)
+        pumps = [asyncio.ensure_future(_pump(downstream, upstream)),
+                 asyncio.ensure_future(_pump(upstream, downstream))]
+        # Either side closing ends the session
+        _, pending = await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+    finally:
+        metrics.PROXY_WEBSOCKETS.dec()
+        await upstream.close()
+        await downstream.close()
+    return downstream
+
+
+async def _pump(source, sink) -> None:
+    """Copy websocket messages from source to sink until source closes."""
+    async for message in source:
+        if message.type == aiohttp.WSMsgType.BINARY:
+            await sink.send_bytes(message.data)
+        elif message.type == aiohttp.WSMsgType.TEXT:
+            await sink.send_str(message.data)
+        elif message.type == aiohttp.WSMsgType.PING:
+            await sink.ping(message.data)
+        elif message.type == aiohttp.WSMsgType.PONG:
+            await sink.pong(message.data)
+        else:
+            return
+
+
+if __name__ == "__main__":
+    # Standalone proxy (instead of proxy.start() in the orchestrator): needs
+    # the same STATE_BACKEND, Docker nodes and PROXY_SECRET as the orchestrator
+    logging_setup.configure()
+    if not enabled():
+        raise SystemExit("PROXY_PORT is not set")
+    asyncio.run(serve())
@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import docker
+
+import containers
+import metrics
+import nodes
+import state
+
+logger = logging.getLogger(__name__)
+
+# Admission control: new sessions are refused (or an idle session is
+# recycled, see ADMISSION_ACTION in services.py) while every node is at or
+# above one of these thresholds, and new containers only go to nodes below
+# them. Usage is the sum over the orchestrator's running containers, in
+# percent of the node's memory / CPUs (engine MemTotal / NCPU, or memory_mb /
+# cpus in DOCKER_NODES). 0 = no threshold; with both 0 nothing is sampled.
+ADMISSION_MAX_MEMORY_PERCENT = float(os.environ.get("ADMISSION_MAX_MEMORY_PERCENT", "0"))
+ADMISSION_MAX_CPU_PERCENT = float(os.environ.get("ADMISSION_MAX_CPU_PERCENT", "0"))
+
+# Seconds between two samples of the containers' stats
+RESOURCE_SAMPLE_SECONDS = float(os.environ.get("RESOURCE_SAMPLE_SECONDS", "10"))
+
+# How many one-shot stats calls a sample makes at the same time
+RESOURCE_SAMPLE_CONCURRENCY = int(os.environ.get("RESOURCE_SAMPLE_CONCURRENCY", "8"))
+
+# Only the leader samples; it writes each sample here for the other workers
+RESOURCE_SNAPSHOT_FILE = os.environ.get("RESOURCE_SNAPSHOT_FILE", state.STATE_FILE + ".resources")
+
+# A node sample older than this many intervals is ignored: admission fails
+# open (the node counts as having headroom) rather than refusing everyone
+_STALE_INTERVALS = 3
+
+_lock = threading.Lock()
+_thread: threading.Thread | None = None
+
+# container_id -> {"node", "memory_mb", "cpus", "cpu_total", "at"} of the last sample
+_containers: dict[str, dict] = {}
+
+# node name -> {"memory_mb", "cpus", "containers", "sampled_at" (time.time())}
+_nodes: dict[str, dict] = {}
+
+# mtime of RESOURCE_SNAPSHOT_FILE when a non-leader last read it
+_snapshot_mtime: int | None = None
+
+
+def enabled() -> bool:
+    return ADMISSION_MAX_MEMORY_PERCENT > 0 or ADMISSION_MAX_CPU_PERCENT > 0
+
+
+def start() -> None:
+    """Start the sampler thread (leader only; no-op if running or disabled).
+
+    Other workers never sample: they read the leader's RESOURCE_SNAPSHOT_FILE.
+    """
+    global _thread
+    if not enabled():
+        return
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=_run, name="resource-monitor", daemon=True)
+        _thread.start()
+    logger.info("[RESOURCES] Sampling container stats every %gs (max memory=%g%% cpu=%g%%)",
+                RESOURCE_SAMPLE_SECONDS, ADMISSION_MAX_MEMORY_PERCENT, ADMISSION_MAX_CPU_PERCENT)
+
+
+def _run() -> None:
+    executor = ThreadPoolExecutor(max_workers=RESOURCE_SAMPLE_CONCURRENCY, thread_name_prefix="resource-stats")
+    while True:
+        for node in containers.NODES:
+            try:
+                _sample_node(node, executor)
+            except Exception as e:
+                logger.warning("[RESOURCES] Could not sample node %s: %s", node.name, e)
+        try:
+            _write_snapshot()
+        except OSError as e:
+            logger.warning("[RESOURCES] Could not write %s: %s", RESOURCE_SNAPSHOT_FILE, e)
+        time.sleep(RESOURCE_SAMPLE_SECONDS)
+
+
+# ---------------------------------------------------------------------------
+# Sampling
+# ---------------------------------------------------------------------------
+
+def _sample_node(node: nodes.Node, executor: ThreadPoolExecutor) -> None:
+    """Take one stats sample of every running (or paused) container of this instance on node."""
+    listed = node.client.api.containers(
+        filters={"label": [containers.MANAGED_LABEL, f"{containers.INSTANCE_LABEL}={containers.ORCHESTRATOR_INSTANCE}"]},
+    )
+    samples = [s for s in executor.map(lambda c: _stats(node, c["Id"]), listed) if s is not None]
+
+    with _lock:
+        memory_mb = cpus = 0.0
+        for sample in samples:
+            prev = _containers.get(sample["id"])
+            # CPU use is the cpu time consumed between two of our samples;
+            # a container seen for the first time counts as idle until the next one
+            if prev and sample["at"] > prev["at"]:
+                sample["cpus"] = max(0.0, (sample["cpu_total"] - prev["cpu_total"]) / 1e9 / (sample["at"] - prev["at"]))
+            memory_mb += sample["memory_mb"]
+            cpus += sample["cpus"]
+        for container_id in [cid for cid, c in _containers.items() if c["node"] == node.name]:
+            del _containers[container_id]
+        for sample in samples:
+            _containers[sample.pop("id")] = sample
+        _nodes[node.name] = totals = {
+            "memory_mb": memory_mb,
+            "cpus": cpus,
+            "containers": len(samples),
+            "sampled_at": time.time(),
+        }
+
+    usage = _usage(node, totals)
+    if usage["memory_percent"] is not None:
+        metrics.NODE_MEMORY_PERCENT.labels(node.name).set(usage["memory_percent"])
+    if usage["cpu_percent"] is not None:
+        metrics.NODE_CPU_PERCENT.labels(node.name).set(usage["cpu_percent"])
+    logger.debug("[RESOURCES] Node %s: %d containers, %.0f MB (%s%%), %.2f CPUs (%s%%)",
+                 node.name, usage["containers"], usage["memory_mb"], usage["memory_percent"],
+                 usage["cpus"], usage["cpu_percent"])
+
+
+def _stats(node: nodes.Node, container_id: str) -> dict | None:
+    """One-shot stats of a container: memory in use and cumulative cpu time."""
+    try:
+        stats = node.client.api.stats(container_id, stream=False, one_shot=True)
+    except (docker.errors.APIError, docker.errors.DockerException, OSError) as e:
+        # Typically removed between the listing and this call
+        logger.debug("[RESOURCES] No stats for container=%s: %s", container_id[:12], e)
+        return None
+    memory = stats.get("memory_stats") or {}
+    detail = memory.get("stats") or {}
+    # Page cache can be reclaimed: same "used" figure as `docker stats`
+    # (inactive_file on cgroup v2, cache on v1)
+    reclaimable = detail.get("inactive_file", detail.get("total_inactive_file", detail.get("cache", 0)))
+    return {
+        "id": container_id,
+        "node": node.name,
+        "memory_mb": max(0, memory.get("usage", 0) - reclaimable) / (1024 * 1024),
+        "cpus": 0.0,
+        "cpu_total": ((stats.get("cpu_stats") or {}).get("cpu_usage") or {}).get("total_usage", 0),
+        "at": time.monotonic(),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Shared snapshot
+# ---------------------------------------------------------------------------
+
+def _write_snapshot() -> None:
+    """Publish the latest sample of every node to RESOURCE_SNAPSHOT_FILE (atomic replace)."""
+    with _lock:
+        snapshot = {
+            "nodes": _nodes,
+            "containers": {cid: {"node": c["node"], "memory_mb": c["memory_mb"], "cpus": c["cpus"]}
+                           for cid, c in _containers.items()},
+        }
+        data = json.dumps(snapshot)
+    tmp = RESOURCE_SNAPSHOT_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(data)
+    os.replace(tmp, RESOURCE_SNAPSHOT_FILE)
+
+
+def _refresh() -> None:
+    """Non-leader workers: load the leader's snapshot if it changed since the last read.
+
+    Without a readable snapshot the nodes have no recent sample, so admission
+    fails open.
+    """
+    global _snapshot_mtime
+    if _thread is not None:
+        return
+    try:
+        mtime = os.stat(RESOURCE_SNAPSHOT_FILE).st_mtime_ns
+        if mtime == _snapshot_mtime:
+            return
+        with open(RESOURCE_SNAPSHOT_FILE) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.debug("[RESOURCES] No snapshot from the leader in %s: %s", RESOURCE_SNAPSHOT_FILE, e)
+        return
+    with _lock:
+        _nodes.clear()
+        _nodes.update(snapshot["nodes"])
+        _containers.clear()
+        _containers.update(snapshot["containers"])
+        _snapshot_mtime = mtime
+
+
+# ---------------------------------------------------------------------------
+# Admission
+# ---------------------------------------------------------------------------
+
+def load(node: nodes.Node) -> dict | None:
+    """Latest usage of node's containers, or None if it was not sampled recently."""
+    _refresh()
+    with _lock:
+        totals = _nodes.get(node.name)
+        if totals is None or time.time() - totals["sampled_at"] > _STALE_INTERVALS * RESOURCE_SAMPLE_SECONDS:
+            return None
+        totals = dict(totals)
+    return _usage(node, totals)
+
+
+def _usage(node: nodes.Node, totals: dict) -> dict:
+    memory_total = node.memory_mb()
+    cpus_total = node.cpus()
+    return {
+        "containers": totals["containers"],
+        "memory_mb": round(totals["memory_mb"]),
+        "memory_percent": round(100 * totals["memory_mb"] / memory_total, 1) if memory_total else None,
+        "cpus": round(totals["cpus"], 2),
+        "cpu_percent": round(100 * totals["cpus"] / cpus_total, 1) if cpus_total else None,
+    }
+
+
+def overload_reason(node: nodes.Node) -> str | None:
+    """Why node cannot take another container ("memory 93% >= 90%"), or None if it can."""
+    if not enabled():
+        return None
+    usage = load(node)
+    if usage is None:
+        return None
+    if ADMISSION_MAX_MEMORY_PERCENT and (usage["memory_percent"] or 0) >= ADMISSION_MAX_MEMORY_PERCENT:
+        return f"memory {usage['memory_percent']:.0f}% >= {ADMISSION_MAX_MEMORY_PERCENT:g}%"
+    if ADMISSION_MAX_CPU_PERCENT and (usage["cpu_percent"] or 0) >= ADMISSION_MAX_CPU_PERCENT:
+        return f"cpu {usage['cpu_percent']:.0f}% >= {ADMISSION_MAX_CPU_PERCENT:g}%"
+    return None
+
+
+def admissible_nodes() -> list[nodes.Node]:
+    """Nodes below every admission threshold (all of them when admission control is off)."""
+    return [node for node in containers.NODES if overload_reason(node) is None]
+
+
+def heaviest_idle_session(idle_minutes: int) -> tuple[dict, float] | None:
+    """Client record on an overloaded node idle for at least idle_minutes that uses the most memory.
+
+    Returns (record, memory_mb), or None if there is no such session.
+    """
+    overloaded = {node.name for node in containers.NODES if overload_reason(node)}
+    _refresh()
+    with _lock:
+        memory = {cid: c["memory_mb"] for cid, c in _containers.items() if c["node"] in overloaded}
+    cutoff = (datetime.now() - timedelta(minutes=idle_minutes)).isoformat()
+    candidates = [
+        rec for rec in state.load_records()
+        if rec["client_id"] != "__pool__" and rec["container_id"] in memory
+        and rec.get("last_accessed_at", "") <= cutoff
+    ]
+    if not candidates:
+        return None
+    victim = max(candidates, key=lambda rec: memory[rec["container_id"]])
+    return victim, memory[victim["container_id"]]
+
+
+def forget(container_id: str) -> None:
+    """Take a removed container out of its node's usage until the next sample."""
+    with _lock:
+        sample = _containers.pop(container_id, None)
+        if sample is None or sample["node"] not in _nodes:
+            return
+        totals = _nodes[sample["node"]]
+        totals["memory_mb"] = max(0.0, totals["memory_mb"] - sample["memory_mb"])
+        totals["cpus"] = max(0.0, totals["cpus"] - sample["cpus"])
+        totals["containers"] -= 1
@@ -1,14 +1,94 @@
+import json
 import logging
 
-from flask import Blueprint, request, redirect, jsonify
+from flask import Blueprint, Response, request, redirect, jsonify
 
 import services
 import containers
+import metrics
+import tracing
 
 logger = logging.getLogger(__name__)
 
 bp = Blueprint("routes", __name__)
 
+# Answer of /access while a container is provisioned in the background
+# (ACCESS_MODE=background). It follows /access/events (server-sent events,
+# ASGI only) or polls /access/status, then redirects to the session.
+WAITING_PAGE = """<!doctype html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Starting your session...</title>
+<style>
+  body { font-family: sans-serif; display: flex; align-items: center; justify-content: center;
+         height: 100vh; margin: 0; color: #333; }
+  progress { width: 16em; }
+</style>
+</head>
+<body>
+<div>
+  <p id="message">Starting your session, this usually takes about __EXPECTED__ seconds...</p>
+  <progress id="progress"></progress>
+</div>
+<script>
+  var id = encodeURIComponent(__CLIENT_ID__);
+  var message = document.getElementById("message");
+  var progress = document.getElementById("progress");
+
+  function handle(status) {
+    if (status.status === "ready") {
+      window.location.replace(status.url);
+    } else if (status.status === "error") {
+      progress.remove();
+      message.textContent = status.error + " ";
+      var retry = document.createElement("a");
+      retry.href = "/access?id=" + id;
+      retry.textContent = "Try again";
+      message.appendChild(retry);
+    } else if (status.status === "unknown") {
+      window.location.replace("/access?id=" + id);
+    } else {
+      if (status.expected) {
+        progress.max = status.expected;
+        progress.value = Math.min(status.elapsed, status.expected);
+      }
+      return false;
+    }
+    return true;
+  }
+
+  function poll() {
+    fetch("/access/status?id=" + id)
+      .then(function (response) { return response.json(); })
+      .then(function (status) { if (!handle(status)) setTimeout(poll, 1000); })
+      .catch(function () { setTimeout(poll, 2000); });
+  }
+
+  if (__EVENTS__ && window.EventSource) {
+    var events = new EventSource("/access/events?id=" + id);
+    events.addEventListener("status", function (event) {
+      if (handle(JSON.parse(event.data))) events.close();
+    });
+    events.onerror = function () { events.close(); poll(); };
+  } else {
+    poll();
+  }
+</script>
+</body>
+</html>
+"""
+
+
+def waiting_page(client_id: str, events: bool = False) -> str:
+    """WAITING_PAGE for client_id; events = the server streams /access/events."""
+    return (WAITING_PAGE
+            .replace("__EXPECTED__", str(round(containers.expected_boot_seconds())))
+            .replace("__EVENTS__", "true" if events else "false")
+            # JSON string, with "<" escaped so the id cannot close the script
+            .replace("__CLIENT_ID__", json.dumps(client_id).replace("<", "\\u003c")))
+
 
 @bp.route("/access")
 def access():
@@ -19,18 +99,33 @@ def access():
         return jsonify({"error": "Missing required parameter: id"}), 400
 
     try:
-        result = services.get_or_create_access(client_id)
+        if services.ACCESS_MODE == "background":
+            result = services.start_access(client_id)
+        else:
+            result = services.get_or_create_access(client_id)
     except ValueError as e:
         return jsonify({
             "error": str(e),
-            "max_slots": containers.PORT_MAX - containers.PORT_MIN + 1,
+            "max_slots": containers.total_slots(),
         }), 503
     except RuntimeError as e:
         return jsonify({"error": str(e)}), 500
 
+    if result["action"] == "pending":
+        return Response(waiting_page(client_id), status=202, content_type="text/html; charset=utf-8")
     return redirect(result["url"])
 
 
+@bp.route("/access/status")
+def access_status():
+    client_id = request.args.get("id", "").strip()
+
+    if not client_id:
+        return jsonify({"error": "Missing required parameter: id"}), 400
+
+    return jsonify(services.access_status(client_id))
+
+
 @bp.route("/status")
 def status():
     return jsonify(services.get_status())
@@ -60,3 +155,17 @@ def remove_all():
 @bp.route("/health")
 def health():
     return jsonify({"status": "ok"})
+
+
+@bp.route("/metrics")
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+@bp.route("/debug/traces")
+def debug_traces():
+    """Slowest recent request/job timelines of this process (TRACING=1)."""
+    limit = request.args.get("limit", 20, type=int)
+    name = request.args.get("name", "").strip() or None
+    return jsonify(tracing.slowest(limit, name))
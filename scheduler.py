@@ -1,82 +1,303 @@
+import heapq
 import logging
 import os
 import threading
-from datetime import datetime, timedelta
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 import state
+import activity
 import containers
+import tracing
 
 logger = logging.getLogger(__name__)
 
-# How often the cleanup job runs (in minutes)
+# Idle containers are expired individually when their deadline passes. The
+# periodic full scan below is only a safety net for sessions this process
+# was not told about (e.g. touched/created by other gunicorn workers).
+
+# How often the full-scan cleanup job runs (in minutes)
 CLEANUP_INTERVAL_MINUTES = int(os.environ.get("CLEANUP_INTERVAL_MINUTES", "30"))
 
-# Containers idle for longer than this will be removed
+# Containers idle for longer than this will be removed (sessions tracked by
+# activity.py use ACTIVITY_IDLE_MINUTES after their last activity instead)
 IDLE_TIMEOUT_HOURS = int(os.environ.get("IDLE_TIMEOUT_HOURS", "8"))
 
+# How many idle containers are removed from Docker at the same time
+CLEANUP_CONCURRENCY = int(os.environ.get("CLEANUP_CONCURRENCY", "8"))
+
+# Labelled containers with no record are removed by the full scan once they
+# are older than this (younger ones may still be booting for a record)
+ORPHAN_GRACE_SECONDS = int(os.environ.get("CLEANUP_ORPHAN_GRACE_SECONDS", "600"))
+
+# Upper bound on one sleep of the expiry thread (re-checks the wall clock)
+EXPIRY_MAX_SLEEP_SECONDS = 60
+
 _timer: threading.Timer | None = None
 
+# Idle deadlines: a min-heap of (deadline, client_id) with lazy invalidation.
+# _deadlines holds the current deadline of each tracked client; heap entries
+# that no longer match it are stale and skipped when popped.
+_cond = threading.Condition()
+_heap: list[tuple[float, str]] = []
+_deadlines: dict[str, float] = {}
+_expiry_thread: threading.Thread | None = None
+_running = False
+
+
+# ---------------------------------------------------------------------------
+# Deadline heap
+# ---------------------------------------------------------------------------
+
+def _last_used(client_id: str, last_accessed_at: str | None) -> str | None:
+    """Latest of the client's last /access and the last activity seen in its container."""
+    seen = activity.last_active(client_id)
+    if seen and (not last_accessed_at or seen > last_accessed_at):
+        return seen
+    return last_accessed_at
+
+
+def _idle_timeout_seconds(client_id: str) -> float:
+    if activity.enabled() and activity.is_tracked(client_id):
+        return activity.ACTIVITY_IDLE_MINUTES * 60
+    return IDLE_TIMEOUT_HOURS * 3600
+
+
+def _deadline_of(client_id: str, last_accessed_at: str | None) -> float | None:
+    try:
+        return datetime.fromisoformat(_last_used(client_id, last_accessed_at)).timestamp() \
+            + _idle_timeout_seconds(client_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def _on_state_change(client_id: str, last_accessed_at: str | None) -> None:
+    """state.subscribe() callback: (re)schedule or forget a client's idle deadline. O(log n)."""
+    with _cond:
+        if last_accessed_at is None:
+            _deadlines.pop(client_id, None)
+            return
+        deadline = _deadline_of(client_id, last_accessed_at)
+        if deadline is None:
+            return
+        _deadlines[client_id] = deadline
+        heapq.heappush(_heap, (deadline, client_id))
+        if len(_heap) > 2 * len(_deadlines) + 1024:
+            # Mostly stale entries (every touch pushes one): rebuild from the live deadlines
+            _heap[:] = [(d, cid) for cid, d in _deadlines.items()]
+            heapq.heapify(_heap)
+        if _heap[0] == (deadline, client_id):
+            # New earliest deadline: wake the expiry thread so it sleeps less
+            _cond.notify()
+
+
+def _on_activity(client_id: str) -> None:
+    """activity.subscribe() callback: activity was seen, or the session became activity tracked."""
+    rec = state.find_by_client(client_id)
+    if rec is not None:
+        _on_state_change(client_id, rec.get("last_accessed_at", rec.get("created_at")))
+
+
+def _track(records: list[dict]) -> None:
+    for rec in records:
+        if rec["client_id"] != "__pool__":
+            _on_state_change(rec["client_id"], rec.get("last_accessed_at", rec.get("created_at")))
+
+
+def _wait_for_due() -> list[str]:
+    """Block until at least one deadline has passed and return those clients."""
+    with _cond:
+        while _running:
+            now = time.time()
+            due = []
+            while _heap and _heap[0][0] <= now:
+                deadline, client_id = heapq.heappop(_heap)
+                if _deadlines.get(client_id) == deadline:
+                    del _deadlines[client_id]
+                    due.append(client_id)
+            if due:
+                return due
+            timeout = min(_heap[0][0] - now, EXPIRY_MAX_SLEEP_SECONDS) if _heap else EXPIRY_MAX_SLEEP_SECONDS
+            _cond.wait(timeout)
+    return []
+
+
+def _expiry_loop() -> None:
+    while _running:
+        due = _wait_for_due()
+        if not due:
+            continue
+        try:
+            _expire(due)
+        except Exception as e:
+            logger.exception("[CLEANUP] Idle expiry failed: %s", e)
+
+
+@tracing.traced_job("cleanup.expire")
+def _expire(client_ids: list[str]) -> None:
+    """Re-check clients whose deadline passed against the state and reap the idle ones."""
+    now = datetime.now()
+    idle = []
+    for client_id in client_ids:
+        rec = state.find_by_client(client_id)
+        if rec is None:
+            continue
+        if _is_idle(rec, now):
+            idle.append(rec)
+        else:
+            # Touched where we could not see it (another worker): reschedule
+            _track([rec])
+    if not idle:
+        return
+
+    removed, commit_seconds, remove_seconds = _reap(idle)
+    logger.info("[CLEANUP] Expired %d idle containers (commit=%.3fs remove=%.3fs)",
+                len(removed), commit_seconds, remove_seconds)
+
+
+# ---------------------------------------------------------------------------
+# Reaping
+# ---------------------------------------------------------------------------
+
 
 def _cleanup_idle_containers() -> None:
-    """Remove containers that have been idle for more than IDLE_TIMEOUT_HOURS.
+    """Timer callback: reap idle containers, then schedule the next run."""
+    try:
+        reap_idle_containers()
+    except Exception as e:
+        logger.exception("[CLEANUP] Cleanup run failed: %s", e)
+
+    # Schedule next run
+    _schedule_next()
+
+
+@tracing.traced_job("cleanup.reap")
+def reap_idle_containers() -> dict:
+    """Remove containers that have been idle for more than IDLE_TIMEOUT_HOURS
+    (ACTIVITY_IDLE_MINUTES since their last activity for activity tracked sessions).
 
     Pool containers (__pool__) are skipped — they are managed by warm_pool.py.
+    Runs in three phases: scan the records once for the idle set, drop them
+    from the state in a single commit, then remove the containers on a
+    bounded worker pool. Returns the counts and per-phase timings.
+
+    Idle sessions are normally expired by the deadline heap as soon as they
+    cross IDLE_TIMEOUT_HOURS; this full scan is the periodic safety net and
+    also resyncs the heap.
     """
     logger.info("[CLEANUP] -------- Scheduled cleanup started --------")
-    logger.info("[CLEANUP] IDLE_TIMEOUT_HOURS = %d", IDLE_TIMEOUT_HOURS)
-
-    cutoff = datetime.now() - timedelta(hours=IDLE_TIMEOUT_HOURS)
-    logger.info("[CLEANUP] Cutoff time: %s (removing containers idle since before this)", cutoff.isoformat())
+    logger.info("[CLEANUP] IDLE_TIMEOUT_HOURS = %d (ACTIVITY_IDLE_MINUTES = %d)",
+                IDLE_TIMEOUT_HOURS, activity.ACTIVITY_IDLE_MINUTES)
 
+    # Phase 1: scan
+    t0 = time.monotonic()
+    now = datetime.now()
     records = state.load_records()
     logger.info("[CLEANUP] Total records: %d", len(records))
+    idle = [rec for rec in records if _is_idle(rec, now)]
 
-    removed = 0
-    for rec in records:
-        # Skip pool containers — they are not idle, they are reserve
-        if rec["client_id"] == "__pool__":
-            logger.debug("[CLEANUP] Skipping pool container: port=%d", rec["port"])
-            continue
+    # Resync the deadline heap with what the scan saw
+    idle_ids = {rec["container_id"] for rec in idle}
+    _track([rec for rec in records if rec["container_id"] not in idle_ids])
+    t1 = time.monotonic()
 
-        last_accessed = rec.get("last_accessed_at", rec.get("created_at", ""))
+    removed, commit_seconds, remove_seconds = _reap(idle)
+    orphans = _reap_orphans({rec["container_id"] for rec in records}, now)
 
-        if not last_accessed:
-            logger.warning("[CLEANUP] Record CPF=%s has no timestamp, skipping", rec["client_id"])
-            continue
+    stats = {
+        "scanned": len(records),
+        "idle": len(idle),
+        "removed": len(removed),
+        "orphans": orphans,
+        "scan_seconds": round(t1 - t0, 3),
+        "commit_seconds": round(commit_seconds, 3),
+        "remove_seconds": round(remove_seconds, 3),
+    }
+    logger.info("[CLEANUP] Done: removed %d idle + %d orphan containers (scan=%.3fs commit=%.3fs remove=%.3fs)",
+                len(removed), orphans, stats["scan_seconds"], stats["commit_seconds"], stats["remove_seconds"])
+    logger.info("[CLEANUP] ----------------------------------------")
+    return stats
 
-        try:
-            last_dt = datetime.fromisoformat(last_accessed)
-        except (ValueError, TypeError):
-            logger.warning("[CLEANUP] Record CPF=%s has invalid timestamp '%s', skipping", rec["client_id"], last_accessed)
-            continue
 
-        idle_hours = (datetime.now() - last_dt).total_seconds() / 3600
-
-        if last_dt < cutoff:
-            logger.info(
-                "[CLEANUP] IDLE container: CPF=%s container=%s port=%d last_accessed=%s (idle %.1fh > %dh)",
-                rec["client_id"], rec["container_id"][:12], rec["port"],
-                last_accessed, idle_hours, IDLE_TIMEOUT_HOURS,
-            )
-            containers.remove_container(rec["container_id"])
-            state.remove_by_client(rec["client_id"])
-            removed += 1
-        else:
-            logger.debug(
-                "[CLEANUP] ACTIVE container: CPF=%s last_accessed=%s (idle %.1fh < %dh)",
-                rec["client_id"], last_accessed, idle_hours, IDLE_TIMEOUT_HOURS,
-            )
+def _reap(idle: list[dict]) -> tuple[list[dict], float, float]:
+    """Drop idle records in one state commit, then remove their containers in parallel.
 
-    logger.info("[CLEANUP] Done: removed %d idle containers", removed)
-    logger.info("[CLEANUP] ----------------------------------------")
+    Records touched or claimed since they were read are skipped, and once
+    the records are gone no request can be redirected to a container that
+    is about to be removed. Returns (removed, commit_seconds, remove_seconds).
+    """
+    t0 = time.monotonic()
+    removed = state.remove_many(idle)
+
+    t1 = time.monotonic()
+    if removed:
+        with ThreadPoolExecutor(max_workers=CLEANUP_CONCURRENCY, thread_name_prefix="cleanup") as pool:
+            list(pool.map(lambda rec: containers.remove_container(rec["container_id"]), removed))
+    t2 = time.monotonic()
 
     # Replenish pool if containers were freed
-    if removed > 0:
+    if removed:
         import warm_pool
         warm_pool.replenish_pool()
 
-    # Schedule next run
-    _schedule_next()
+    return removed, t1 - t0, t2 - t1
+
+
+def _reap_orphans(known: set[str], now: datetime) -> int:
+    """Remove containers of this instance (found by label) that no record points to."""
+    orphans = []
+    for container_id, info in containers.snapshot_orchestrated_containers().items():
+        if container_id in known:
+            continue
+        try:
+            age = (now - datetime.fromisoformat(info["created_at"])).total_seconds()
+        except (ValueError, TypeError):
+            continue
+        if age > ORPHAN_GRACE_SECONDS:
+            logger.warning("[CLEANUP] ORPHAN container: name=%s id=%s status=%s (no record, created %s)",
+                           info["name"], container_id[:12], info["status"], info["created_at"])
+            orphans.append(container_id)
+    if orphans:
+        with ThreadPoolExecutor(max_workers=CLEANUP_CONCURRENCY, thread_name_prefix="cleanup") as pool:
+            list(pool.map(containers.remove_container, orphans))
+    return len(orphans)
+
+
+def _is_idle(rec: dict, now: datetime) -> bool:
+    # Skip pool containers — they are not idle, they are reserve
+    if rec["client_id"] == "__pool__":
+        logger.debug("[CLEANUP] Skipping pool container: port=%d", rec["port"])
+        return False
+
+    last_used = _last_used(rec["client_id"], rec.get("last_accessed_at", rec.get("created_at", "")))
+
+    if not last_used:
+        logger.warning("[CLEANUP] Record CPF=%s has no timestamp, skipping", rec["client_id"])
+        return False
+
+    try:
+        last_dt = datetime.fromisoformat(last_used)
+    except (ValueError, TypeError):
+        logger.warning("[CLEANUP] Record CPF=%s has invalid timestamp '%s', skipping", rec["client_id"], last_used)
+        return False
+
+    idle_minutes = (now - last_dt).total_seconds() / 60
+    timeout_minutes = _idle_timeout_seconds(rec["client_id"]) / 60
+
+    if idle_minutes > timeout_minutes:
+        logger.info(
+            "[CLEANUP] IDLE container: CPF=%s container=%s port=%d last_used=%s (idle %.0f min > %.0f min)",
+            rec["client_id"], rec["container_id"][:12], rec["port"],
+            last_used, idle_minutes, timeout_minutes,
+        )
+        return True
+
+    logger.debug(
+        "[CLEANUP] ACTIVE container: CPF=%s last_used=%s (idle %.0f min < %.0f min)",
+        rec["client_id"], last_used, idle_minutes, timeout_minutes,
+    )
+    return False
 
 
 def _schedule_next() -> None:
@@ -90,17 +311,35 @@ def _schedule_next() -> None:
 
 
 def start_scheduler() -> None:
-    """Start the background cleanup scheduler."""
+    """Start the idle expiry thread and the periodic full-scan cleanup."""
+    global _expiry_thread, _running
     logger.info("========== CLEANUP SCHEDULER ==========")
     logger.info("[CLEANUP] IDLE_TIMEOUT_HOURS      = %d", IDLE_TIMEOUT_HOURS)
     logger.info("[CLEANUP] CLEANUP_INTERVAL_MINUTES = %d", CLEANUP_INTERVAL_MINUTES)
+    logger.info("[CLEANUP] CLEANUP_CONCURRENCY      = %d", CLEANUP_CONCURRENCY)
+    logger.info("[CLEANUP] ACTIVITY_IDLE_MINUTES    = %d (signal=%s)",
+                activity.ACTIVITY_IDLE_MINUTES, activity.ACTIVITY_SIGNAL)
     logger.info("=======================================")
+
+    state.subscribe(_on_state_change)
+    activity.subscribe(_on_activity)
+    with _cond:
+        _running = True
+        if _expiry_thread is None or not _expiry_thread.is_alive():
+            _expiry_thread = threading.Thread(target=_expiry_loop, name="idle-expiry", daemon=True)
+            _expiry_thread.start()
+    # Seed the heap once; sessions already past their deadline expire right away
+    _track(state.load_records())
+    activity.start()
     _schedule_next()
 
 
 def stop_scheduler() -> None:
     """Stop the background cleanup scheduler."""
-    global _timer
+    global _timer, _running
+    with _cond:
+        _running = False
+        _cond.notify_all()
     if _timer is not None:
         _timer.cancel()
         _timer = None
@@ -1,14 +1,70 @@
+import asyncio
+import contextvars
+import functools
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import state
 import containers
+import metrics
+import proxy
+import resource_monitor
+import tracing
 import warm_pool
+from logging_setup import SAMPLED
 
 logger = logging.getLogger(__name__)
 
-VNC_HOST = os.environ.get("VNC_HOST", "localhost")
+# Which session is recycled when all ports are taken: "lru" (least recently
+# accessed) or "lfu" (fewest accesses, least recently accessed first)
+RECYCLE_POLICY = os.environ.get("RECYCLE_POLICY", "lru")
+
+# Sessions created less than this many minutes ago are never recycled (0 = off)
+RECYCLE_PROTECT_MINUTES = int(os.environ.get("RECYCLE_PROTECT_MINUTES", "0"))
+
+# How a recycled session's slot is handed to the new client: "destroy" (remove
+# the victim, create a new container) or "reset" (rename + restart the
+# victim's running container, see containers.reset_container()). Note that
+# "reset" keeps the container filesystem, so the image must start each
+# browser session from a clean profile.
+RECYCLE_MODE = os.environ.get("RECYCLE_MODE", "destroy")
+
+# What a new session gets while every node is above the admission thresholds
+# (ADMISSION_MAX_*_PERCENT in resource_monitor.py): "reject" (503, retry
+# later) or "recycle" (remove the idle session using the most memory, then
+# admit if that brought a node back under the thresholds)
+ADMISSION_ACTION = os.environ.get("ADMISSION_ACTION", "reject")
+
+# Only sessions idle for at least this many minutes are recycled to make room
+ADMISSION_RECYCLE_IDLE_MINUTES = int(os.environ.get("ADMISSION_RECYCLE_IDLE_MINUTES", "15"))
+
+# How /access answers a client that needs a new container: "wait" (hold the
+# request until the container is healthy, up to 60s) or "background"
+# (provision it in a background job and answer 202 with a waiting page that
+# redirects once it is ready, see start_access())
+ACCESS_MODE = os.environ.get("ACCESS_MODE", "wait")
+ACCESS_MODES = ("wait", "background")
+
+# ACCESS_MODE=background: seconds /access waits for the job before answering
+# 202, so reuse and pool claims still redirect straight away
+ACCESS_BACKGROUND_GRACE_SECONDS = float(os.environ.get("ACCESS_BACKGROUND_GRACE_SECONDS", "1"))
+
+# ACCESS_MODE=background: cold starts provisioned at the same time by the
+# WSGI job queue (the ASGI entry point provisions on its event loop)
+PROVISION_CONCURRENCY = int(os.environ.get("PROVISION_CONCURRENCY", "8"))
+
+# Seconds a finished background job stays visible to its waiting page
+PROVISION_RESULT_TTL_SECONDS = 120
+
+# Worker processes serving requests (gunicorn and uvicorn both read it)
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY") or "1")
+
+# How many stale containers startup reconciliation removes at the same time
+RECONCILE_CONCURRENCY = int(os.environ.get("RECONCILE_CONCURRENCY", "8"))
 
 
 # ---------------------------------------------------------------------------
@@ -16,165 +72,476 @@ VNC_HOST = os.environ.get("VNC_HOST", "localhost")
 # ---------------------------------------------------------------------------
 
 def reconcile_on_startup() -> None:
-    """Sync JSON state with actual Docker containers after a restart."""
+    """Rebuild the state from the Docker containers after a restart.
+
+    Driven by a single container list call (by label) joined against the
+    previous state in memory; works without a state file too. Stale
+    containers are removed in the background on a bounded executor, so
+    startup does not wait for N Docker calls.
+    """
     logger.info("========== STARTUP RECONCILIATION ==========")
 
     containers.log_config()
 
-    logger.info("[RECONCILE] VNC_HOST = %s", VNC_HOST)
-    logger.info("[RECONCILE] STATE_FILE = %s", state.STATE_FILE)
-    logger.info("[RECONCILE] WARM_POOL_SIZE = %d", warm_pool.WARM_POOL_SIZE)
-    logger.info("[RECONCILE] Loading existing records from JSON...")
-
-    records = state.load_records()
-    logger.info("[RECONCILE] Found %d records in JSON", len(records))
-
-    running = containers.list_running_orchestrated_containers()
-    logger.info("[RECONCILE] Found %d running vnc_* containers in Docker", len(running))
+    logger.info("[RECONCILE] STATE_BACKEND = %s (%s)", state.STATE_BACKEND,
+                state.STATE_DB if state.STATE_BACKEND == "sqlite" else state.STATE_FILE)
+    if ACCESS_MODE not in ACCESS_MODES:
+        raise ValueError(f"Unknown ACCESS_MODE: {ACCESS_MODE!r} (expected one of {ACCESS_MODES})")
+    check_single_worker()
+    logger.info("[RECONCILE] ACCESS_MODE = %s", ACCESS_MODE)
+    logger.info("[RECONCILE] RECYCLE_POLICY = %s (protect %d min, mode=%s)",
+                RECYCLE_POLICY, RECYCLE_PROTECT_MINUTES, RECYCLE_MODE)
+    if resource_monitor.enabled():
+        logger.info("[RECONCILE] ADMISSION: max memory=%g%% cpu=%g%% action=%s (idle >= %d min)",
+                    resource_monitor.ADMISSION_MAX_MEMORY_PERCENT, resource_monitor.ADMISSION_MAX_CPU_PERCENT,
+                    ADMISSION_ACTION, ADMISSION_RECYCLE_IDLE_MINUTES)
+    logger.info("[RECONCILE] WARM_POOL_SIZE = %d (min=%d max=%d)",
+                warm_pool.WARM_POOL_SIZE, warm_pool.WARM_POOL_MIN, warm_pool.WARM_POOL_MAX)
+    logger.info("[RECONCILE] Loading existing records from the state store...")
+
+    # Docker (labels + names) is the source of truth; the state store only
+    # contributes access metadata, and the owner of containers it knows
+    previous = {rec["container_id"]: rec for rec in state.load_records()}
+    logger.info("[RECONCILE] Found %d records in the state store", len(previous))
+
+    # Records may point to containers created before the labels existed:
+    # the same listing returns those too
+    unreachable: set[str] = set()
+    snapshot = containers.snapshot_orchestrated_containers(unreachable=unreachable, known=set(previous))
+    logger.info("[RECONCILE] Found %d orchestrated containers in Docker", len(snapshot))
 
     cleaned: list[dict] = []
+    stale: list[str] = []
     seen_clients: set[str] = set()
     seen_pools: int = 0
 
-    for rec in records:
-        cid = rec["client_id"]
-        cname = rec.get("container_name", f"vnc_{cid}")
+    for container_id, rec in previous.items():
+        if container_id in snapshot:
+            continue
+        if _node_name(rec["port"]) in unreachable:
+            # Nothing is known about that node yet: keep its records as they are
+            logger.warning("[RECONCILE] Node of CPF=%s container=%s is unreachable, keeping the record",
+                           rec["client_id"], container_id[:12])
+            cleaned.append(rec)
+            if rec["client_id"] != "__pool__":
+                seen_clients.add(rec["client_id"])
+            else:
+                seen_pools += 1
+            continue
+        logger.warning("[RECONCILE] STALE record: CPF=%s container=%s no longer exists",
+                       rec["client_id"], container_id[:12])
+
+    # Containers the state already knew go first, so they win a duplicate CPF
+    for container_id, info in sorted(snapshot.items(), key=lambda item: item[0] not in previous):
+        prev = previous.get(container_id)
+        cid = prev["client_id"] if prev else info["client_id"]
+        cname = info["name"]
+
+        # Pool containers may be paused (WARM_POOL_PAUSED)
+        alive = info["status"] == "running" or (cid == "__pool__" and info["status"] == "paused")
+        if not alive or info["port"] is None or not cid:
+            logger.warning("[RECONCILE] STALE container: name=%s CPF=%s status=%s, removing...",
+                           cname, cid, info["status"])
+            stale.append(container_id)
+            continue
 
         # Allow multiple __pool__ records
         if cid != "__pool__" and cid in seen_clients:
-            logger.warning("[RECONCILE] Duplicate record for CPF %s, removing container %s", cid, rec["container_id"][:12])
-            containers.remove_container(rec["container_id"])
+            logger.warning("[RECONCILE] Duplicate container for CPF %s, removing container %s", cid, container_id[:12])
+            stale.append(container_id)
             continue
 
-        if containers.is_container_healthy(rec["container_id"]):
-            cleaned.append(rec)
-            if cid != "__pool__":
-                seen_clients.add(cid)
-            else:
-                seen_pools += 1
-            running.pop(cname, None)
-            logger.info("[RECONCILE] KEPT record: CPF=%s container=%s port=%d", cid, rec["container_id"][:12], rec["port"])
+        now = datetime.now().isoformat()
+        rec = {
+            "client_id": cid,
+            "container_id": container_id,
+            "container_name": cname,
+            "port": info["port"],
+            "created_at": info["created_at"] or (prev or {}).get("created_at") or now,
+            "last_accessed_at": (prev or {}).get("last_accessed_at") or now,
+            "access_count": (prev or {}).get("access_count", 1),
+        }
+        cleaned.append(rec)
+        if cid != "__pool__":
+            seen_clients.add(cid)
         else:
-            logger.warning("[RECONCILE] STALE record: CPF=%s container=%s is dead, removing...", cid, rec["container_id"][:12])
-            containers.remove_container(rec["container_id"])
-
-    # Containers running but not in JSON (manual restart, orphans, etc.)
-    for cname, info in running.items():
-        if cname.startswith("vnc_pool_"):
-            # Pool container orphan
-            now = datetime.now().isoformat()
-            rec = {
-                "client_id": "__pool__",
-                "container_id": info["container_id"],
-                "container_name": cname,
-                "port": info["port"],
-                "created_at": now,
-                "last_accessed_at": now,
-            }
-            cleaned.append(rec)
             seen_pools += 1
+
+        if prev:
+            logger.info("[RECONCILE] KEPT record: CPF=%s container=%s port=%d", cid, container_id[:12], info["port"])
+        elif cid == "__pool__":
             logger.info("[RECONCILE] RECOVERED orphan pool container: name=%s port=%d", cname, info["port"])
-        elif cname.startswith("vnc_"):
-            cpf = cname[4:]
-            if cpf and cpf not in seen_clients:
-                now = datetime.now().isoformat()
-                rec = {
-                    "client_id": cpf,
-                    "container_id": info["container_id"],
-                    "container_name": cname,
-                    "port": info["port"],
-                    "created_at": now,
-                    "last_accessed_at": now,
-                }
-                cleaned.append(rec)
-                seen_clients.add(cpf)
-                logger.info("[RECONCILE] RECOVERED orphan container: name=%s CPF=%s port=%d", cname, cpf, info["port"])
+        else:
+            logger.info("[RECONCILE] RECOVERED orphan container: name=%s CPF=%s port=%d", cname, cid, info["port"])
 
     state.save_records(cleaned)
     logger.info("[RECONCILE] Done: %d active records (%d clients + %d pool) after reconciliation",
                 len(cleaned), len(seen_clients), seen_pools)
+
+    if stale:
+        # Their records are gone already, so nothing is routed to them meanwhile
+        logger.info("[RECONCILE] Removing %d stale containers in the background (concurrency=%d)",
+                    len(stale), RECONCILE_CONCURRENCY)
+        executor = ThreadPoolExecutor(max_workers=RECONCILE_CONCURRENCY, thread_name_prefix="reconcile")
+        for container_id in stale:
+            executor.submit(containers.remove_container, container_id)
+        executor.shutdown(wait=False)
     logger.info("=============================================")
 
 
+def check_single_worker(leader: bool = True) -> None:
+    """Refuse ACCESS_MODE=background when more than one worker serves requests.
+
+    Background jobs, and the single-flight that joins concurrent requests
+    of a client, live in the memory of one process. A status poll routed
+    to another worker finds no job and starts a second provisioning of the
+    same client, whose leftover removal kills the first one's container.
+    Called with leader=False by workers that lost the leader election,
+    which proves there is more than one. Such a worker is also refused on
+    the journal backend, whose files stay locked by the leader: it would
+    boot and then fail every state call.
+    """
+    if not leader and state.STATE_BACKEND == "journal":
+        raise ValueError("STATE_BACKEND=journal keeps the state in one process and supports a single "
+                         "worker; use STATE_BACKEND=sqlite or WEB_CONCURRENCY=1")
+    if ACCESS_MODE == "background" and (not leader or WEB_CONCURRENCY > 1):
+        raise ValueError("ACCESS_MODE=background keeps provisioning jobs in one process and needs a "
+                         f"single worker (WEB_CONCURRENCY={WEB_CONCURRENCY}); use ACCESS_MODE=wait")
+
+
+def _node_name(port: int) -> str | None:
+    try:
+        return containers.node_for_port(port).name
+    except ValueError:
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Single-flight (one provisioning per client at a time)
+# ---------------------------------------------------------------------------
+
+class _Flight:
+    """One in-flight provisioning for a client_id, shared by concurrent callers."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: dict | None = None
+        self.error: BaseException | None = None
+        self.started_at = time.monotonic()
+        self.finished_at: float | None = None
+        self._async_waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def outcome(self) -> dict:
+        if self.error is not None:
+            raise self.error
+        return dict(self.result)
+
+    async def wait_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with _flights_lock:
+            if self.done.is_set():
+                return
+            self._async_waiters.append((loop, future))
+        await future
+
+    def land(self) -> None:
+        """Wake every waiter. Must be called with _flights_lock held."""
+        self.finished_at = time.monotonic()
+        self.done.set()
+        for loop, future in self._async_waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+        self._async_waiters.clear()
+
+
+_flights: dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def _join_flight(client_id: str) -> tuple[_Flight, bool]:
+    """Return the in-flight provisioning for client_id and whether the caller leads it."""
+    with _flights_lock:
+        flight = _flights.get(client_id)
+        if flight is not None:
+            return flight, False
+        flight = _flights[client_id] = _Flight()
+        return flight, True
+
+
+def _land_flight(client_id: str, flight: _Flight) -> None:
+    if flight.result is None and flight.error is None:
+        # The leading request was cancelled before it finished
+        flight.error = RuntimeError(f"Provisioning for {client_id} was interrupted, please retry")
+    with _flights_lock:
+        if _flights.get(client_id) is flight:
+            del _flights[client_id]
+        flight.land()
+
+
 # ---------------------------------------------------------------------------
 # Access (main flow)
 # ---------------------------------------------------------------------------
 
+def _access_action(result: dict) -> str:
+    return result["action"]
+
+
+@metrics.timed(metrics.ACCESS_SECONDS, _access_action)
 def get_or_create_access(client_id: str) -> dict:
     """Main access flow for a client.
 
+    Concurrent requests for the same client_id (double clicks, browser
+    retries) share a single provisioning and all get the same result.
+
     Returns:
         dict with keys:
-            "action": "reused" | "pool" | "created"
+            "action": "reused" | "pool" | "created" | "reset"
             "url": str
     Raises:
-        ValueError: no ports available and nothing to recycle
+        ValueError: no ports available and nothing to recycle, or every node overloaded
         RuntimeError: container creation failed
     """
     logger.info("[ACCESS] -------- Request for CPF=%s --------", client_id)
+    tracing.annotate(client_id=client_id)
+
+    flight, leader = _join_flight(client_id)
+    if not leader:
+        logger.info("[ACCESS] Provisioning already in flight for CPF=%s, waiting for it", client_id)
+        tracing.annotate(joined_flight=True)
+        flight.done.wait()
+        return flight.outcome()
+
+    try:
+        flight.result = _provision(client_id)
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        _land_flight(client_id, flight)
+    tracing.annotate(action=flight.result["action"])
+    return dict(flight.result)
+
+
+def _provision(client_id: str) -> dict:
+    """Run _provision_flow() in the calling thread with the blocking Docker client."""
+    return _run_inline(_provision_flow(client_id, _inline,
+                                       functools.partial(_inline, containers.create_container),
+                                       functools.partial(_inline, containers.reset_container)))
+
+
+async def _inline(fn, *args):
+    """Call fn in the current thread; the counterpart of asyncio.to_thread for _run_inline()."""
+    return fn(*args)
+
+
+def _run_inline(coro):
+    """Run a coroutine that never suspends (it only awaits _inline) without an event loop."""
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("_run_inline() coroutine suspended; it must only await _inline()")
+
+
+@metrics.timed(metrics.ACCESS_SECONDS, _access_action)
+async def get_or_create_access_async(client_id: str) -> dict:
+    """Same as get_or_create_access() for the ASGI entry point.
+
+    The reuse/pool/port steps are short and run in a worker thread; the
+    cold start (create + health wait) runs on the event loop through the
+    async Docker client, so it does not hold a thread while the container boots.
+    """
+    logger.info("[ACCESS] -------- Request for CPF=%s (async) --------", client_id)
+    tracing.annotate(client_id=client_id)
+
+    flight, leader = _join_flight(client_id)
+    if not leader:
+        logger.info("[ACCESS] Provisioning already in flight for CPF=%s, waiting for it", client_id)
+        tracing.annotate(joined_flight=True)
+        await flight.wait_async()
+        return flight.outcome()
+
+    try:
+        flight.result = await _aprovision(client_id)
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        _land_flight(client_id, flight)
+    tracing.annotate(action=flight.result["action"])
+    return dict(flight.result)
+
+
+async def _aprovision(client_id: str) -> dict:
+    """Run _provision_flow() with state steps in worker threads and Docker on the event loop."""
+    return await _provision_flow(client_id, asyncio.to_thread,
+                                 containers.acreate_container, containers.areset_container)
+
+
+async def _provision_flow(client_id: str, blocking, create, reset) -> dict:
+    """Steps 1-5 of the access flow, run by the single in-flight caller.
+
+    Shared by both entry points: blocking(fn, *args) runs a state/sync
+    step, create and reset are the container calls. The async path passes
+    asyncio.to_thread and the async Docker client; the sync path runs
+    everything inline (see _provision()).
+    """
+    result = await blocking(_reuse_or_claim, client_id)
+    if result:
+        return result
+
+    # Only nodes under the admission thresholds take new containers
+    allowed = resource_monitor.admissible_nodes()
+    port = await blocking(containers.allocate_port, None, allowed)
+    if port is None and RECYCLE_MODE == "reset":
+        rec = await blocking(_take_over_victim, client_id, allowed)
+        if rec:
+            try:
+                info = await reset(rec["container_id"], client_id, rec["port"])
+            except Exception as e:
+                raise await blocking(_reset_failed, client_id, rec, e) from e
+            return await blocking(_finish_reset, client_id, info)
+
+    port = await blocking(_reserve_port_for, client_id, port, allowed)
+
+    # 4. Create container
+    logger.info("[ACCESS] Creating new container for CPF=%s on port %d...", client_id, port)
+    try:
+        info = await create(client_id, port)
+    except Exception as e:
+        logger.exception("[ACCESS] FAILED to create container for CPF=%s: %s", client_id, e)
+        await blocking(state.release_port, port)
+        raise RuntimeError(f"Failed to create container: {e}") from e
+
+    return await blocking(_finish_created, client_id, info)
+
+
+def _access_url(port: int, container_id: str) -> str:
+    """Where the client is sent: its session behind the proxy, or the container's published port."""
+    if proxy.enabled():
+        return proxy.session_url(port, container_id)
+    return containers.access_url(port)
 
+
+@tracing.traced("access.reuse_or_claim")
+def _reuse_or_claim(client_id: str) -> dict | None:
+    """Steps 1-2 of the access flow: reuse the client's container or claim one from the pool.
+
+    Returns the access result, or None when a new container must be created.
+    Raises ValueError when a new session is not admitted (see _admit()).
+    """
     # 1. Check existing record
     record = state.find_by_client(client_id)
 
     if record:
         logger.info("[ACCESS] Found existing record: CPF=%s container=%s port=%d",
-                     client_id, record["container_id"][:12], record["port"])
+                    client_id, record["container_id"][:12], record["port"], extra=SAMPLED)
 
         if containers.is_container_healthy(record["container_id"]):
             state.touch_client(client_id)
-            url = f"https://{VNC_HOST}:{record['port']}"
-            logger.info("[ACCESS] Container HEALTHY -> REUSING, redirect to %s", url)
+            url = _access_url(record["port"], record["container_id"])
+            logger.info("[ACCESS] Container HEALTHY -> REUSING, redirect to %s", url, extra=SAMPLED)
             return {"action": "reused", "url": url}
         else:
             logger.warning("[ACCESS] Container DEAD -> cleaning up CPF=%s container=%s",
                            client_id, record["container_id"][:12])
-            containers.remove_container(record["container_id"])
-            state.remove_by_client(client_id)
+            _drop_session(record["container_id"], client_id)
             logger.info("[ACCESS] Cleanup done for CPF=%s, will assign or create", client_id)
     else:
         logger.info("[ACCESS] No existing record for CPF=%s", client_id)
 
+    _admit(client_id)
+
     # 2. Try to claim a pool container (instant!)
     pool_rec = state.claim_pool_container(client_id)
     if pool_rec:
+        # Pool containers may be kept paused (WARM_POOL_PAUSED)
+        containers.unpause_container(pool_rec["container_id"])
         if containers.is_container_healthy(pool_rec["container_id"]):
-            url = f"https://{VNC_HOST}:{pool_rec['port']}"
+            try:
+                containers.rename_claimed_container(pool_rec["container_id"], client_id)
+            except Exception as e:
+                # The state still records the owner; only a rebuild from Docker alone would miss it
+                logger.warning("[ACCESS] Could not rename claimed container=%s: %s", pool_rec["container_id"][:12], e)
+            url = _access_url(pool_rec["port"], pool_rec["container_id"])
             logger.info("[ACCESS] POOL -> assigned container=%s port=%d to CPF=%s (instant!)",
                          pool_rec["container_id"][:12], pool_rec["port"], client_id)
 
             # Replenish pool in background
+            warm_pool.record_demand("pool")
             warm_pool.replenish_pool()
 
             return {"action": "pool", "url": url}
         else:
             logger.warning("[ACCESS] Pool container DEAD, cleaning up and continuing...")
-            containers.remove_container(pool_rec["container_id"])
-            state.remove_by_client(client_id)
+            _drop_session(pool_rec["container_id"], client_id)
 
     logger.info("[ACCESS] No pool containers available, creating new one...")
+    return None
+
 
-    # 3. Allocate a free port
-    used = state.used_ports()
-    logger.info("[ACCESS] Ports in use: %s (%d/%d)",
-                sorted(used), len(used), containers.PORT_MAX - containers.PORT_MIN + 1)
-    port = containers.allocate_port(used)
+@tracing.traced("access.reserve_port_for")
+def _reserve_port_for(client_id: str, port: int | None = None, among: list | None = None) -> int:
+    """Step 3: reserve a free port, recycling the oldest session if all are taken.
+
+    port is a port the caller already reserved, if any; among are the nodes
+    the port may be on (default: all).
+    """
+    if port is None:
+        port = containers.allocate_port(among=among)
 
     if port is None:
-        port = _recycle_oldest_container(client_id)
+        port = _recycle_oldest_container(client_id, among)
 
     if port is None:
         logger.error("[ACCESS] No available ports and no containers to recycle for CPF=%s", client_id)
         raise ValueError("No available ports. All VNC slots are in use.")
 
-    # 4. Create container
-    logger.info("[ACCESS] Creating new container for CPF=%s on port %d...", client_id, port)
-    try:
-        info = containers.create_container(client_id, port)
-    except Exception as e:
-        logger.exception("[ACCESS] FAILED to create container for CPF=%s: %s", client_id, e)
-        raise RuntimeError(f"Failed to create container: {e}") from e
+    return port
+
+
+@tracing.traced("access.admit")
+def _admit(client_id: str) -> None:
+    """Admission control for a new session (pool claim or new container).
+
+    A session is admitted while at least one node is under the resource
+    thresholds. Otherwise ADMISSION_ACTION either refuses it or first
+    recycles the heaviest idle session on an overloaded node.
+    """
+    if resource_monitor.admissible_nodes():
+        return
+
+    if ADMISSION_ACTION == "recycle":
+        found = resource_monitor.heaviest_idle_session(ADMISSION_RECYCLE_IDLE_MINUTES)
+        if found:
+            victim, memory_mb = found
+            logger.warning("[ADMISSION] Nodes overloaded, recycling idle CPF=%s container=%s (%.0f MB) for CPF=%s",
+                           victim["client_id"], victim["container_id"][:12], memory_mb, client_id)
+            if _drop_session(victim["container_id"], victim["client_id"]) is None:
+                logger.warning("[ADMISSION] Container=%s no longer belongs to CPF=%s, leaving it",
+                               victim["container_id"][:12], victim["client_id"])
+            else:
+                metrics.ADMISSIONS.labels("recycled").inc()
+                resource_monitor.forget(victim["container_id"])
+                warm_pool.replenish_pool()
+                if resource_monitor.admissible_nodes():
+                    return
+
+    reasons = ", ".join(f"{node.name}: {resource_monitor.overload_reason(node)}" for node in containers.NODES)
+    logger.warning("[ADMISSION] REFUSED new session for CPF=%s (%s)", client_id, reasons)
+    metrics.ADMISSIONS.labels("refused").inc()
+    raise ValueError("All VNC hosts are at capacity, please retry later.")
+
 
-    # 5. Persist
+@tracing.traced("access.finish_created")
+def _finish_created(client_id: str, info: dict) -> dict:
+    """Step 5: persist the new container and return the access result."""
     state.add_record(
         client_id=client_id,
         container_id=info["container_id"],
@@ -182,34 +549,220 @@ def get_or_create_access(client_id: str) -> dict:
         port=info["port"],
     )
 
-    url = f"https://{VNC_HOST}:{port}"
+    url = _access_url(info["port"], info["container_id"])
     logger.info("[ACCESS] SUCCESS: CPF=%s -> container=%s port=%d, redirect to %s",
-                client_id, info["container_id"][:12], port, url)
+                client_id, info["container_id"][:12], info["port"], url)
 
     # Replenish pool in background
+    warm_pool.record_demand("created")
     warm_pool.replenish_pool()
 
     return {"action": "created", "url": url}
 
 
-def _recycle_oldest_container(requesting_client_id: str) -> int | None:
-    """Kill the container with the oldest last_accessed_at and return its port."""
-    oldest = state.find_oldest_accessed()
-    if not oldest:
+@tracing.traced("access.take_over_victim")
+def _take_over_victim(client_id: str, among: list | None = None) -> dict | None:
+    """RECYCLE_MODE=reset: move the recycle victim's record (and port) to client_id.
+
+    Only sessions on among (default: all nodes) are candidates. Picking the
+    victim and reassigning its record are one state operation, so
+    concurrent callers never take the same container. Returns the victim's
+    record as it was, or None if there is nothing to recycle.
+    """
+    ranges = [(node.port_min, node.port_max) for node in (containers.NODES if among is None else among)]
+    victim = state.take_reset_victim(RECYCLE_POLICY, RECYCLE_PROTECT_MINUTES, ranges,
+                                     client_id, f"vnc_{client_id}")
+    if not victim:
         return None
 
-    logger.warning("[RECYCLE] All ports full! Recycling oldest container...")
+    logger.warning("[RECYCLE] All ports full! Resetting container (policy=%s)...", RECYCLE_POLICY)
     logger.warning("[RECYCLE] Victim: CPF=%s container=%s port=%d last_accessed=%s",
-                   oldest["client_id"], oldest["container_id"][:12], oldest["port"],
-                   oldest.get("last_accessed_at", "unknown"))
+                   victim["client_id"], victim["container_id"][:12], victim["port"],
+                   victim.get("last_accessed_at", "unknown"))
+    metrics.RECYCLES.labels("reset").inc()
+    return victim
 
-    containers.remove_container(oldest["container_id"])
-    state.remove_by_client(oldest["client_id"])
 
-    port = oldest["port"]
-    logger.info("[RECYCLE] Port %d freed from CPF=%s, reusing for CPF=%s",
-                port, oldest["client_id"], requesting_client_id)
-    return port
+def _reset_failed(client_id: str, rec: dict, error: Exception) -> RuntimeError:
+    """Drop a container whose reset failed and return the error to raise."""
+    logger.exception("[RECYCLE] FAILED to reset container=%s for CPF=%s: %s",
+                     rec["container_id"][:12], client_id, error)
+    _drop_session(rec["container_id"], client_id)
+    return RuntimeError(f"Failed to reset container: {error}")
+
+
+@tracing.traced("access.finish_reset")
+def _finish_reset(client_id: str, info: dict) -> dict:
+    """Return the access result for a container taken over by reset (record already reassigned)."""
+    url = _access_url(info["port"], info["container_id"])
+    logger.info("[ACCESS] RESET: CPF=%s -> container=%s port=%d, redirect to %s",
+                client_id, info["container_id"][:12], info["port"], url)
+    warm_pool.record_demand("created")
+    return {"action": "reset", "url": url}
+
+
+@tracing.traced("access.recycle_oldest_container")
+def _recycle_oldest_container(requesting_client_id: str, among: list | None = None) -> int | None:
+    """Kill the session chosen by RECYCLE_POLICY and return its port, reserved for the caller.
+
+    Only sessions on among (default: all nodes) are candidates. Picking the
+    victim, dropping its record and leasing its port are one state
+    operation, so concurrent recyclers never pick the same victim.
+    """
+    ranges = [(node.port_min, node.port_max) for node in (containers.NODES if among is None else among)]
+    victim = state.take_recycle_victim(RECYCLE_POLICY, RECYCLE_PROTECT_MINUTES, ranges)
+    if not victim:
+        return None
+
+    logger.warning("[RECYCLE] All ports full! Recycling container (policy=%s)...", RECYCLE_POLICY)
+    metrics.RECYCLES.labels("destroy").inc()
+    logger.warning("[RECYCLE] Victim: CPF=%s container=%s port=%d last_accessed=%s",
+                   victim["client_id"], victim["container_id"][:12], victim["port"],
+                   victim.get("last_accessed_at", "unknown"))
+
+    containers.remove_container(victim["container_id"])
+
+    logger.info("[RECYCLE] Port %d freed from CPF=%s, reserved for CPF=%s",
+                victim["port"], victim["client_id"], requesting_client_id)
+    return victim["port"]
+
+
+# ---------------------------------------------------------------------------
+# Background provisioning (ACCESS_MODE=background)
+# ---------------------------------------------------------------------------
+
+# client_id -> its latest background job (a _Flight kept after it lands)
+_jobs: dict[str, _Flight] = {}
+_job_executor: ThreadPoolExecutor | None = None
+_job_tasks: set[asyncio.Task] = set()
+
+
+def _job_for(client_id: str) -> tuple[_Flight, bool]:
+    """Return client_id's running job, or a new one, and whether it is new."""
+    with _flights_lock:
+        now = time.monotonic()
+        for cid in [c for c, job in _jobs.items()
+                    if job.finished_at is not None and now - job.finished_at > PROVISION_RESULT_TTL_SECONDS]:
+            del _jobs[cid]
+        job = _jobs.get(client_id)
+        if job is not None and not job.done.is_set():
+            return job, False
+        job = _jobs[client_id] = _Flight()
+        metrics.PROVISIONS_PENDING.inc()
+        return job, True
+
+
+def _land_job(job: _Flight) -> None:
+    metrics.PROVISIONS_PENDING.dec()
+    with _flights_lock:
+        job.land()
+
+
+def _run_job(client_id: str, job: _Flight) -> None:
+    # A trace of its own: the request that started the job has already answered
+    try:
+        with tracing.trace("access.job"):
+            job.result = get_or_create_access(client_id)
+    except Exception as e:
+        job.error = e
+    finally:
+        _land_job(job)
+
+
+async def _arun_job(client_id: str, job: _Flight) -> None:
+    try:
+        with tracing.trace("access.job"):
+            job.result = await get_or_create_access_async(client_id)
+    except Exception as e:
+        job.error = e
+    finally:
+        _land_job(job)
+
+
+def _pending(job: _Flight) -> dict:
+    if job.done.is_set():
+        return job.outcome()
+    return {"action": "pending", "url": None}
+
+
+def start_access(client_id: str) -> dict:
+    """ACCESS_MODE=background twin of get_or_create_access().
+
+    Runs the access flow as a job on a bounded thread pool and waits for it
+    at most ACCESS_BACKGROUND_GRACE_SECONDS. Returns the access result when
+    it finished by then (reuse, pool claim), or {"action": "pending"} while
+    the container is still being provisioned; follow it with access_status().
+    Raises what get_or_create_access() raises if the job failed in the grace period.
+    """
+    global _job_executor
+    job, new = _job_for(client_id)
+    if new:
+        with _flights_lock:
+            if _job_executor is None:
+                _job_executor = ThreadPoolExecutor(max_workers=PROVISION_CONCURRENCY, thread_name_prefix="provision")
+        # The job logs under the request's correlation id
+        _job_executor.submit(contextvars.copy_context().run, _run_job, client_id, job)
+    job.done.wait(ACCESS_BACKGROUND_GRACE_SECONDS)
+    result = _pending(job)
+    if result["action"] == "pending":
+        logger.info("[ACCESS] CPF=%s is being provisioned in the background", client_id)
+    return result
+
+
+async def start_access_async(client_id: str) -> dict:
+    """start_access() for the ASGI entry point: the job is a task on the running event loop."""
+    job, new = _job_for(client_id)
+    if new:
+        task = asyncio.get_running_loop().create_task(_arun_job(client_id, job))
+        _job_tasks.add(task)
+        task.add_done_callback(_job_tasks.discard)
+    try:
+        await asyncio.wait_for(job.wait_async(), ACCESS_BACKGROUND_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        pass
+    result = _pending(job)
+    if result["action"] == "pending":
+        logger.info("[ACCESS] CPF=%s is being provisioned in the background", client_id)
+    return result
+
+
+def access_status(client_id: str) -> dict:
+    """Progress of client_id's session, for the waiting page.
+
+    Returns a dict with "status":
+        "pending"  being provisioned ("elapsed" and "expected" seconds)
+        "ready"    redirect to "url"
+        "error"    provisioning failed ("error", "code" 503 or 500)
+        "unknown"  no job in this process and no healthy container: call /access again
+    """
+    with _flights_lock:
+        job = _jobs.get(client_id)
+    if job is None:
+        record = state.find_by_client(client_id)
+        if record and containers.is_container_healthy(record["container_id"]):
+            return {"status": "ready", "url": _access_url(record["port"], record["container_id"])}
+        return {"status": "unknown"}
+    if not job.done.is_set():
+        return {
+            "status": "pending",
+            "elapsed": round(time.monotonic() - job.started_at, 1),
+            "expected": round(containers.expected_boot_seconds(), 1),
+        }
+    if job.error is not None:
+        return {"status": "error", "error": str(job.error), "code": 503 if isinstance(job.error, ValueError) else 500}
+    return {"status": "ready", "url": job.result["url"]}
+
+
+async def wait_access_status(client_id: str, timeout: float) -> dict:
+    """access_status() once the client's job finishes, or after timeout seconds."""
+    with _flights_lock:
+        job = _jobs.get(client_id)
+    if job is not None:
+        try:
+            await asyncio.wait_for(job.wait_async(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    return await asyncio.to_thread(access_status, client_id)
 
 
 # ---------------------------------------------------------------------------
@@ -226,15 +779,53 @@ def get_status() -> dict:
     return {
         "active_containers": assigned_count,
         "pool_containers": pool_count,
-        "max_slots": containers.PORT_MAX - containers.PORT_MIN + 1,
+        "max_slots": containers.total_slots(),
+        "nodes": _node_status(records),
+        "pool": warm_pool.get_progress(),
         "records": records,
     }
 
 
+def _node_status(records: list[dict]) -> list[dict]:
+    """Per-node slot usage for /status."""
+    result = []
+    for node in containers.NODES:
+        on_node = [r for r in records if node.owns(r["port"])]
+        pool = sum(1 for r in on_node if r["client_id"] == "__pool__")
+        result.append({
+            "name": node.name,
+            "host": node.host,
+            "ports": f"{node.port_min}-{node.port_max}",
+            "max_slots": node.capacity,
+            "active_containers": len(on_node) - pool,
+            "pool_containers": pool,
+            "resources": resource_monitor.load(node),
+        })
+    return result
+
+
 # ---------------------------------------------------------------------------
 # Remove
 # ---------------------------------------------------------------------------
 
+def _drop_session(container_id: str, client_id: str) -> dict | None:
+    """Delete client_id's record of container_id, then kill the container.
+
+    Under RECYCLE_MODE=reset a container can be handed to another CPF at any
+    time, so the record is only deleted while it still belongs to client_id
+    and the container is left alone otherwise. The port stays leased until
+    the container is gone. Returns the deleted record, or None.
+    """
+    rec = state.remove_by_container(container_id, client_id=client_id, lease_port=True)
+    if rec is None:
+        return None
+    try:
+        containers.remove_container(container_id)
+    finally:
+        state.release_port(rec["port"])
+    return rec
+
+
 def remove_client(client_id: str) -> dict | None:
     """Remove a specific client's container. Returns dict or None if not found."""
     logger.info("[REMOVE] -------- Remove request for CPF=%s --------", client_id)
@@ -247,8 +838,10 @@ def remove_client(client_id: str) -> dict | None:
 
     logger.info("[REMOVE] Found record: CPF=%s container=%s port=%d",
                 client_id, record["container_id"][:12], record["port"])
-    containers.remove_container(record["container_id"])
-    state.remove_by_client(client_id)
+    if _drop_session(record["container_id"], client_id) is None:
+        logger.warning("[REMOVE] Container=%s no longer belongs to CPF=%s, leaving it",
+                       record["container_id"][:12], client_id)
+        return None
     logger.info("[REMOVE] SUCCESS: CPF=%s container removed and record deleted", client_id)
 
     # Replenish pool in background (port freed)
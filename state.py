@@ -1,60 +1,263 @@
-import json
+import fcntl
 import logging
 import os
 import threading
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Callable
+
+import metrics
+import tracing
+from logging_setup import SAMPLED, lazy
 
 logger = logging.getLogger(__name__)
 
+# Which StateBackend implementation to use: "journal" (single worker) or "sqlite"
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "journal")
+
 STATE_FILE = os.environ.get("STATE_FILE", "state.json")
 
-_lock = threading.Lock()
+# Append-only journal of mutations applied on top of the STATE_FILE snapshot
+JOURNAL_FILE = os.environ.get("STATE_JOURNAL_FILE", STATE_FILE + ".journal")
 
+# Rewrite the snapshot (and truncate the journal) after this many journal entries
+COMPACT_EVERY = int(os.environ.get("STATE_COMPACT_EVERY", "500"))
 
-def _read_state() -> list[dict]:
-    if not os.path.exists(STATE_FILE):
-        logger.debug("[STATE] File %s does not exist, returning empty list", STATE_FILE)
-        return []
-    with open(STATE_FILE, "r") as f:
+# SQLite database used when STATE_BACKEND=sqlite
+STATE_DB = os.environ.get("STATE_DB", os.path.splitext(STATE_FILE)[0] + ".db")
+
+# How long a reserved port stays leased if no record claims it (create failed/crashed)
+PORT_LEASE_SECONDS = int(os.environ.get("PORT_LEASE_SECONDS", "300"))
+
+# Victim selection policies accepted by take_recycle_victim() / take_reset_victim()
+RECYCLE_POLICIES = ("lru", "lfu")
+
+# Lock file used to elect the single worker that runs background jobs
+LEADER_LOCK_FILE = os.environ.get("LEADER_LOCK_FILE", STATE_FILE + ".leader")
+
+
+class StateBackend:
+    """Storage interface behind the module-level state functions.
+
+    Implementations must make every method atomic with respect to the other
+    callers they can see (threads for "journal", processes for "sqlite").
+    Records are plain dicts with the keys documented in ARCHITECTURE.md.
+    """
+
+    name = "abstract"
+
+    def load_records(self) -> list[dict]:
+        raise NotImplementedError
+
+    def save_records(self, records: list[dict]) -> None:
+        raise NotImplementedError
+
+    def find_by_client(self, client_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def find_by_container(self, container_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def find_by_port(self, port: int) -> dict | None:
+        """Return the client (non-pool) record holding port, through an index."""
+        raise NotImplementedError
+
+    def add_record(self, record: dict) -> None:
+        """Insert a record, replacing any existing one for the same (non-pool) client."""
+        raise NotImplementedError
+
+    def touch_client(self, client_id: str, now: str) -> None:
+        raise NotImplementedError
+
+    def take_recycle_victim(self, policy: str, protect_before: str | None,
+                            port_ranges: list[tuple[int, int]], ttl: float) -> dict | None:
+        """Atomically pick the recycle victim, delete its record and lease its port.
+
+        The victim is the assigned record (never __pool__) to recycle first
+        under policy, found in O(log n) or better: "lru" is the least
+        recently accessed, "lfu" the lowest access_count (least recently
+        accessed first among equals). Records created after protect_before
+        (ISO timestamp) or whose port lies outside port_ranges are skipped. The freed port is leased for ttl
+        seconds (see reserve_port()), so concurrent callers get distinct
+        victims and no one else can take the port. Returns the removed record.
+        """
+        raise NotImplementedError
+
+    def remove_by_client(self, client_id: str) -> int:
+        """Delete the records for client_id and return how many were removed."""
+        raise NotImplementedError
+
+    def remove_by_container(self, container_id: str, client_id: str | None = None,
+                            lease_ttl: float | None = None) -> dict | None:
+        """Delete the record of one container and return it.
+
+        If client_id is given the record is only deleted while it still
+        belongs to that client. If lease_ttl is given the record's port is
+        leased in the same write (see reserve_port()), so it is not handed
+        out before the container is gone. Returns None when nothing was deleted.
+        """
+        raise NotImplementedError
+
+    def remove_many(self, records: list[dict]) -> list[dict]:
+        """Delete several records in one write and return the ones removed.
+
+        A record is skipped if it changed since it was read (claimed,
+        touched or replaced), so a session that became active again is kept.
+        """
+        raise NotImplementedError
+
+    def used_ports(self) -> set[int]:
+        raise NotImplementedError
+
+    def find_unassigned(self) -> list[dict]:
+        raise NotImplementedError
+
+    def claim_pool_container(self, client_id: str, now: str) -> dict | None:
+        """Atomically drop client_id's record and reassign the oldest pool record to it."""
+        raise NotImplementedError
+
+    def take_reset_victim(self, policy: str, protect_before: str | None, port_ranges: list[tuple[int, int]],
+                          to_client_id: str, container_name: str, now: str) -> dict | None:
+        """Atomically pick the recycle victim and hand its record (and port) to to_client_id.
+
+        Same choice as take_recycle_victim() (to_client_id's own record is
+        never picked). Drops to_client_id's record, keeps the victim's
+        container and port, and resets the timestamps and access_count.
+        Returns the victim's record as it was before the handover.
+        """
+        raise NotImplementedError
+
+    def reserve_port(self, port_min: int, port_max: int, ttl: float) -> int | None:
+        """Lease a port not used by any record or live lease.
+
+        The lease is consumed by add_record() for that port and expires
+        after ttl seconds otherwise.
+        """
+        raise NotImplementedError
+
+    def release_port(self, port: int) -> None:
+        raise NotImplementedError
+
+
+_backend: StateBackend | None = None
+_backend_lock = threading.Lock()
+_leader_fd = None
+
+_listeners: list[Callable[[str, str | None], None]] = []
+
+
+def _create_backend() -> StateBackend:
+    if STATE_BACKEND == "journal":
+        from state_journal import JournalBackend
+        return JournalBackend(STATE_FILE, JOURNAL_FILE, COMPACT_EVERY)
+    if STATE_BACKEND == "sqlite":
+        from state_sqlite import SQLiteBackend
+        return SQLiteBackend(STATE_DB)
+    raise ValueError(f"Unknown STATE_BACKEND: {STATE_BACKEND!r} (expected 'journal' or 'sqlite')")
+
+
+def get_backend() -> StateBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend()
+    return _backend
+
+
+def try_become_leader() -> bool:
+    """Return True if this process should run the background jobs.
+
+    With several gunicorn workers sharing a SQLite database, only the first
+    worker to grab an exclusive lock on LEADER_LOCK_FILE runs startup
+    reconciliation, the cleanup scheduler and the warm pool. The lock is
+    held for the lifetime of the process and released by the OS on exit.
+    """
+    global _leader_fd
+    if _leader_fd is not None:
+        return True
+    fd = open(LEADER_LOCK_FILE, "w")
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        fd.close()
+        logger.info("[STATE] Another worker is the leader (pid=%d will only serve requests)", os.getpid())
+        return False
+    _leader_fd = fd
+    logger.info("[STATE] This worker is the leader (pid=%d)", os.getpid())
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Change notifications
+# ---------------------------------------------------------------------------
+
+def subscribe(callback: Callable[[str, str | None], None]) -> None:
+    """Register callback(client_id, last_accessed_at) for changes to client records.
+
+    Called after every write made by this process that creates, touches,
+    claims or removes an assigned (non-pool) record; last_accessed_at is
+    None when the record was removed. Writes made by other workers are not
+    reported.
+    """
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+
+def _notify(client_id: str, last_accessed_at: str | None) -> None:
+    if client_id == "__pool__":
+        return
+    for callback in _listeners:
         try:
-            data = json.load(f)
-        except (json.JSONDecodeError, ValueError):
-            logger.warning("[STATE] Failed to parse %s, returning empty list", STATE_FILE)
-            return []
-    if not isinstance(data, list):
-        logger.warning("[STATE] %s content is not a list, returning empty list", STATE_FILE)
-        return []
-    return data
+            callback(client_id, last_accessed_at)
+        except Exception:
+            logger.exception("[STATE] Listener %s failed", getattr(callback, "__name__", callback))
+
 
+def _timed(operation: str):
+    """Record the latency of a state operation (orchestrator_state_seconds) and trace it as a span."""
+    timer = metrics.STATE_SECONDS.labels(operation).time()
+    return lambda func: tracing.traced(f"state.{operation}")(timer(func))
 
-def _write_state(records: list[dict]) -> None:
-    tmp = STATE_FILE + ".tmp"
-    with open(tmp, "w") as f:
-        json.dump(records, f, indent=2, default=str)
-    os.replace(tmp, STATE_FILE)
-    logger.debug("[STATE] Wrote %d records to %s", len(records), STATE_FILE)
 
+# ---------------------------------------------------------------------------
+# Public API
+# ---------------------------------------------------------------------------
 
+@_timed("load_records")
 def load_records() -> list[dict]:
-    with _lock:
-        return _read_state()
+    return get_backend().load_records()
 
 
+@_timed("save_records")
 def save_records(records: list[dict]) -> None:
-    with _lock:
-        _write_state(records)
-    logger.info("[STATE] Saved %d records to %s", len(records), STATE_FILE)
+    get_backend().save_records(records)
+    logger.info("[STATE] Saved %d records (%s backend)", len(records), get_backend().name)
+    for rec in records:
+        _notify(rec["client_id"], rec.get("last_accessed_at", rec.get("created_at")))
 
 
+@_timed("find_by_client")
 def find_by_client(client_id: str) -> dict | None:
-    for rec in load_records():
-        if rec["client_id"] == client_id:
-            logger.debug("[STATE] Found record for CPF=%s port=%d", client_id, rec["port"])
-            return rec
-    logger.debug("[STATE] No record found for CPF=%s", client_id)
-    return None
+    rec = get_backend().find_by_client(client_id)
+    if rec:
+        logger.debug("[STATE] Found record for CPF=%s port=%d", client_id, rec["port"])
+    else:
+        logger.debug("[STATE] No record found for CPF=%s", client_id)
+    return rec
+
+
+@_timed("find_by_container")
+def find_by_container(container_id: str) -> dict | None:
+    return get_backend().find_by_container(container_id)
+
 
+@_timed("find_by_port")
+def find_by_port(port: int) -> dict | None:
+    """Return the session (never a pool container) holding port, or None."""
+    return get_backend().find_by_port(port)
 
+
+@_timed("add_record")
 def add_record(client_id: str, container_id: str, container_name: str, port: int) -> dict:
     now = datetime.now().isoformat()
     record = {
@@ -64,95 +267,168 @@ def add_record(client_id: str, container_id: str, container_name: str, port: int
         "port": port,
         "created_at": now,
         "last_accessed_at": now,
+        "access_count": 1,
     }
-    with _lock:
-        records = _read_state()
-        # Pool containers allow multiple records with same client_id
-        if client_id != "__pool__":
-            records = [r for r in records if r["client_id"] != client_id]
-        records.append(record)
-        _write_state(records)
+    get_backend().add_record(record)
     logger.info("[STATE] ADD record: CPF=%s container=%s port=%d", client_id, container_id[:12], port)
+    _notify(client_id, now)
     return record
 
 
+@_timed("touch_client")
 def touch_client(client_id: str) -> None:
     """Update last_accessed_at for a client."""
     now = datetime.now().isoformat()
-    with _lock:
-        records = _read_state()
-        for rec in records:
-            if rec["client_id"] == client_id:
-                rec["last_accessed_at"] = now
-                break
-        _write_state(records)
-    logger.info("[STATE] TOUCH: CPF=%s last_accessed_at=%s", client_id, now)
-
-
-def find_oldest_accessed() -> dict | None:
-    """Return the record with the oldest last_accessed_at (excludes pool containers)."""
-    records = [r for r in load_records() if r["client_id"] != "__pool__"]
-    if not records:
-        logger.info("[STATE] No records to find oldest")
+    get_backend().touch_client(client_id, now)
+    logger.info("[STATE] TOUCH: CPF=%s last_accessed_at=%s", client_id, now, extra=SAMPLED)
+    _notify(client_id, now)
+
+
+def _protect_before(policy: str, protect_minutes: int) -> str | None:
+    """Validate policy and turn protect_minutes into the oldest protected created_at."""
+    if policy not in RECYCLE_POLICIES:
+        raise ValueError(f"Unknown recycle policy: {policy!r} (expected one of {RECYCLE_POLICIES})")
+    if protect_minutes <= 0:
         return None
-    oldest = min(records, key=lambda r: r.get("last_accessed_at", r.get("created_at", "")))
-    logger.info("[STATE] Oldest accessed: CPF=%s last_accessed=%s port=%d",
-                oldest["client_id"], oldest.get("last_accessed_at", "unknown"), oldest["port"])
-    return oldest
+    return (datetime.now() - timedelta(minutes=protect_minutes)).isoformat()
+
 
+@_timed("take_recycle_victim")
+def take_recycle_victim(policy: str, protect_minutes: int, port_ranges: list[tuple[int, int]]) -> dict | None:
+    """Remove the session to recycle and lease its port to the caller, in one step.
 
+    policy is one of RECYCLE_POLICIES; sessions created less than
+    protect_minutes ago, pool containers and sessions whose port is outside
+    port_ranges are never picked. The returned record's port stays leased
+    for PORT_LEASE_SECONDS: add_record() it or release_port() it.
+    """
+    protect_before = _protect_before(policy, protect_minutes)
+    victim = get_backend().take_recycle_victim(policy, protect_before, port_ranges, PORT_LEASE_SECONDS)
+    if not victim:
+        logger.info("[STATE] No recycle victim (policy=%s protect=%dmin)", policy, protect_minutes)
+        return None
+    logger.info("[STATE] RECYCLE: removed CPF=%s last_accessed=%s accesses=%d, leased port %d (policy=%s)",
+                victim["client_id"], victim.get("last_accessed_at", "unknown"),
+                victim.get("access_count", 1), victim["port"], policy)
+    _notify(victim["client_id"], None)
+    return victim
+
+
+@_timed("remove_by_client")
 def remove_by_client(client_id: str) -> None:
-    with _lock:
-        records = _read_state()
-        before = len(records)
-        records = [r for r in records if r["client_id"] != client_id]
-        _write_state(records)
-    logger.info("[STATE] REMOVE record: CPF=%s (records: %d -> %d)", client_id, before, len(records))
+    removed = get_backend().remove_by_client(client_id)
+    logger.info("[STATE] REMOVE record: CPF=%s (%d removed)", client_id, removed)
+    if removed:
+        _notify(client_id, None)
+
 
+@_timed("remove_by_container")
+def remove_by_container(container_id: str, client_id: str | None = None,
+                        lease_port: bool = False) -> dict | None:
+    """Remove the record of a single container (e.g. one specific pool container).
 
+    Pass client_id to only remove it while it still belongs to that client,
+    and lease_port=True to keep its port leased until release_port().
+    """
+    rec = get_backend().remove_by_container(container_id, client_id,
+                                            PORT_LEASE_SECONDS if lease_port else None)
+    if rec:
+        logger.info("[STATE] REMOVE record: container=%s CPF=%s port=%d",
+                    container_id[:12], rec["client_id"], rec["port"])
+        _notify(rec["client_id"], None)
+    return rec
+
+
+@_timed("remove_many")
+def remove_many(records: list[dict]) -> list[dict]:
+    """Remove a batch of records (e.g. idle sessions) in a single state commit.
+
+    Records modified since they were read are left alone. Returns the
+    records that were actually removed.
+    """
+    if not records:
+        return []
+    removed = get_backend().remove_many(records)
+    logger.info("[STATE] REMOVE batch: %d of %d records removed (%d changed meanwhile)",
+                len(removed), len(records), len(records) - len(removed))
+    for rec in removed:
+        _notify(rec["client_id"], None)
+    return removed
+
+
+@_timed("used_ports")
 def used_ports() -> set[int]:
-    ports = {r["port"] for r in load_records()}
-    logger.debug("[STATE] Used ports: %s", sorted(ports))
+    ports = get_backend().used_ports()
+    logger.debug("[STATE] Used ports: %s", lazy(sorted, ports))
     return ports
 
 
+@_timed("find_unassigned")
 def find_unassigned() -> list[dict]:
     """Return all pool records (client_id == '__pool__')."""
-    records = load_records()
-    pool = [r for r in records if r["client_id"] == "__pool__"]
+    pool = get_backend().find_unassigned()
     logger.debug("[STATE] Pool containers: %d", len(pool))
     return pool
 
 
+@_timed("claim_pool_container")
 def claim_pool_container(client_id: str) -> dict | None:
     """Claim a pool container for a specific client.
 
-    Finds the first __pool__ record, changes its client_id to the given CPF,
-    updates last_accessed_at, and returns the updated record.
+    Takes the oldest __pool__ record, changes its client_id to the given CPF
+    (and container_name to vnc_{CPF}), updates last_accessed_at, and returns
+    the updated record.
     Returns None if no pool container is available.
     """
     now = datetime.now().isoformat()
-    with _lock:
-        records = _read_state()
-
-        # Remove any existing record for this client
-        records = [r for r in records if r["client_id"] != client_id]
+    pool_rec = get_backend().claim_pool_container(client_id, now)
 
-        # Find first pool container
-        pool_rec = None
-        for rec in records:
-            if rec["client_id"] == "__pool__":
-                pool_rec = rec
-                break
-
-        if pool_rec is None:
-            logger.debug("[STATE] No pool container available to claim")
-            return None
-
-        pool_rec["client_id"] = client_id
-        pool_rec["last_accessed_at"] = now
-        _write_state(records)
+    if pool_rec is None:
+        logger.debug("[STATE] No pool container available to claim")
+        return None
 
     logger.info("[STATE] CLAIM pool: container=%s port=%d -> CPF=%s",
                 pool_rec["container_id"][:12], pool_rec["port"], client_id)
+    _notify(client_id, now)
     return pool_rec
+
+
+@_timed("take_reset_victim")
+def take_reset_victim(policy: str, protect_minutes: int, port_ranges: list[tuple[int, int]],
+                      to_client_id: str, container_name: str) -> dict | None:
+    """Give the session to recycle (its running container and port) to to_client_id, in one step.
+
+    Same choice as take_recycle_victim(); used when recycling by reset.
+    Returns the victim's record as it was before, or None.
+    """
+    protect_before = _protect_before(policy, protect_minutes)
+    now = datetime.now().isoformat()
+    victim = get_backend().take_reset_victim(policy, protect_before, port_ranges, to_client_id, container_name, now)
+    if not victim:
+        logger.info("[STATE] No recycle victim (policy=%s protect=%dmin)", policy, protect_minutes)
+        return None
+    logger.info("[STATE] REASSIGN: container=%s port=%d CPF=%s -> CPF=%s (policy=%s, last_accessed=%s accesses=%d)",
+                victim["container_id"][:12], victim["port"], victim["client_id"], to_client_id, policy,
+                victim.get("last_accessed_at", "unknown"), victim.get("access_count", 1))
+    _notify(victim["client_id"], None)
+    _notify(to_client_id, now)
+    return victim
+
+
+@_timed("reserve_port")
+def reserve_port(port_min: int, port_max: int) -> int | None:
+    """Lease a free port in [port_min, port_max] for PORT_LEASE_SECONDS.
+
+    Call add_record() with the port to keep it, or release_port() if the
+    container could not be created.
+    """
+    port = get_backend().reserve_port(port_min, port_max, PORT_LEASE_SECONDS)
+    if port is not None:
+        logger.debug("[STATE] RESERVE port %d (lease %ds)", port, PORT_LEASE_SECONDS)
+    return port
+
+
+@_timed("release_port")
+def release_port(port: int) -> None:
+    get_backend().release_port(port)
+    logger.debug("[STATE] RELEASE port %d", port)
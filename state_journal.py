@@ -0,0 +1,518 @@
+import fcntl
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+
+from ports import PortAllocator
+from state import StateBackend
+
+logger = logging.getLogger(__name__)
+
+
+class JournalBackend(StateBackend):
+    """In-memory indexed store persisted as a JSON snapshot + append-only journal.
+
+    Records are keyed by container_id; the other dicts are secondary indexes
+    kept in step by _put() / _delete(). For recycle victim selection,
+    assigned records still inside the protection window wait in a
+    created_at heap; past it they move to per-port-range LRU
+    (last_accessed_at) and LFU (access_count, last_accessed_at) heaps, all
+    lazily invalidated, so a pick never walks protected sessions. Lookups
+    never touch disk, each mutation appends one line to the journal, and
+    the snapshot is rewritten in a background thread every
+    ``compact_every`` journal entries.
+
+    Only one process may own the files at a time (enforced with flock), so
+    this backend requires a single gunicorn worker.
+    """
+
+    name = "journal"
+
+    def __init__(self, state_file: str, journal_file: str, compact_every: int):
+        self.state_file = state_file
+        self.journal_file = journal_file
+        self.compact_every = compact_every
+
+        self._lock = threading.Lock()
+        self._records: dict[str, dict] = {}
+        self._by_client: dict[str, str] = {}      # client_id -> container_id (assigned only)
+        self._by_port: dict[int, str] = {}        # port -> container_id
+        self._pool: dict[str, None] = {}          # ordered set of __pool__ container_ids
+        # One allocator per port range (node), created on its first reserve_port()
+        self._ports: dict[tuple[int, int], PortAllocator] = {}
+        # port -> expires_at (monotonic) of leases taken before their range had an allocator
+        self._early_leases: dict[int, float] = {}
+        # Recycle candidates. Assigned records created after _protect_before
+        # wait in _protected, a heap of (created_at, container_id) whose live
+        # entry per record is in _protected_at; older ones are in _eligible and
+        # in the LRU/LFU heaps of every port range that asked for a victim.
+        self._protected: list[tuple[str, str]] = []
+        self._protected_at: dict[str, str] = {}
+        self._protect_before = ""
+        self._eligible: set[str] = set()
+        self._victims: dict[tuple[int, int], dict[str, list[tuple]]] = {}
+
+        self._loaded = False
+        self._owner_fd = None
+        self._journal = None
+        self._journal_entries = 0
+        self._compacting = False
+
+        # Serializes snapshot writes; _generation changes whenever save_records()
+        # replaces the whole state, so a slower background compaction never
+        # overwrites a newer snapshot.
+        self._snapshot_lock = threading.Lock()
+        self._generation = 0
+
+    # -----------------------------------------------------------------------
+    # Persistence (snapshot + journal)
+    # -----------------------------------------------------------------------
+
+    def _read_snapshot(self) -> list[dict]:
+        if not os.path.exists(self.state_file):
+            logger.debug("[STATE] File %s does not exist, returning empty list", self.state_file)
+            return []
+        with open(self.state_file, "r") as f:
+            try:
+                data = json.load(f)
+            except (json.JSONDecodeError, ValueError):
+                logger.warning("[STATE] Failed to parse %s, returning empty list", self.state_file)
+                return []
+        if not isinstance(data, list):
+            logger.warning("[STATE] %s content is not a list, returning empty list", self.state_file)
+            return []
+        return data
+
+    def _write_snapshot(self, records: list[dict]) -> None:
+        tmp = self.state_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(records, f, default=str)
+        os.replace(tmp, self.state_file)
+        logger.debug("[STATE] Wrote snapshot of %d records to %s", len(records), self.state_file)
+
+    def _replay_journal(self, path: str) -> int:
+        """Apply every complete entry of a journal file to the in-memory store."""
+        if not os.path.exists(path):
+            return 0
+        applied = 0
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except (json.JSONDecodeError, ValueError):
+                    # A torn last line from a crash mid-append; everything before it is valid
+                    logger.warning("[STATE] Ignoring corrupt journal entry in %s", path)
+                    break
+                if entry.get("op") == "put":
+                    self._put(entry["rec"])
+                elif entry.get("op") == "del":
+                    self._delete(entry["container_id"])
+                elif entry.get("op") == "del_many":
+                    for container_id in entry["container_ids"]:
+                        self._delete(container_id)
+                applied += 1
+        return applied
+
+    def _open_journal(self) -> None:
+        self._journal = open(self.journal_file, "a")
+
+    def _append(self, entry: dict) -> None:
+        """Append one mutation to the journal. Must be called with _lock held."""
+        self._journal.write(json.dumps(entry, default=str) + "\n")
+        self._journal.flush()
+        self._journal_entries += 1
+        if self._journal_entries >= self.compact_every and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self._compact, daemon=True).start()
+
+    def _compact(self) -> None:
+        """Write a fresh snapshot in the background and drop the journal it covers.
+
+        The live journal is rotated to ``.old`` under the lock, so writers keep
+        appending to a new file while the snapshot is written. Until the rotated
+        journal is deleted, a restart replays snapshot + .old + journal, which is
+        idempotent because journal entries carry whole records.
+        """
+        old_journal = self.journal_file + ".old"
+        try:
+            with self._lock:
+                generation = self._generation
+                records = [dict(r) for r in self._records.values()]
+                self._journal.close()
+                if os.path.exists(old_journal):
+                    # Previous compaction never finished: fold it into this one
+                    with open(old_journal, "a") as dst, open(self.journal_file, "r") as src:
+                        dst.write(src.read())
+                    os.remove(self.journal_file)
+                else:
+                    os.replace(self.journal_file, old_journal)
+                self._open_journal()
+                self._journal_entries = 0
+            with self._snapshot_lock:
+                if generation != self._generation:
+                    logger.debug("[STATE] State replaced during compaction, discarding stale snapshot")
+                    return
+                self._write_snapshot(records)
+                os.remove(old_journal)
+            logger.info("[STATE] Compacted journal into snapshot (%d records)", len(records))
+        except OSError as e:
+            logger.error("[STATE] Journal compaction failed: %s", e)
+        finally:
+            self._compacting = False
+
+    def _ensure_loaded(self) -> None:
+        """Load snapshot + journal into memory on first use. Must be called with _lock held."""
+        if self._loaded:
+            return
+        self._owner_fd = open(self.journal_file + ".lock", "w")
+        try:
+            fcntl.flock(self._owner_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError(
+                f"State file {self.state_file} is owned by another process; "
+                f"the journal backend supports a single worker (use STATE_BACKEND=sqlite)"
+            )
+        for rec in self._read_snapshot():
+            self._put(rec)
+        replayed = self._replay_journal(self.journal_file + ".old") + self._replay_journal(self.journal_file)
+        # Start from a clean snapshot so the journal only holds this process' writes
+        self._write_snapshot(list(self._records.values()))
+        for path in (self.journal_file + ".old", self.journal_file):
+            if os.path.exists(path):
+                os.remove(path)
+        self._open_journal()
+        self._loaded = True
+        logger.info("[STATE] Loaded %d records from %s (%d journal entries replayed)",
+                    len(self._records), self.state_file, replayed)
+
+    # -----------------------------------------------------------------------
+    # Index maintenance
+    # -----------------------------------------------------------------------
+
+    def _put(self, rec: dict) -> None:
+        cid = rec["container_id"]
+        if cid in self._records:
+            self._delete(cid)
+        self._records[cid] = rec
+        self._by_port[rec["port"]] = cid
+        for ports in self._ports.values():
+            ports.commit(rec["port"])
+        if rec["client_id"] == "__pool__":
+            self._pool[cid] = None
+        else:
+            self._by_client[rec["client_id"]] = cid
+            self._enqueue(rec)
+
+    def _delete(self, container_id: str) -> dict | None:
+        rec = self._records.pop(container_id, None)
+        if rec is None:
+            return None
+        if self._by_port.get(rec["port"]) == container_id:
+            del self._by_port[rec["port"]]
+            for ports in self._ports.values():
+                ports.release(rec["port"])
+        if rec["client_id"] == "__pool__":
+            self._pool.pop(container_id, None)
+        elif self._by_client.get(rec["client_id"]) == container_id:
+            del self._by_client[rec["client_id"]]
+        self._eligible.discard(container_id)
+        return rec
+
+    def _enqueue(self, rec: dict) -> None:
+        """Index an assigned record as a recycle candidate (every put is an access)."""
+        cid = rec["container_id"]
+        created_at = rec.get("created_at", "")
+        if created_at > self._protect_before:
+            if self._protected_at.get(cid) != created_at:
+                self._protected_at[cid] = created_at
+                heapq.heappush(self._protected, (created_at, cid))
+            return
+        self._protected_at.pop(cid, None)
+        self._eligible.add(cid)
+        for (port_min, port_max), heaps in self._victims.items():
+            if port_min <= rec["port"] <= port_max:
+                for policy, heap in heaps.items():
+                    heapq.heappush(heap, _VICTIM_KEYS[policy](rec))
+                    if len(heap) > 2 * len(self._eligible) + 1024:
+                        # Mostly superseded keys: rebuild from the live records
+                        heaps[policy] = self._victim_heap(policy, port_min, port_max)
+
+    def _release_protected(self, protect_before: str | None) -> None:
+        """Move the records created up to protect_before (None = all) to the victim heaps."""
+        if protect_before is None:
+            protect_before = "\uffff"
+        if protect_before <= self._protect_before:
+            return
+        self._protect_before = protect_before
+        while self._protected and self._protected[0][0] <= protect_before:
+            created_at, cid = heapq.heappop(self._protected)
+            if self._protected_at.get(cid) != created_at:
+                continue
+            del self._protected_at[cid]
+            rec = self._records.get(cid)
+            if rec is not None and rec["client_id"] != "__pool__" and rec.get("created_at", "") == created_at:
+                self._enqueue(rec)
+
+    def _victim_heap(self, policy: str, port_min: int, port_max: int) -> list[tuple]:
+        heap = [_VICTIM_KEYS[policy](self._records[cid]) for cid in self._eligible
+                if port_min <= self._records[cid]["port"] <= port_max]
+        heapq.heapify(heap)
+        return heap
+
+    def _victim_heaps(self, policy: str, port_range: tuple[int, int]) -> list[tuple]:
+        """LRU or LFU heap of one port range, built on its first victim pick."""
+        heaps = self._victims.get(port_range)
+        if heaps is None:
+            heaps = self._victims[port_range] = {p: self._victim_heap(p, *port_range) for p in _VICTIM_KEYS}
+        return heaps[policy]
+
+    def _store(self, rec: dict) -> None:
+        self._put(rec)
+        self._append({"op": "put", "rec": rec})
+
+    def _drop(self, container_id: str) -> dict | None:
+        rec = self._delete(container_id)
+        if rec is not None:
+            self._append({"op": "del", "container_id": container_id})
+        return rec
+
+    # -----------------------------------------------------------------------
+    # StateBackend
+    # -----------------------------------------------------------------------
+
+    def load_records(self) -> list[dict]:
+        with self._lock:
+            self._ensure_loaded()
+            return [dict(r) for r in self._records.values()]
+
+    def save_records(self, records: list[dict]) -> None:
+        with self._lock:
+            self._ensure_loaded()
+            self._records.clear()
+            self._by_client.clear()
+            self._by_port.clear()
+            self._pool.clear()
+            self._protected.clear()
+            self._protected_at.clear()
+            self._eligible.clear()
+            self._victims.clear()
+            for rec in records:
+                self._put(dict(rec))
+            for ports in self._ports.values():
+                ports.resync()
+            with self._snapshot_lock:
+                self._generation += 1
+                self._write_snapshot(list(self._records.values()))
+                if os.path.exists(self.journal_file + ".old"):
+                    os.remove(self.journal_file + ".old")
+            self._journal.truncate(0)
+            self._journal_entries = 0
+
+    def find_by_client(self, client_id: str) -> dict | None:
+        with self._lock:
+            self._ensure_loaded()
+            cid = self._by_client.get(client_id)
+            return dict(self._records[cid]) if cid else None
+
+    def find_by_container(self, container_id: str) -> dict | None:
+        with self._lock:
+            self._ensure_loaded()
+            rec = self._records.get(container_id)
+            return dict(rec) if rec else None
+
+    def find_by_port(self, port: int) -> dict | None:
+        with self._lock:
+            self._ensure_loaded()
+            rec = self._records.get(self._by_port.get(port))
+            return dict(rec) if rec and rec["client_id"] != "__pool__" else None
+
+    def add_record(self, record: dict) -> None:
+        with self._lock:
+            self._ensure_loaded()
+            # Pool containers allow multiple records with same client_id
+            client_id = record["client_id"]
+            if client_id != "__pool__" and client_id in self._by_client:
+                self._drop(self._by_client[client_id])
+            self._store(dict(record))
+
+    def touch_client(self, client_id: str, now: str) -> None:
+        with self._lock:
+            self._ensure_loaded()
+            cid = self._by_client.get(client_id)
+            if cid is None and client_id == "__pool__" and self._pool:
+                cid = next(iter(self._pool))
+            if cid is not None:
+                rec = self._records[cid]
+                self._store(dict(rec, last_accessed_at=now, access_count=rec.get("access_count", 1) + 1))
+
+    def take_recycle_victim(self, policy: str, protect_before: str | None,
+                            port_ranges: list[tuple[int, int]], ttl: float) -> dict | None:
+        with self._lock:
+            self._ensure_loaded()
+            victim = self._victim(policy, protect_before, port_ranges)
+            if victim is None:
+                return None
+            self._drop(victim["container_id"])
+            port = victim["port"]
+            for port_min, port_max in port_ranges:
+                if port_min <= port <= port_max:
+                    self._allocator(port_min, port_max).lease(port, ttl)
+            return dict(victim)
+
+    def take_reset_victim(self, policy: str, protect_before: str | None, port_ranges: list[tuple[int, int]],
+                          to_client_id: str, container_name: str, now: str) -> dict | None:
+        with self._lock:
+            self._ensure_loaded()
+            victim = self._victim(policy, protect_before, port_ranges, exclude_client=to_client_id)
+            if victim is None:
+                return None
+            victim = dict(victim)
+            if to_client_id in self._by_client:
+                self._drop(self._by_client[to_client_id])
+            self._store(dict(victim, client_id=to_client_id, container_name=container_name,
+                             created_at=now, last_accessed_at=now, access_count=1))
+            return victim
+
+    def _victim(self, policy: str, protect_before: str | None, port_ranges: list[tuple[int, int]],
+                exclude_client: str | None = None) -> dict | None:
+        """Record to recycle first under policy. Must be called with _lock held.
+
+        Sessions created within the protection window, with a port outside
+        port_ranges or belonging to exclude_client are skipped. Protected
+        sessions are not in the victim heaps at all; the heads of the heaps
+        of port_ranges are compared, dropping superseded keys on the way.
+        """
+        self._release_protected(protect_before)
+        heaps = [self._victim_heaps(policy, tuple(port_range)) for port_range in port_ranges]
+        skipped = []
+        try:
+            while True:
+                best = None
+                for heap in heaps:
+                    while heap:
+                        rec = self._records.get(heap[0][-1])
+                        if rec is not None and rec["container_id"] in self._eligible \
+                                and _VICTIM_KEYS[policy](rec) == heap[0]:
+                            break
+                        heapq.heappop(heap)
+                    if heap and (best is None or heap[0] < best[0]):
+                        best = heap
+                if best is None:
+                    return None
+                rec = self._records[best[0][-1]]
+                if rec["client_id"] == exclude_client or \
+                        (protect_before is not None and rec.get("created_at", "") > protect_before):
+                    skipped.append((best, heapq.heappop(best)))
+                    continue
+                return rec
+        finally:
+            for heap, key in skipped:
+                heapq.heappush(heap, key)
+
+    def remove_by_client(self, client_id: str) -> int:
+        with self._lock:
+            self._ensure_loaded()
+            if client_id == "__pool__":
+                cids = list(self._pool)
+            else:
+                cids = [self._by_client[client_id]] if client_id in self._by_client else []
+            for cid in cids:
+                self._drop(cid)
+            return len(cids)
+
+    def remove_by_container(self, container_id: str, client_id: str | None = None,
+                            lease_ttl: float | None = None) -> dict | None:
+        with self._lock:
+            self._ensure_loaded()
+            rec = self._records.get(container_id)
+            if rec is None or (client_id is not None and rec["client_id"] != client_id):
+                return None
+            rec = self._drop(container_id)
+            if lease_ttl is not None:
+                self._lease(rec["port"], lease_ttl)
+            return rec
+
+    def _lease(self, port: int, ttl: float) -> None:
+        """Lease port in its range's allocator, or until one is created. Must be called with _lock held."""
+        for (port_min, port_max), ports in self._ports.items():
+            if port_min <= port <= port_max:
+                ports.lease(port, ttl)
+                return
+        self._early_leases[port] = time.monotonic() + ttl
+
+    def remove_many(self, records: list[dict]) -> list[dict]:
+        with self._lock:
+            self._ensure_loaded()
+            removed = []
+            for rec in records:
+                current = self._records.get(rec["container_id"])
+                if current is None or current["client_id"] != rec["client_id"] \
+                        or current.get("last_accessed_at") != rec.get("last_accessed_at"):
+                    continue
+                removed.append(self._delete(rec["container_id"]))
+            if removed:
+                # One journal entry for the whole batch
+                self._append({"op": "del_many", "container_ids": [r["container_id"] for r in removed]})
+            return [dict(r) for r in removed]
+
+    def used_ports(self) -> set[int]:
+        with self._lock:
+            self._ensure_loaded()
+            return set(self._by_port)
+
+    def find_unassigned(self) -> list[dict]:
+        with self._lock:
+            self._ensure_loaded()
+            return [dict(self._records[cid]) for cid in self._pool]
+
+    def claim_pool_container(self, client_id: str, now: str) -> dict | None:
+        with self._lock:
+            self._ensure_loaded()
+            if client_id in self._by_client:
+                self._drop(self._by_client[client_id])
+            if not self._pool:
+                return None
+            cid = next(iter(self._pool))
+            pool_rec = dict(self._records[cid], client_id=client_id, container_name=f"vnc_{client_id}",
+                            last_accessed_at=now, access_count=1)
+            self._store(pool_rec)
+            return dict(pool_rec)
+
+    def reserve_port(self, port_min: int, port_max: int, ttl: float) -> int | None:
+        with self._lock:
+            self._ensure_loaded()
+            return self._allocator(port_min, port_max).reserve(ttl)
+
+    def _allocator(self, port_min: int, port_max: int) -> PortAllocator:
+        """Allocator of one port range, created on first use. Must be called with _lock held."""
+        ports = self._ports.get((port_min, port_max))
+        if ports is None:
+            ports = self._ports[(port_min, port_max)] = PortAllocator(port_min, port_max, self._by_port.__contains__)
+            now = time.monotonic()
+            for port in [p for p in self._early_leases if port_min <= p <= port_max]:
+                remaining = self._early_leases.pop(port) - now
+                if remaining > 0:
+                    ports.lease(port, remaining)
+        return ports
+
+    def release_port(self, port: int) -> None:
+        with self._lock:
+            self._ensure_loaded()
+            self._early_leases.pop(port, None)
+            for ports in self._ports.values():
+                ports.release(port)
+
+
+def _lru_key(rec: dict) -> tuple[str, str]:
+    return (rec.get("last_accessed_at", rec.get("created_at", "")), rec["container_id"])
+
+
+def _lfu_key(rec: dict) -> tuple[int, str, str]:
+    return (rec.get("access_count", 1), rec.get("last_accessed_at", rec.get("created_at", "")), rec["container_id"])
+
+
+# Heap key of a recycle candidate under each RECYCLE_POLICY (smallest goes first)
+_VICTIM_KEYS = {"lru": _lru_key, "lfu": _lfu_key}
@@ -0,0 +1,288 @@
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from state import StateBackend
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    container_id     TEXT PRIMARY KEY,
+    client_id        TEXT NOT NULL,
+    container_name   TEXT NOT NULL,
+    port             INTEGER NOT NULL,
+    created_at       TEXT NOT NULL,
+    last_accessed_at TEXT NOT NULL,
+    access_count     INTEGER NOT NULL DEFAULT 1
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_records_client
+    ON records(client_id) WHERE client_id != '__pool__';
+CREATE INDEX IF NOT EXISTS idx_records_pool
+    ON records(client_id) WHERE client_id = '__pool__';
+CREATE INDEX IF NOT EXISTS idx_records_port ON records(port);
+CREATE INDEX IF NOT EXISTS idx_records_last_accessed ON records(last_accessed_at);
+CREATE INDEX IF NOT EXISTS idx_records_lfu
+    ON records(access_count, last_accessed_at) WHERE client_id != '__pool__';
+CREATE TABLE IF NOT EXISTS port_leases (
+    port       INTEGER PRIMARY KEY,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_port_leases_expires ON port_leases(expires_at);
+
+-- Ports with neither a record nor a lease, kept in sync by the triggers
+-- below so reserve_port() takes one with a single index seek. A range is
+-- filled the first time it is reserved from (see port_ranges).
+CREATE TABLE IF NOT EXISTS free_ports (port INTEGER PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS port_ranges (
+    port_min INTEGER NOT NULL,
+    port_max INTEGER NOT NULL,
+    PRIMARY KEY (port_min, port_max)
+);
+CREATE TRIGGER IF NOT EXISTS trg_records_insert AFTER INSERT ON records BEGIN
+    DELETE FROM free_ports WHERE port = NEW.port;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_records_delete AFTER DELETE ON records BEGIN
+    INSERT OR IGNORE INTO free_ports (port) SELECT OLD.port
+    WHERE NOT EXISTS (SELECT 1 FROM records WHERE port = OLD.port)
+      AND NOT EXISTS (SELECT 1 FROM port_leases WHERE port = OLD.port);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_records_port AFTER UPDATE OF port ON records BEGIN
+    DELETE FROM free_ports WHERE port = NEW.port;
+    INSERT OR IGNORE INTO free_ports (port) SELECT OLD.port
+    WHERE NOT EXISTS (SELECT 1 FROM records WHERE port = OLD.port)
+      AND NOT EXISTS (SELECT 1 FROM port_leases WHERE port = OLD.port);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_leases_insert AFTER INSERT ON port_leases BEGIN
+    DELETE FROM free_ports WHERE port = NEW.port;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_leases_delete AFTER DELETE ON port_leases BEGIN
+    INSERT OR IGNORE INTO free_ports (port) SELECT OLD.port
+    WHERE NOT EXISTS (SELECT 1 FROM records WHERE port = OLD.port);
+END;
+"""
+
+_COLUMNS = "client_id, container_id, container_name, port, created_at, last_accessed_at, access_count"
+
+
+class SQLiteBackend(StateBackend):
+    """State stored in a SQLite database in WAL mode.
+
+    Every process (gunicorn worker) opens its own connections, one per
+    thread, and all writes run inside ``BEGIN IMMEDIATE`` transactions, so
+    several workers can share the same database safely.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, db_path: str, busy_timeout_ms: int = 5000):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._conn()
+        logger.info("[STATE] Using SQLite state database %s", db_path)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute(f"PRAGMA busy_timeout = {self.busy_timeout_ms}")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            # INSERT OR REPLACE must fire the delete triggers for the row it replaces
+            conn.execute("PRAGMA recursive_triggers = ON")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """Run a block inside an IMMEDIATE transaction (takes the write lock up front)."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _query(self, sql: str, params: tuple = ()) -> list[dict]:
+        return [dict(row) for row in self._conn().execute(sql, params)]
+
+    # -----------------------------------------------------------------------
+    # StateBackend
+    # -----------------------------------------------------------------------
+
+    def load_records(self) -> list[dict]:
+        return self._query(f"SELECT {_COLUMNS} FROM records ORDER BY rowid")
+
+    def save_records(self, records: list[dict]) -> None:
+        with self._write() as conn:
+            conn.execute("DELETE FROM records")
+            conn.executemany(
+                f"INSERT OR REPLACE INTO records ({_COLUMNS}) VALUES "
+                "(:client_id, :container_id, :container_name, :port, :created_at, :last_accessed_at, :access_count)",
+                [dict(r, last_accessed_at=r.get("last_accessed_at", r["created_at"]),
+                      access_count=r.get("access_count", 1)) for r in records],
+            )
+
+    def find_by_client(self, client_id: str) -> dict | None:
+        rows = self._query(f"SELECT {_COLUMNS} FROM records WHERE client_id = ? LIMIT 1", (client_id,))
+        return rows[0] if rows else None
+
+    def find_by_container(self, container_id: str) -> dict | None:
+        rows = self._query(f"SELECT {_COLUMNS} FROM records WHERE container_id = ?", (container_id,))
+        return rows[0] if rows else None
+
+    def find_by_port(self, port: int) -> dict | None:
+        rows = self._query(f"SELECT {_COLUMNS} FROM records WHERE port = ? AND client_id != '__pool__' LIMIT 1",
+                           (port,))
+        return rows[0] if rows else None
+
+    def add_record(self, record: dict) -> None:
+        with self._write() as conn:
+            if record["client_id"] != "__pool__":
+                conn.execute("DELETE FROM records WHERE client_id = ?", (record["client_id"],))
+            conn.execute("DELETE FROM port_leases WHERE port = ?", (record["port"],))
+            conn.execute(
+                f"INSERT OR REPLACE INTO records ({_COLUMNS}) VALUES "
+                "(:client_id, :container_id, :container_name, :port, :created_at, :last_accessed_at, :access_count)",
+                dict(record, access_count=record.get("access_count", 1)),
+            )
+
+    def touch_client(self, client_id: str, now: str) -> None:
+        self._conn().execute(
+            "UPDATE records SET last_accessed_at = ?, access_count = access_count + 1 WHERE rowid = "
+            "(SELECT rowid FROM records WHERE client_id = ? LIMIT 1)",
+            (now, client_id),
+        )
+
+    def _select_victim(self, conn: sqlite3.Connection, policy: str, protect_before: str | None,
+                       port_ranges: list[tuple[int, int]], exclude_client: str | None = None):
+        """Row of the record to recycle first under policy (inside the caller's write)."""
+        # Both orders are served by an index (idx_records_last_accessed / idx_records_lfu)
+        order = "access_count, last_accessed_at" if policy == "lfu" else "last_accessed_at"
+        in_ranges = " OR ".join("port BETWEEN ? AND ?" for _ in port_ranges) or "0"
+        return conn.execute(
+            f"SELECT rowid, {_COLUMNS} FROM records WHERE client_id != '__pool__' AND client_id IS NOT ? "
+            f"AND (? IS NULL OR created_at <= ?) AND ({in_ranges}) ORDER BY {order} LIMIT 1",
+            (exclude_client, protect_before, protect_before, *[p for r in port_ranges for p in r]),
+        ).fetchone()
+
+    def take_recycle_victim(self, policy: str, protect_before: str | None,
+                            port_ranges: list[tuple[int, int]], ttl: float) -> dict | None:
+        with self._write() as conn:
+            row = self._select_victim(conn, policy, protect_before, port_ranges)
+            if row is None:
+                return None
+            conn.execute("DELETE FROM records WHERE rowid = ?", (row["rowid"],))
+            conn.execute("INSERT OR REPLACE INTO port_leases (port, expires_at) VALUES (?, ?)",
+                         (row["port"], time.time() + ttl))
+        return _record(row)
+
+    def take_reset_victim(self, policy: str, protect_before: str | None, port_ranges: list[tuple[int, int]],
+                          to_client_id: str, container_name: str, now: str) -> dict | None:
+        with self._write() as conn:
+            row = self._select_victim(conn, policy, protect_before, port_ranges, exclude_client=to_client_id)
+            if row is None:
+                return None
+            conn.execute("DELETE FROM records WHERE client_id = ?", (to_client_id,))
+            conn.execute(
+                "UPDATE records SET client_id = ?, container_name = ?, created_at = ?, "
+                "last_accessed_at = ?, access_count = 1 WHERE rowid = ?",
+                (to_client_id, container_name, now, now, row["rowid"]),
+            )
+        return _record(row)
+
+    def remove_by_client(self, client_id: str) -> int:
+        return self._conn().execute("DELETE FROM records WHERE client_id = ?", (client_id,)).rowcount
+
+    def remove_by_container(self, container_id: str, client_id: str | None = None,
+                            lease_ttl: float | None = None) -> dict | None:
+        with self._write() as conn:
+            row = conn.execute(
+                "DELETE FROM records WHERE container_id = ? AND (? IS NULL OR client_id = ?) "
+                f"RETURNING {_COLUMNS}",
+                (container_id, client_id, client_id),
+            ).fetchone()
+            if row is not None and lease_ttl is not None:
+                conn.execute("INSERT OR REPLACE INTO port_leases (port, expires_at) VALUES (?, ?)",
+                             (row["port"], time.time() + lease_ttl))
+        return dict(row) if row else None
+
+    def remove_many(self, records: list[dict]) -> list[dict]:
+        removed = []
+        with self._write() as conn:
+            for rec in records:
+                row = conn.execute(
+                    "DELETE FROM records WHERE container_id = ? AND client_id = ? AND last_accessed_at = ? "
+                    f"RETURNING {_COLUMNS}",
+                    (rec["container_id"], rec["client_id"],
+                     rec.get("last_accessed_at", rec.get("created_at"))),
+                ).fetchone()
+                if row:
+                    removed.append(dict(row))
+        return removed
+
+    def used_ports(self) -> set[int]:
+        return {row[0] for row in self._conn().execute("SELECT port FROM records")}
+
+    def find_unassigned(self) -> list[dict]:
+        return self._query(f"SELECT {_COLUMNS} FROM records WHERE client_id = '__pool__' ORDER BY rowid")
+
+    def claim_pool_container(self, client_id: str, now: str) -> dict | None:
+        with self._write() as conn:
+            conn.execute("DELETE FROM records WHERE client_id = ?", (client_id,))
+            row = conn.execute(
+                "UPDATE records SET client_id = ?, container_name = ?, last_accessed_at = ?, access_count = 1 "
+                "WHERE rowid = (SELECT rowid FROM records WHERE client_id = '__pool__' ORDER BY rowid LIMIT 1) "
+                f"RETURNING {_COLUMNS}",
+                (client_id, f"vnc_{client_id}", now),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def reserve_port(self, port_min: int, port_max: int, ttl: float) -> int | None:
+        # Leases are shared by all workers, so the lowest free port is picked
+        # inside the write transaction. Expired leases are found through
+        # idx_port_leases_expires (their delete trigger puts the port back in
+        # free_ports) and the pick itself is a seek on the free_ports key.
+        now = time.time()
+        with self._write() as conn:
+            conn.execute("DELETE FROM port_leases WHERE expires_at <= ?", (now,))
+            if conn.execute("INSERT OR IGNORE INTO port_ranges (port_min, port_max) VALUES (?, ?)",
+                            (port_min, port_max)).rowcount:
+                _fill_free_ports(conn, port_min, port_max)
+            row = conn.execute(
+                "SELECT port FROM free_ports WHERE port BETWEEN ? AND ? ORDER BY port LIMIT 1",
+                (port_min, port_max),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("INSERT INTO port_leases (port, expires_at) VALUES (?, ?)", (row[0], now + ttl))
+        return row[0]
+
+    def release_port(self, port: int) -> None:
+        self._conn().execute("DELETE FROM port_leases WHERE port = ?", (port,))
+
+
+def _record(row: sqlite3.Row) -> dict:
+    """A records row selected with its rowid, as a plain record dict."""
+    rec = dict(row)
+    del rec["rowid"]
+    return rec
+
+
+def _fill_free_ports(conn: sqlite3.Connection, port_min: int, port_max: int) -> None:
+    """Fill free_ports for a range reserved from for the first time (one O(range) scan)."""
+    conn.execute(
+        "INSERT OR IGNORE INTO free_ports (port) "
+        "WITH RECURSIVE slots(p) AS (SELECT ? UNION ALL SELECT p + 1 FROM slots WHERE p < ?) "
+        "SELECT p FROM slots WHERE NOT EXISTS (SELECT 1 FROM records WHERE port = p) "
+        "AND NOT EXISTS (SELECT 1 FROM port_leases WHERE port = p)",
+        (port_min, port_max),
+    )
+    logger.info("[STATE] Indexed free ports %d-%d", port_min, port_max)
@@ -0,0 +1,71 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+
+# The orchestrator modules read their configuration and connect to Docker at
+# import time, so the fake daemon (bench/fake_docker.py) and the environment
+# are set up here, before any test module imports them.
+_workdir = tempfile.mkdtemp(prefix="orchestrator-tests-")
+_socket_path = os.path.join(_workdir, "docker.sock")
+os.environ.update({
+    "DOCKER_HOST": f"unix://{_socket_path}",
+    "DOCKER_SOCKET": _socket_path,
+    "STATE_BACKEND": "journal",
+    "STATE_FILE": os.path.join(_workdir, "state.json"),
+    "WARM_POOL_SIZE": "0",
+    "VNC_HOST": "localhost",
+})
+os.environ.pop("DOCKER_NODES", None)
+os.environ.pop("PROXY_PORT", None)
+
+_daemon = subprocess.Popen([sys.executable, os.path.join(ROOT, "bench", "fake_docker.py"),
+                            "--socket", _socket_path, "--boot-seconds", "0", "--health-seconds", "0",
+                            "--jitter", "0"])
+_deadline = time.time() + 10
+while True:
+    try:
+        with socket.socket(socket.AF_UNIX) as _s:
+            _s.connect(_socket_path)
+        break
+    except OSError:
+        if time.time() > _deadline:
+            _daemon.kill()
+            raise RuntimeError("fake Docker daemon did not start")
+        time.sleep(0.05)
+
+
+def pytest_unconfigure(config):
+    _daemon.kill()
+    _daemon.wait()
+    shutil.rmtree(_workdir, ignore_errors=True)
+
+
+@pytest.fixture(params=["journal", "sqlite"])
+def backend(request, tmp_path):
+    """A fresh StateBackend of each implementation."""
+    if request.param == "journal":
+        from state_journal import JournalBackend
+        return JournalBackend(str(tmp_path / "state.json"), str(tmp_path / "state.json.journal"), 500)
+    from state_sqlite import SQLiteBackend
+    return SQLiteBackend(str(tmp_path / "state.db"))
+
+
+def make_record(client_id: str, port: int, at: str, container_id: str | None = None, access_count: int = 1) -> dict:
+    return {
+        "client_id": client_id,
+        "container_id": container_id or f"cid-{client_id}",
+        "container_name": f"vnc_{client_id}",
+        "port": port,
+        "created_at": at,
+        "last_accessed_at": at,
+        "access_count": access_count,
+    }
@@ -0,0 +1,61 @@
+import pytest
+
+import ports
+from ports import PortAllocator
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ports.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_reserve_hands_out_ports_in_order(clock):
+    used = {5001}
+    allocator = PortAllocator(5000, 5003, used.__contains__)
+
+    assert [allocator.reserve(60) for _ in range(4)] == [5000, 5002, 5003, None]
+
+
+def test_released_port_goes_to_the_back_of_the_queue(clock):
+    allocator = PortAllocator(5000, 5002, set().__contains__)
+    first = allocator.reserve(60)
+
+    allocator.release(first)
+    assert [allocator.reserve(60) for _ in range(3)] == [5001, 5002, first]
+
+
+def test_leases_expire_in_order(clock):
+    allocator = PortAllocator(5000, 5002, set().__contains__)
+    assert allocator.reserve(10) == 5000
+    assert allocator.reserve(20) == 5001
+    assert allocator.reserve(30) == 5002
+
+    clock[0] += 15
+    assert allocator.reserve(60) == 5000
+    assert allocator.reserve(60) is None
+    clock[0] += 10
+    assert allocator.reserve(60) == 5001
+
+
+def test_a_renewed_lease_outlives_its_first_expiry(clock):
+    allocator = PortAllocator(5000, 5000, set().__contains__)
+    assert allocator.reserve(10) == 5000
+
+    allocator.lease(5000, 60)
+    clock[0] += 15
+    assert allocator.reserve(60) is None
+    clock[0] += 60
+    assert allocator.reserve(60) == 5000
+
+
+def test_committed_port_is_not_released_by_its_lease(clock):
+    used = set()
+    allocator = PortAllocator(5000, 5000, used.__contains__)
+    port = allocator.reserve(10)
+
+    used.add(port)
+    allocator.commit(port)
+    clock[0] += 15
+    assert allocator.reserve(60) is None
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+import containers
+import docker_async
+import proxy
+import state
+
+
+class _Inspector:
+    def __init__(self, ip: str):
+        self.ip = ip
+
+    async def inspect_container(self, container_id: str) -> dict:
+        return {"NetworkSettings": {"Networks": {containers.NETWORK_NAME: {"IPAddress": self.ip}}}}
+
+
+@pytest.fixture
+def session(monkeypatch):
+    """One session on port 5000, found by state.find_by_port()."""
+    record = {"client_id": "111", "container_id": "c" * 64, "port": 5000}
+    monkeypatch.setattr(state, "find_by_port", lambda port: dict(record) if port == record["port"] else None)
+    monkeypatch.setattr(docker_async, "get_client", lambda url=None: _Inspector("10.10.0.7"))
+    proxy._routes.clear()
+    yield record
+    proxy._routes.clear()
+
+
+def test_token_is_bound_to_port_and_container():
+    token = proxy.session_token(5000, "c" * 64)
+
+    assert token.startswith("5000-")
+    assert token == proxy.session_token(5000, "c" * 64)
+    assert token != proxy.session_token(5000, "d" * 64)
+    assert token != proxy.session_token(5001, "c" * 64)
+
+
+def test_valid_token_resolves_to_the_container(session):
+    token = proxy.session_token(session["port"], session["container_id"])
+
+    assert asyncio.run(proxy._resolve(token)) == f"http://10.10.0.7:{containers.CONTAINER_PORT}"
+
+
+@pytest.mark.parametrize("token", [
+    "5000-" + "0" * 32,    # forged signature
+    "5001-{sig}",          # signature of another slot
+    "abc-{sig}",           # not a slot
+    "{sig}",               # no slot at all
+])
+def test_invalid_token_is_rejected(session, token):
+    signature = proxy.session_token(session["port"], session["container_id"]).partition("-")[2]
+
+    assert asyncio.run(proxy._resolve(token.format(sig=signature))) is None
+
+
+def test_recycled_slot_invalidates_old_links(session):
+    old = proxy.session_token(session["port"], session["container_id"])
+    session["container_id"] = "d" * 64
+
+    assert asyncio.run(proxy._resolve(old)) is None
+    assert asyncio.run(proxy._resolve(proxy.session_token(5000, "d" * 64))) is not None
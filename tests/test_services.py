@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+import pytest
+
+import services
+
+
+class _Provision:
+    """Stand-in for services._provision that blocks until the test releases it."""
+
+    def __init__(self, error: Exception | None = None):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.error = error
+
+    def __call__(self, client_id: str) -> dict:
+        self.calls.append(client_id)
+        self.started.set()
+        assert self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return {"action": "created", "url": f"https://localhost/{client_id}"}
+
+
+@pytest.fixture
+def provision(monkeypatch):
+    fake = _Provision()
+    monkeypatch.setattr(services, "_provision", fake)
+    return fake
+
+
+def _in_flight(client_id: str) -> bool:
+    with services._flights_lock:
+        return client_id in services._flights
+
+
+def _run_all(target, count: int) -> list[threading.Thread]:
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def test_concurrent_requests_share_one_provisioning(provision):
+    results = []
+    threads = _run_all(lambda: results.append(services.get_or_create_access("111")), 5)
+    assert provision.started.wait(5)
+    provision.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert provision.calls == ["111"]
+    assert results == [{"action": "created", "url": "https://localhost/111"}] * 5
+    assert not _in_flight("111")
+
+
+def test_async_request_joins_a_sync_flight(provision):
+    leader = threading.Thread(target=services.get_or_create_access, args=("222",))
+    leader.start()
+    assert provision.started.wait(5)
+
+    async def join():
+        waiter = asyncio.ensure_future(services.get_or_create_access_async("222"))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        provision.release.set()
+        return await waiter
+
+    assert asyncio.run(join())["url"] == "https://localhost/222"
+    leader.join(5)
+    assert provision.calls == ["222"]
+
+
+def test_failure_reaches_every_waiter(monkeypatch):
+    provision = _Provision(ValueError("No available ports. All VNC slots are in use."))
+    monkeypatch.setattr(services, "_provision", provision)
+    errors = []
+
+    def call():
+        try:
+            services.get_or_create_access("333")
+        except ValueError as e:
+            errors.append(e)
+
+    threads = _run_all(call, 3)
+    assert provision.started.wait(5)
+    provision.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(errors) == 3
+    assert not _in_flight("333")
+
+
+def test_interrupted_flight_fails_its_waiters():
+    flight, leader = services._join_flight("444")
+    joined, leads = services._join_flight("444")
+    assert leader and joined is flight and not leads
+
+    services._land_flight("444", flight)
+
+    assert flight.done.is_set()
+    with pytest.raises(RuntimeError):
+        flight.outcome()
+    assert services._join_flight("444")[1]
+    services._land_flight("444", services._flights["444"])
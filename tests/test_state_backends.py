@@ -0,0 +1,121 @@
+import json
+import subprocess
+import sys
+
+from conftest import ROOT, make_record
+
+RANGE = [(5000, 5003)]
+
+
+def test_reserve_and_release_port(backend):
+    ports = [backend.reserve_port(5000, 5003, 60) for _ in range(4)]
+    assert sorted(ports) == [5000, 5001, 5002, 5003]
+    assert backend.reserve_port(5000, 5003, 60) is None
+
+    backend.add_record(make_record("a", ports[0], "2026-01-01T00:00:01"))
+    backend.release_port(ports[0])  # owned by a record now: stays taken
+    backend.release_port(ports[1])
+    assert backend.reserve_port(5000, 5003, 60) == ports[1]
+    assert backend.reserve_port(5000, 5003, 60) is None
+
+
+def test_take_recycle_victim_lru(backend):
+    backend.add_record(make_record("old", 5000, "2026-01-01T00:00:01"))
+    backend.add_record(make_record("new", 5001, "2026-01-01T00:00:02"))
+    backend.touch_client("old", "2026-01-01T00:00:03")
+
+    victim = backend.take_recycle_victim("lru", None, RANGE, 60)
+    assert victim["client_id"] == "new"
+    assert backend.find_by_client("new") is None
+    # The freed port is leased to the caller, not handed to the next reserve
+    assert backend.reserve_port(5000, 5003, 60) not in (5000, 5001)
+
+
+def test_take_recycle_victim_lfu(backend):
+    backend.add_record(make_record("busy", 5000, "2026-01-01T00:00:01", access_count=5))
+    backend.add_record(make_record("idle", 5001, "2026-01-01T00:00:02", access_count=1))
+
+    assert backend.take_recycle_victim("lfu", None, RANGE, 60)["client_id"] == "idle"
+
+
+def test_take_recycle_victim_skips_protected_and_other_ranges(backend):
+    backend.add_record(make_record("other-node", 6000, "2026-01-01T00:00:01"))
+    backend.add_record(make_record("young", 5000, "2026-01-01T00:10:00"))
+    backend.add_record(make_record("old", 5001, "2026-01-01T00:00:02"))
+
+    assert backend.take_recycle_victim("lru", "2026-01-01T00:05:00", RANGE, 60)["client_id"] == "old"
+    assert backend.take_recycle_victim("lru", "2026-01-01T00:05:00", RANGE, 60) is None
+    assert backend.take_recycle_victim("lru", "2026-01-01T00:05:00", [], 60) is None
+    assert backend.take_recycle_victim("lru", None, RANGE, 60)["client_id"] == "young"
+
+
+def test_take_reset_victim_moves_the_record(backend):
+    backend.add_record(make_record("victim", 5000, "2026-01-01T00:00:01"))
+    backend.add_record(make_record("caller", 5001, "2026-01-01T00:00:02"))
+
+    # The caller's own session is never its victim
+    victim = backend.take_reset_victim("lru", None, [(5001, 5001)], "caller", "vnc_caller", "2026-01-01T00:01:00")
+    assert victim is None
+
+    victim = backend.take_reset_victim("lru", None, RANGE, "caller", "vnc_caller", "2026-01-01T00:01:00")
+    assert victim["client_id"] == "victim"
+    assert backend.find_by_client("victim") is None
+    moved = backend.find_by_client("caller")
+    assert (moved["container_id"], moved["port"], moved["access_count"]) == ("cid-victim", 5000, 1)
+    assert backend.find_by_container("cid-caller") is None
+
+
+def test_remove_by_container_checks_the_owner(backend):
+    backend.add_record(make_record("a", 5000, "2026-01-01T00:00:01"))
+
+    assert backend.remove_by_container("cid-a", client_id="b") is None
+    assert backend.find_by_client("a") is not None
+
+    removed = backend.remove_by_container("cid-a", client_id="a", lease_ttl=60)
+    assert removed["client_id"] == "a"
+    assert backend.find_by_client("a") is None
+    # Leased until released
+    assert 5000 not in [backend.reserve_port(5000, 5003, 60) for _ in range(3)]
+    backend.release_port(5000)
+    assert backend.reserve_port(5000, 5003, 60) == 5000
+
+
+_WRITER = """
+import os, sys
+sys.path.insert(0, {root!r})
+from state_journal import JournalBackend
+
+def make_record(client_id, port, at):
+    return {{"client_id": client_id, "container_id": f"cid-{{client_id}}", "container_name": f"vnc_{{client_id}}",
+            "port": port, "created_at": at, "last_accessed_at": at, "access_count": 1}}
+
+b = JournalBackend({state!r}, {journal!r}, 500)
+b.add_record(make_record("a", 5000, "2026-01-01T00:00:01"))
+b.save_records([make_record("a", 5000, "2026-01-01T00:00:01"),
+                make_record("b", 5001, "2026-01-01T00:00:02"),
+                make_record("c", 5002, "2026-01-01T00:00:03")])
+b.touch_client("a", "2026-01-01T00:00:04")
+b.remove_by_client("b")
+b.add_record(make_record("d", 5003, "2026-01-01T00:00:05"))
+os._exit(0)
+"""
+
+
+def test_journal_replay_after_truncation(tmp_path):
+    from state_journal import JournalBackend
+
+    state_file, journal_file = str(tmp_path / "state.json"), str(tmp_path / "state.json.journal")
+    # Crash right after the writes: save_records() truncated the journal, the
+    # later mutations are only in the journal
+    subprocess.run([sys.executable, "-c", _WRITER.format(root=ROOT, state=state_file, journal=journal_file)],
+                   check=True)
+    with open(journal_file) as f:
+        assert len(f.readlines()) == 3
+    with open(journal_file, "a") as f:
+        f.write(json.dumps({"op": "put", "rec": make_record("torn", 5004, "2026-01-01T00:00:06")})[:40])
+
+    backend = JournalBackend(state_file, journal_file, 500)
+    records = {rec["client_id"]: rec for rec in backend.load_records()}
+    assert sorted(records) == ["a", "c", "d"]
+    assert records["a"]["last_accessed_at"] == "2026-01-01T00:00:04"
+    assert records["a"]["access_count"] == 2
@@ -0,0 +1,215 @@
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import logging_setup
+import metrics
+
+# Per-request phase timelines. When on, every HTTP request and background
+# job (pool fill, idle cleanup, ACCESS_MODE=background provisioning) records
+# a trace of its spans: phases of the access flow, container operations,
+# state store operations and single Docker API calls. The last
+# TRACE_BUFFER_SIZE traces are kept and served slowest first on
+# /debug/traces. Off: traced() returns the function unchanged and span() a
+# shared no-op, so the instrumentation costs a flag check at most.
+TRACING = os.environ.get("TRACING", "0") == "1"
+
+# Finished traces kept in memory (ring buffer, per process)
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "200"))
+
+# Spans kept per trace; later ones are only counted
+TRACE_MAX_SPANS = 500
+
+_current: contextvars.ContextVar["Trace | None"] = contextvars.ContextVar("trace", default=None)
+_buffer: deque["Trace"] = deque(maxlen=TRACE_BUFFER_SIZE)
+_lock = threading.Lock()
+
+
+class Trace:
+    """Timeline of one request or background job."""
+
+    __slots__ = ("name", "attrs", "request_id", "started_at", "t0", "duration", "error", "spans", "dropped", "depth")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.request_id = logging_setup.request_id.get()
+        self.started_at = datetime.now().isoformat(timespec="milliseconds")
+        self.t0 = time.perf_counter()
+        self.duration: float | None = None
+        self.error: str | None = None
+        # (name, start offset, duration, depth, error)
+        self.spans: list[tuple[str, float, float, int, str | None]] = []
+        self.dropped = 0
+        self.depth = 0
+
+    def add(self, name: str, start: float, duration: float, depth: int, error: str | None = None) -> None:
+        if len(self.spans) >= TRACE_MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append((name, start - self.t0, duration, depth, error))
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "attrs": self.attrs,
+            "request_id": self.request_id,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+            "error": self.error,
+            "spans_dropped": self.dropped,
+            # Spans are appended when they end: list them in start order, indented by depth
+            "spans": [
+                {"name": name, "start_ms": round(start * 1000, 2), "duration_ms": round(duration * 1000, 2),
+                 "depth": depth, **({"error": error} if error else {})}
+                for name, start, duration, depth, error in sorted(self.spans, key=lambda s: (s[1], s[3]))
+            ],
+        }
+
+
+class _Scope:
+    """Context manager of a trace (root=True) or of a span within the current trace."""
+
+    __slots__ = ("name", "attrs", "root", "trace", "token", "start", "depth")
+
+    def __init__(self, name: str, attrs: dict | None = None, trace: Trace | None = None):
+        self.name = name
+        self.attrs = attrs
+        self.root = trace is None
+        self.trace = trace
+
+    def __enter__(self):
+        if self.root:
+            self.trace = Trace(self.name, self.attrs or {})
+            self.token = _current.set(self.trace)
+        else:
+            self.depth = self.trace.depth
+            self.trace.depth += 1
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        trace = self.trace
+        if self.root:
+            _current.reset(self.token)
+            trace.duration = time.perf_counter() - trace.t0
+            trace.error = exc_type.__name__ if exc_type else None
+            with _lock:
+                _buffer.append(trace)
+        else:
+            trace.depth = self.depth
+            trace.add(self.name, self.start, time.perf_counter() - self.start, self.depth,
+                      exc_type.__name__ if exc_type else None)
+        return False
+
+
+class _NoScope:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NO_SCOPE = _NoScope()
+
+
+def trace(name: str, **attrs):
+    """Context manager recording a new trace (a request or background job) until it exits."""
+    if not TRACING:
+        return _NO_SCOPE
+    return _Scope(name, attrs)
+
+
+def span(name: str):
+    """Context manager timing one phase of the current trace (no-op outside of one)."""
+    current = _current.get() if TRACING else None
+    if current is None:
+        return _NO_SCOPE
+    return _Scope(name, trace=current)
+
+
+def traced(name: str):
+    """Decorator: every call of the (sync or async) function is a span named name."""
+    def decorate(func):
+        if not TRACING:
+            return func
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def awrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def traced_job(name: str):
+    """Decorator for (sync) background jobs: every call is a trace of its own,
+    or a span when called while serving a request (e.g. POST /cleanup)."""
+    def decorate(func):
+        if not TRACING:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with (trace(name) if _current.get() is None else span(name)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def annotate(**attrs) -> None:
+    """Attach attributes (client id, action...) to the current trace."""
+    current = _current.get() if TRACING else None
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def record_docker(method: str, path: str, seconds: float) -> None:
+    """Add a Docker API call that just finished (measured by the caller) as a span."""
+    current = _current.get() if TRACING else None
+    if current is not None:
+        current.add("docker." + metrics.docker_operation(method, path),
+                    time.perf_counter() - seconds, seconds, current.depth)
+
+
+def docker_response_hook(response, *args, **kwargs) -> None:
+    """requests response hook for the docker SDK client (see record_docker())."""
+    if TRACING and _current.get() is not None:
+        try:
+            record_docker(response.request.method, response.request.path_url, response.elapsed.total_seconds())
+        except Exception:
+            pass
+
+
+# ---------------------------------------------------------------------------
+# Buffer
+# ---------------------------------------------------------------------------
+
+def slowest(limit: int = 20, name: str | None = None) -> dict:
+    """The slowest buffered traces (optionally only those whose name contains name)."""
+    with _lock:
+        traces = list(_buffer)
+    if name:
+        traces = [t for t in traces if name in t.name]
+    traces.sort(key=lambda t: t.duration, reverse=True)
+    return {
+        "enabled": TRACING,
+        "buffered": len(traces),
+        "buffer_size": TRACE_BUFFER_SIZE,
+        "traces": [t.to_dict() for t in traces[:limit]],
+    }
@@ -1,69 +1,289 @@
 import logging
+import math
 import os
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 import state
 import containers
+import metrics
+import nodes
+import resource_monitor
+import tracing
 
 logger = logging.getLogger(__name__)
 
+# Warm pool target size, across all nodes (nodes without a fixed "pool" in
+# DOCKER_NODES share it evenly)
 WARM_POOL_SIZE = int(os.environ.get("WARM_POOL_SIZE", "1"))
 
+# Adaptive sizing bounds. With the defaults (both = WARM_POOL_SIZE) the pool
+# has a fixed size; set WARM_POOL_MAX > WARM_POOL_MIN to let it follow demand.
+WARM_POOL_MIN = int(os.environ.get("WARM_POOL_MIN", str(WARM_POOL_SIZE)))
+WARM_POOL_MAX = int(os.environ.get("WARM_POOL_MAX", str(WARM_POOL_SIZE)))
+
+# Arrivals (pool claims + cold creates) are counted per window and smoothed
+# into an EWMA rate with weight WARM_POOL_RATE_ALPHA for the newest window
+WARM_POOL_RATE_WINDOW_SECONDS = int(os.environ.get("WARM_POOL_RATE_WINDOW_SECONDS", "60"))
+WARM_POOL_RATE_ALPHA = float(os.environ.get("WARM_POOL_RATE_ALPHA", "0.3"))
+
+# Target = arrivals expected during one container boot * headroom
+WARM_POOL_HEADROOM = float(os.environ.get("WARM_POOL_HEADROOM", "1.5"))
+
+# Pause pool containers once they are healthy and unpause them on claim: idle
+# pool containers use no CPU (their memory stays allocated), so a larger pool
+# fits on the same host at the cost of a sub-second unpause per claim
+WARM_POOL_PAUSED = os.environ.get("WARM_POOL_PAUSED", "0").lower() in ("1", "true", "yes")
+
+# How many pool containers may be booting at the same time
+WARM_POOL_CONCURRENCY = int(os.environ.get("WARM_POOL_CONCURRENCY", "3"))
+
+# The manager re-checks the pool this often even without replenish requests
+# (picks up claims made by other gunicorn workers and retries failed creations)
+WARM_POOL_CHECK_SECONDS = int(os.environ.get("WARM_POOL_CHECK_SECONDS", "30"))
+
+_cond = threading.Condition()
+_requested = False
+_manager: threading.Thread | None = None
+_executor: ThreadPoolExecutor | None = None
+
+# Fill progress, exposed through get_progress() (and /status)
+_progress = {
+    "target": WARM_POOL_SIZE,
+    "paused": WARM_POOL_PAUSED,
+    "ready": 0,
+    "in_flight": 0,
+    "created": 0,
+    "failed": 0,
+    "drained": 0,
+    "pool_hits": 0,
+    "cold_creates": 0,
+    "arrival_rate_per_min": 0.0,
+    "last_fill_at": None,
+}
+
+# Pool containers being created, per node (guarded by _cond)
+_booting: dict[str, int] = {}
+
+# Arrival rate tracking (guarded by _cond)
+_rate = 0.0
+_window_start = time.monotonic()
+_window_count = 0
+
+
+def start_pool_manager() -> None:
+    """Start the pool manager thread for this process and request a first fill.
+
+    Only the process that runs background jobs (the leader worker) starts
+    the manager; replenish_pool() in other processes is a no-op and the
+    leader notices their claims on its next periodic check.
+    """
+    global _manager, _executor
+    if WARM_POOL_MAX <= 0:
+        logger.debug("[POOL] WARM_POOL_MAX=0, pool disabled")
+        return
+    with _cond:
+        if _manager is None:
+            _executor = ThreadPoolExecutor(max_workers=WARM_POOL_CONCURRENCY, thread_name_prefix="pool-fill")
+            _manager = threading.Thread(target=_manager_loop, name="pool-manager", daemon=True)
+            _manager.start()
+            logger.info("[POOL] Pool manager started: size=%d min=%d max=%d concurrency=%d check=%ds paused=%s",
+                        WARM_POOL_SIZE, WARM_POOL_MIN, WARM_POOL_MAX,
+                        WARM_POOL_CONCURRENCY, WARM_POOL_CHECK_SECONDS, WARM_POOL_PAUSED)
+    replenish_pool()
+
 
 def replenish_pool() -> None:
-    """Ensure the warm pool has WARM_POOL_SIZE containers ready.
+    """Ask the pool manager to bring the pool to its current target size.
 
-    Runs the actual filling in a background thread so it never blocks
-    the caller (HTTP request, startup, cleanup, etc.).
+    Never blocks the caller (HTTP request, cleanup, etc.). Requests made
+    while the manager is busy are coalesced into a single extra pass.
     """
-    if WARM_POOL_SIZE <= 0:
-        logger.debug("[POOL] WARM_POOL_SIZE=0, pool disabled")
+    global _requested
+    if WARM_POOL_MAX <= 0:
+        logger.debug("[POOL] WARM_POOL_MAX=0, pool disabled")
+        return
+
+    with _cond:
+        if _manager is None:
+            logger.debug("[POOL] No pool manager in this process, leaving replenishment to the leader")
+            return
+        _requested = True
+        _cond.notify()
+
+
+def record_demand(kind: str) -> None:
+    """Count one client arrival that needed a container ("pool" or "created")."""
+    global _window_count
+    with _cond:
+        _roll_window()
+        _window_count += 1
+        _progress["pool_hits" if kind == "pool" else "cold_creates"] += 1
+
+
+def _roll_window() -> None:
+    """Fold finished windows into the EWMA rate. Must be called with _cond held."""
+    global _rate, _window_start, _window_count
+    elapsed = int((time.monotonic() - _window_start) // WARM_POOL_RATE_WINDOW_SECONDS)
+    if elapsed <= 0:
         return
+    _rate = WARM_POOL_RATE_ALPHA * _window_count / WARM_POOL_RATE_WINDOW_SECONDS + (1 - WARM_POOL_RATE_ALPHA) * _rate
+    # Windows with no arrivals at all only decay the rate
+    _rate *= (1 - WARM_POOL_RATE_ALPHA) ** (elapsed - 1)
+    _window_start += elapsed * WARM_POOL_RATE_WINDOW_SECONDS
+    _window_count = 0
 
-    t = threading.Thread(target=_fill_pool, daemon=True)
-    t.start()
+
+def _target_size() -> int:
+    """Pool size needed to absorb the arrivals expected while a container boots.
+
+    The current (unfinished) window also counts, so a burst raises the
+    target right away instead of one window later. Must be called with _cond held.
+    """
+    if WARM_POOL_MAX <= WARM_POOL_MIN:
+        return WARM_POOL_MIN
+    _roll_window()
+    rate = max(_rate, _window_count / WARM_POOL_RATE_WINDOW_SECONDS)
+    _progress["arrival_rate_per_min"] = round(rate * 60, 2)
+    desired = math.ceil(rate * containers.expected_boot_seconds() * WARM_POOL_HEADROOM)
+    return max(WARM_POOL_MIN, min(WARM_POOL_MAX, desired))
+
+
+def get_progress() -> dict:
+    """Return a snapshot of the pool fill progress."""
+    with _cond:
+        return dict(_progress)
+
+
+def _manager_loop() -> None:
+    global _requested
+    while True:
+        with _cond:
+            if not _requested:
+                _cond.wait(timeout=WARM_POOL_CHECK_SECONDS)
+            _requested = False
+        try:
+            _fill_pool()
+        except Exception as e:
+            logger.exception("[POOL] Replenishment pass failed: %s", e)
 
 
 def _fill_pool() -> None:
-    """Create pool containers until we reach WARM_POOL_SIZE (if ports available)."""
+    """Bring each node's pool to its target: submit creations, or drain the surplus.
+
+    Containers already booting count towards the target, so overlapping
+    passes never overshoot it. Nodes above the admission thresholds get no
+    new pool containers until their usage drops.
+    """
     current_pool = state.find_unassigned()
-    current_count = len(current_pool)
-    needed = WARM_POOL_SIZE - current_count
+    overloaded = {node.name: resource_monitor.overload_reason(node) for node in containers.NODES}
+    plan: list[tuple[nodes.Node, int]] = []
+    surplus: list[dict] = []
+    with _cond:
+        targets = _node_targets(_target_size())
+        for node in containers.NODES:
+            on_node = [rec for rec in current_pool if node.owns(rec["port"])]
+            booting = _booting.get(node.name, 0)
+            needed = targets[node.name] - len(on_node) - booting
+            if needed > 0 and overloaded[node.name]:
+                logger.info("[POOL] Node %s is overloaded (%s), not adding pool containers",
+                            node.name, overloaded[node.name])
+            elif needed > 0:
+                _booting[node.name] = booting + needed
+                plan.append((node, needed))
+            elif len(on_node) > targets[node.name]:
+                surplus.extend(on_node[:len(on_node) - targets[node.name]])
+        in_flight = sum(_booting.values())
+        _progress["target"] = sum(targets.values())
+        _progress["ready"] = len(current_pool)
+        _progress["in_flight"] = in_flight
+        if plan:
+            _progress["last_fill_at"] = datetime.now().isoformat()
+        metrics.POOL_TARGET.set(_progress["target"])
+        metrics.POOL_BOOTING.set(in_flight)
 
-    if needed <= 0:
-        logger.info("[POOL] Pool already full: %d/%d containers ready", current_count, WARM_POOL_SIZE)
+    if surplus:
+        _drain(surplus)
+
+    if not plan:
+        logger.debug("[POOL] Pool full or filling: ready=%d booting=%d target=%d",
+                     len(current_pool), in_flight, _progress["target"])
         return
 
-    logger.info("[POOL] Replenishing pool: current=%d target=%d need=%d",
-                current_count, WARM_POOL_SIZE, needed)
+    for node, needed in plan:
+        logger.info("[POOL] Replenishing pool on node %s: target=%d need=%d (ready=%d booting=%d overall)",
+                    node.name, targets[node.name], needed, len(current_pool), in_flight)
+        for _ in range(needed):
+            _executor.submit(_create_one, node)
 
-    created = 0
-    for _ in range(needed):
-        used = state.used_ports()
-        port = containers.allocate_port(used)
 
-        if port is None:
-            logger.warning("[POOL] No free ports available, stopping pool replenishment (created %d/%d)",
-                           created, needed)
-            break
+def _node_targets(target: int) -> dict[str, int]:
+    """Split the pool target across nodes.
 
-        try:
-            logger.info("[POOL] Creating pool container on port %d...", port)
-            info = containers.create_pool_container(port)
+    Nodes with a fixed "pool" size in DOCKER_NODES keep it; the target is
+    shared evenly by the others. Must be called with _cond held.
+    """
+    shared = [node for node in containers.NODES if node.pool_size is None]
+    targets = {node.name: node.pool_size for node in containers.NODES if node.pool_size is not None}
+    for i, node in enumerate(shared):
+        targets[node.name] = target // len(shared) + (1 if i < target % len(shared) else 0)
+    return targets
 
-            state.add_record(
-                client_id="__pool__",
-                container_id=info["container_id"],
-                container_name=info["container_name"],
-                port=info["port"],
-            )
 
-            created += 1
-            logger.info("[POOL] Pool container READY: name=%s port=%d (%d/%d)",
-                        info["container_name"], port, current_count + created, WARM_POOL_SIZE)
+def _drain(surplus: list[dict]) -> None:
+    """Remove idle pool containers above the target (oldest first)."""
+    logger.info("[POOL] Shrinking pool: removing %d idle pool containers", len(surplus))
+    for rec in surplus:
+        # Only succeeds if the container is still unclaimed
+        if state.remove_by_container(rec["container_id"], client_id="__pool__") is None:
+            continue
+        _executor.submit(containers.remove_container, rec["container_id"])
+        with _cond:
+            _progress["drained"] += 1
+            _progress["ready"] -= 1
 
-        except Exception as e:
-            logger.exception("[POOL] FAILED to create pool container on port %d: %s", port, e)
 
-    logger.info("[POOL] Replenishment done: created %d containers (pool: %d/%d)",
-                created, current_count + created, WARM_POOL_SIZE)
+@tracing.traced_job("pool.create")
+def _create_one(node: nodes.Node) -> None:
+    """Create a single pool container on node (runs on the bounded fill executor)."""
+    ok = False
+    info = None
+    port = containers.allocate_port(node)
+    try:
+        if port is None:
+            logger.warning("[POOL] No free ports available on node %s, skipping pool container", node.name)
+            return
+
+        logger.info("[POOL] Creating pool container on port %d...", port)
+        info = containers.create_pool_container(port)
+        if WARM_POOL_PAUSED:
+            containers.pause_container(info["container_id"])
+
+        state.add_record(
+            client_id="__pool__",
+            container_id=info["container_id"],
+            container_name=info["container_name"],
+            port=info["port"],
+        )
+        ok = True
+        logger.info("[POOL] Pool container READY: name=%s port=%d", info["container_name"], port)
+
+    except Exception as e:
+        logger.exception("[POOL] FAILED to create pool container on port %d: %s", port, e)
+        if info is not None:
+            # Created but not recorded (pause or state write failed): nothing else would remove it
+            containers.remove_container(info["container_id"])
+        state.release_port(port)
+
+    finally:
+        with _cond:
+            _booting[node.name] -= 1
+            _progress["in_flight"] -= 1
+            metrics.POOL_BOOTING.set(_progress["in_flight"])
+            if ok:
+                _progress["created"] += 1
+                _progress["ready"] += 1
+            elif port is not None:
+                _progress["failed"] += 1
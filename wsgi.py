@@ -1,8 +1,18 @@
 from app import app
+import services
 from services import reconcile_on_startup
+import proxy
+import resource_monitor
 import scheduler
+import state
 import warm_pool
 
-reconcile_on_startup()
-scheduler.start_scheduler()
-warm_pool.replenish_pool()
+# With several gunicorn workers only one of them runs the background jobs
+if state.try_become_leader():
+    reconcile_on_startup()
+    scheduler.start_scheduler()
+    resource_monitor.start()
+    warm_pool.start_pool_manager()
+    proxy.start()
+else:
+    services.check_single_worker(leader=False)